@@ -1,27 +1,54 @@
-from flask import Flask, request, jsonify
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.naive_bayes import MultinomialNB
-import numpy as np
+from flask import Flask, Response, request, jsonify, stream_with_context
+import hmac
 import json
+import logging
 import os
-import unicodedata
-import requests 
-import re
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-import nltk
-import cohere # Importation de Cohere
-import os # Pour la clé API Cohere
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv # Importation de load_dotenv
 
+# Rendre importable le paquet shared/ commun aux services
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from shared.text_normalization import normalize_string # Normalisation sans téléchargement NLTK
+from shared.metrics import REGISTRY as metrics, instrument_app
+from shared.profiling import install_profiling
+from urgency import UrgencyDetector
+import specialties
+from rag_client import CircuitBreaker, create_rag_client
+from llm import WhitespaceCleaner, create_backend
+from knowledge_base import KnowledgeBase, KnowledgeReloader
+from diagnosis_model import candidate_shares
+import batch
+from session_store import SessionRecord, create_session_store
+from llm_cache import LLM_CACHE_ENABLED, CachedBackend, LlmCache, bucket_confidence
+from doctor_index import DEFAULT_LIMIT as DEFAULT_DOCTORS_LIMIT, MAX_NEAREST, parse_coordinate, public_doctor
+
 load_dotenv()
 
+# Traces détaillées (symptômes, prompts, réponses du LLM) au niveau DEBUG : LOG_LEVEL=DEBUG pour les voir
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
-co = cohere.Client(os.environ.get("COHERE_API_KEY"))
+# Durée des requêtes par route et GET /metrics (format Prometheus)
+instrument_app(app)
+STAGE_SECONDS = metrics.histogram('diagnosis_stage_seconds', "Durée des étapes de /predict et /predict/batch.",
+                                  ('stage',))
+PREDICT_OUTCOMES = metrics.counter('diagnosis_predict_total', "Réponses de /predict par issue.", ('outcome',))
+
+# Modèle de langage (Cohere, ou réponse simulée avec LLM_BACKEND=fake),
+# précédé d'un cache persistant des réponses sauf si LLM_CACHE_ENABLED=0
+llm = create_backend()
+llm_cache = None
+if LLM_CACHE_ENABLED:
+    llm_cache = LlmCache()
+    llm = CachedBackend(llm, llm_cache)
 
 
-user_sessions = {}
+# Sessions de diagnostic : mémoire du processus (TTL/LRU) ou SQLite partagé entre workers
+session_store = create_session_store()
 
 # Questions de diagnostic dynamiques
 DYNAMIC_DIAGNOSTIC_QUESTIONS = [
@@ -32,300 +59,356 @@ DYNAMIC_DIAGNOSTIC_QUESTIONS = [
 ]
 
 
-try:
-    nltk.data.find('tokenizers/punkt')
-except nltk.downloader.DownloadError:
-    nltk.download('punkt', quiet=True)
-try:
-    nltk.data.find('corpora/stopwords')
-except nltk.downloader.DownloadError:
-    nltk.download('stopwords', quiet=True)
-
-stop_words = set(stopwords.words('french'))
-
-# Liste de symptômes graves pour la détection d'urgence
-URGENT_SYMPTOMS = [
-    "douleur thoracique intense", "difficulté à respirer sévère", "perte de conscience",
-    "engourdissement soudain", "faiblesse soudaine d'un côté du corps", "parole confuse",
-    "convulsions", "saignement incontrôlable", "fièvre très élevée avec confusion",
-    "raideur de la nuque avec fièvre", "vomissements persistants avec déshydratation",
-    "douleur abdominale aiguë et sévère", "réaction allergique sévère (gonflement, difficulté à respirer)"
-]
+# Lexique des symptômes graves (et de leurs synonymes) pour la détection d'urgence,
+# compilé une seule fois en automate multi-expressions
+urgency_detector = UrgencyDetector.from_file()
+URGENT_SYMPTOMS = urgency_detector.symptoms
+logger.info("Lexique d'urgence chargé : %d symptômes, %d expressions.", len(URGENT_SYMPTOMS), len(urgency_detector))
+
+# Client RAG : service HTTP (connexions persistantes, délais, disjoncteur) ou index en processus (RAG_MODE=local)
+rag_client = create_rag_client()
+
+# Pool borné pour paralléliser l'étape finale de /predict (RAG, médecins)
+fanout_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('PREDICT_FANOUT_WORKERS', 8)),
+                                     thread_name_prefix='predict-fanout')
+# Pool distinct pour l'enrichissement de /predict/batch : un lot ne retarde jamais les requêtes interactives
+batch_executor = ThreadPoolExecutor(max_workers=batch.BATCH_ENRICH_WORKERS, thread_name_prefix='batch-enrich')
+
+# Base de connaissances (maladies, modèle compilé, médecins) : un instantané
+# immuable, remplacé à chaud par le rechargeur (voir knowledge_base.py)
+knowledge_reloader = KnowledgeReloader(KnowledgeBase.load()[0])
+logger.info("Modèle de diagnostic (%s): %d classes, version %s.", knowledge_reloader.current.model_origin,
+            len(knowledge_reloader.current.model), knowledge_reloader.current.version)
+
+# Jeton attendu dans l'en-tête X-Admin-Token pour les routes d'administration
+ADMIN_TOKEN = os.environ.get('DIAGNOSIS_ADMIN_TOKEN')
+
+
+# Jauges lues à chaque GET /metrics
+metrics.gauge('diagnosis_sessions', "Sessions de diagnostic en cours.", lambda: session_store.stats()['sessions'])
+metrics.gauge('diagnosis_session_lookups', "Lectures de session de ce processus, par résultat.",
+              lambda: {'hit': session_store.stats()['hits'], 'miss': session_store.stats()['misses']}, ('result',))
+metrics.gauge('llm_cache_entries', "Réponses du LLM en cache.",
+              lambda: llm_cache.stats()['entries'] if llm_cache is not None else None)
+metrics.gauge('llm_cache_lookups', "Lectures du cache LLM de ce processus, par résultat.",
+              lambda: {'hit': llm_cache.hits, 'miss': llm_cache.misses} if llm_cache is not None else {}, ('result',))
+metrics.gauge('rag_circuit_state', "État du disjoncteur du service RAG (1 pour l'état courant).",
+              lambda: {state: int(state == rag_client.breaker.state)
+                       for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)}
+              if rag_client.breaker is not None else {}, ('state',))
+metrics.gauge('diagnosis_knowledge_reloads', "Rechargements de la base de connaissances dans ce processus.",
+              lambda: knowledge_reloader.reloads)
+
+
+def is_admin_request():
+    # Comparaison en temps constant, sur les octets (compare_digest refuse les chaînes non ASCII)
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(),
+                                                     ADMIN_TOKEN.encode())
+
+
+# Profilage à la demande (en-tête X-Profile des administrateurs) ou par tirage au sort (PROFILE_SAMPLE_RATE),
+# profils consultables par GET /admin/profiles (voir shared/profiling.py)
+profiler = install_profiling(app, is_admin_request, sample_paths=('/predict', '/predict/batch'))
+
+
+@app.before_request
+def start_background_tasks():
+    # Surveillance des fichiers, démarrée dans chaque worker après le fork
+    knowledge_reloader.ensure_started()
+
+
+# Fonction pour suggérer des médecins de la spécialité associée à la maladie :
+# les plus proches du patient si sa position est connue, sinon les mieux classés
+def get_suggested_doctors(disease_name, limit=DEFAULT_DOCTORS_LIMIT, location=None, knowledge=None):
+    with STAGE_SECONDS.time(stage='doctors'):
+        doctor_index = (knowledge or knowledge_reloader.current).doctor_index
+        specialty = specialties.specialty_for_disease(disease_name)
+        found_doctors = []
+        if location is not None:
+            found_doctors = doctor_index.nearest(location[0], location[1], specialty, limit)
+        if not found_doctors:
+            found_doctors = doctor_index.top(specialty, limit)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Médecins trouvés pour '%s' (%s): %s", disease_name, specialty,
+                     [doctor['name'] for doctor in found_doctors])
+    return [public_doctor(doctor) for doctor in found_doctors]
+
+
+def rag_lookup(query):
+    """Résumé RAG pour le prompt (voir HttpRagClient.lookup), durée comprise dans les métriques."""
+    with STAGE_SECONDS.time(stage='rag'):
+        return rag_client.lookup(query)
+
+
+def parse_location(values):
+    """(lat, lng) à partir d'un dictionnaire de paramètres, None si absent ; ValueError si invalide."""
+    if not hasattr(values, 'get'):
+        raise ValueError("La position doit être de la forme {\"lat\": ..., \"lng\": ...}.")
+    if values.get('lat') is None and values.get('lng') is None:
+        return None
+    lat = parse_coordinate(values.get('lat'), 90.0)
+    lng = parse_coordinate(values.get('lng'), 180.0)
+    if lat is None or lng is None:
+        raise ValueError("Les paramètres 'lat' (entre -90 et 90) et 'lng' (entre -180 et 180) sont requis.")
+    return lat, lng
+
+
+@app.route('/doctors/nearest', methods=['GET'])
+def nearest_doctors():
+    try:
+        location = parse_location(request.args)
+        if location is None:
+            raise ValueError("Les paramètres 'lat' et 'lng' sont requis.")
+        k = int(request.args.get('k', DEFAULT_DOCTORS_LIMIT))
+        radius = request.args.get('radius')
+        radius = float(radius) if radius is not None else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if radius is not None and not radius > 0:
+        return jsonify({"error": "Le paramètre 'radius' (en km) doit être positif."}), 400
+    if not 1 <= k <= MAX_NEAREST:
+        return jsonify({"error": f"Le paramètre 'k' doit être compris entre 1 et {MAX_NEAREST}."}), 400
+
+    specialty = request.args.get('specialty') or None
+    doctors = knowledge_reloader.current.doctor_index.nearest(location[0], location[1], specialty, k, radius)
+    return jsonify({"doctors": [public_doctor(doctor) for doctor in doctors]})
+
+def wants_event_stream(data):
+    """Réponse en flux SSE si le client la demande ("stream": true ou Accept: text/event-stream)."""
+    return data.get('stream') is True or 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def event_stream_response(events):
+    """Diffuse les événements (nom, contenu) en SSE puis un événement 'done' avec le message complet.
+
+    Les événements 'message' portent chacun un morceau du texte : {"text": ...}.
+    """
+    def generate():
+        parts = []
+        for event, payload in events:
+            if event == 'message':
+                parts.append(payload)
+                payload = {"text": payload}
+            yield sse_event(event, payload)
+        yield sse_event('done', {"message": "".join(parts)})
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def collect_events(events):
+    """Réponse JSON non streamée, assemblée à partir des mêmes événements."""
+    response = {}
+    parts = []
+    for event, payload in events:
+        if event == 'message':
+            parts.append(payload)
+        else:
+            response.update(payload)
+    response["message"] = "".join(parts)
+    return response
 
-RAG_SERVICE_URL = "http://127.0.0.1:5002/rag" # URL du service RAG
-
-# Charger la base de connaissances à partir du fichier JSON
-try:
-    json_file_path = os.path.join(os.path.dirname(__file__), 'diseases_symptoms.json')
-    with open(json_file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    symptoms_db = data.get('diseases', {})
-    all_symptoms = data.get('symptoms', [])
-except FileNotFoundError:
-    print("Erreur: Le fichier diseases_symptoms.json n'a pas été trouvé.")
-    symptoms_db = {}
-    all_symptoms = []
-except json.JSONDecodeError:
-    print("Erreur: Impossible de décoder diseases_symptoms.json. Vérifiez le format JSON.")
-    symptoms_db = {}
-    all_symptoms = []
-
-# Charger les données des médecins
-doctors_data = []
-try:
-    doctors_file_path = os.path.join(os.path.dirname(__file__), 'doctors.json')
-    with open(doctors_file_path, 'r', encoding='utf-8') as f:
-        doctors_data = json.load(f)
-except FileNotFoundError:
-    print("Erreur: Le fichier doctors.json n'a pas été trouvé.")
-except json.JSONDecodeError:
-    print("Erreur: Impossible de décoder doctors.json. Vérifiez le format JSON.")
-
-if not symptoms_db:
-    print("Avertissement: La base de données des maladies est vide. Le modèle ne sera pas entraîné.")
-    # Fallback à une base de connaissances minimale si le chargement échoue
-    symptoms_db = {
-        "Rhume": ["éternuements", "nez qui coule", "mal de gorge", "toux"],
-        "Grippe": ["fièvre", "frissons", "douleurs musculaires", "fatigue", "maux de tête"]
-    }
-    all_symptoms = list(set([symptom for symptoms in symptoms_db.values() for symptom in symptoms]))
-
-print(f"Base de données des maladies chargée: {len(symptoms_db)} maladies.")
-print(f"Exemple de maladies: {list(symptoms_db.keys())[:5]}")
-
-# Préparation des données pour le modèle
-X_train_text = [" ".join(s) for s in symptoms_db.values()]
-y_train_labels = list(symptoms_db.keys())
-
-print(f"Textes d'entraînement: {len(X_train_text)} entrées.")
-print(f"Exemple de textes d'entraînement (top 10): {X_train_text[:10]}")
-print(f"Labels d'entraînement: {len(y_train_labels)} labels.")
-print(f"Exemple de labels d'entraînement (top 10): {y_train_labels[:10]}")
-
-# Création et entraînement du modèle
-vectorizer = TfidfVectorizer()
-if X_train_text:
-    X_train = vectorizer.fit_transform(X_train_text)
-    model = MultinomialNB()
-    model.fit(X_train, y_train_labels)
-    print(f"Modèle entraîné avec {len(model.classes_)} classes.")
-    print(f"Classes du modèle: {model.classes_[:5]}")
-    print(f"Taille du vocabulaire du vectorizer: {len(vectorizer.vocabulary_)}")
-    print(f"Exemple de vocabulaire du vectorizer (top 10): {list(vectorizer.vocabulary_.items())[:10]}")
-else:
-    print("Avertissement: Pas de données d'entraînement pour le modèle.")
-    model = None # Le modèle ne sera pas entraîné si X_train_text est vide
-
-# Fonction pour suggérer des médecins
-def get_suggested_doctors(disease_name):
-    suggestions = []
-    
-    # Cartographie des maladies vers les spécialités
-    disease_to_specialty_map = {
-        "Hypertensive disease": "Cardiologue",
-        "Coronary arteriosclerosis": "Cardiologue",
-        "Coronary heart disease": "Cardiologue",
-        "Myocardial infarction": "Cardiologue",
-        "Cardiomyopathy": "Cardiologue",
-        "Tricuspid valve insufficiency": "Cardiologue",
-        "Stenosis aortic valve": "Cardiologue",
-        "Failure heart congestive": "Cardiologue",
-        "Failure heart": "Cardiologue",
-        "Tachycardia sinus": "Cardiologue",
-
-        "Diabetes": "Endocrinologue",
-        "Hyperglycemia": "Endocrinologue",
-        "Ketoacidosis diabetic": "Endocrinologue",
-
-        "Depression mental": "Psychiatre",
-        "Depressive disorder": "Psychiatre",
-        "Anxiety state": "Psychiatre",
-        "Psychotic disorder": "Psychiatre",
-        "Bipolar disorder": "Psychiatre",
-        "Schizophrenia": "Psychiatre",
-        "Personality disorder": "Psychiatre",
-        "Delusion": "Psychiatre",
-        "Affect labile": "Psychiatre",
-        "Manic disorder": "Psychiatre",
-        "Suicide attempt": "Psychiatre",
-        "Dependence": "Psychiatre",
-        "Chronic alcoholic intoxication": "Psychiatre",
-
-        "Pneumonia": "Pneumologue",
-        "Asthma": "Pneumologue",
-        "Bronchitis": "Pneumologue",
-        "Respiratory failure": "Pneumologue",
-        "Emphysema pulmonary": "Pneumologue",
-        "Pneumothorax": "Pneumologue",
-        "Upper respiratory infection": "Pneumologue",
-        "Spasm bronchial": "Pneumologue",
-        "Pneumocystis\u00a0carinii\u00a0pneumonia": "Pneumologue",
-        "Pneumonia aspiration": "Pneumologue",
-        "Hypertension pulmonary": "Pneumologue",
-
-        "Infection urinary tract": "Néphrologue",
-        "Insufficiency renal": "Néphrologue",
-        "Chronic kidney failure": "Néphrologue",
-        "Kidney failure acute": "Néphrologue",
-        "Kidney disease": "Néphrologue",
-        "Pyelonephritis": "Néphrologue",
-        "Benign prostatic hypertrophy": "Urologue",
-        "Malignant neoplasm of prostate": "Urologue",
-        "Carcinoma prostate": "Urologue",
-
-        "Gastroesophageal reflux disease": "Gastro-entérologue",
-        "Hepatitis c": "Gastro-entérologue",
-        "Cirrhosis": "Gastro-entérologue",
-        "Pancreatitis": "Gastro-entérologue",
-        "Cholecystitis": "Gastro-entérologue",
-        "Cholelithiasis": "Gastro-entérologue",
-        "Biliary calculus": "Gastro-entérologue",
-        "Ileus": "Gastro-entérologue",
-        "Hernia": "Gastro-entérologue",
-        "Ulcer peptic": "Gastro-entérologue",
-        "Diverticulitis": "Gastro-entérologue",
-        "Diverticulosis": "Gastro-entérologue",
-        "Gastritis": "Gastro-entérologue",
-        "Gastroenteritis": "Gastro-entérologue",
-        "Primary carcinoma of the liver cells": "Gastro-entérologue",
-        "Hemorrhoids": "Gastro-entérologue",
-        "Hernia\u00a0hiatal": "Gastro-entérologue",
-        "Colitis": "Gastro-entérologue",
-        "Hepatitis b": "Gastro-entérologue",
-        "Hepatitis": "Gastro-entérologue",
-        "Malignant tumor of colon": "Gastro-entérologue",
-        "Carcinoma colon": "Gastro-entérologue",
-
-        "Accident\u00a0cerebrovascular": "Neurologue",
-        "Dementia": "Neurologue",
-        "Epilepsy": "Neurologue",
-        "Hemiparesis": "Neurologue",
-        "Transient ischemic attack": "Neurologue",
-        "Paranoia": "Neurologue",
-        "Parkinson disease": "Neurologue",
-        "Encephalopathy": "Neurologue",
-        "Alzheimer's disease": "Neurologue",
-        "Neuropathy": "Neurologue",
-        "Migraine disorders": "Neurologue",
-        "Tonic-clonic epilepsy": "Neurologue",
-        "Tonic-clonic seizures": "Neurologue",
-        "Delirium": "Neurologue",
-        "Aphasia": "Neurologue",
-        "Confusion": "Neurologue",
-
-        "Malignant neoplasms": "Oncologue",
-        "Primary malignant neoplasm": "Oncologue",
-        "Carcinoma": "Oncologue",
-        "Malignant neoplasm of breast": "Oncologue",
-        "Carcinoma breast": "Oncologue",
-        "Malignant neoplasm of lung": "Oncologue",
-        "Carcinoma of lung": "Oncologue",
-        "Neoplasm": "Oncologue",
-        "Neoplasm metastasis": "Oncologue",
-        "Lymphatic diseases": "Oncologue",
-        "Lymphoma": "Oncologue",
-        "Melanoma": "Oncologue",
-        "Malignant\u00a0neoplasms": "Oncologue",
-
-        "Arthritis": "Rhumatologue",
-        "Osteoporosis": "Rhumatologue",
-        "Degenerative\u00a0polyarthritis": "Rhumatologue",
-        "Gout": "Rhumatologue",
-
-        "Cellulitis": "Dermatologue",
-        "Exanthema": "Dermatologue",
-        "Candidiasis": "Dermatologue",
-        "Oralcandidiasis": "Dermatologue",
-
-        "Anemia": "Hématologue",
-        "Thrombocytopaenia": "Hématologue",
-        "Pancytopenia": "Hématologue",
-        "Neutropenia": "Hématologue",
-        "Sickle cell anemia": "Hématologue",
-
-        "Allergie": "Allergologue",
-
-        "Angine": "ORL",
-
-        "Rhume": "Généraliste",
-        "Grippe": "Généraliste",
-        "COVID-19": "Généraliste",
-        "Infection": "Généraliste",
-        "Septicemia": "Généraliste",
-        "Systemic infection": "Généraliste",
-        "Sepsis (invertebrate)": "Généraliste",
-        "Bacteremia": "Généraliste",
-        "Influenza": "Généraliste",
-        "Dehydration": "Généraliste",
-        "Hypoglycemia": "Généraliste",
-        "Overload fluid": "Généraliste",
-        "Obesity": "Généraliste",
-        "Obesity morbid": "Généraliste",
-        "Hypercholesterolemia": "Généraliste",
-        "Hyperlipidemia": "Généraliste",
-        "Ischemia": "Généraliste",
-        "Peripheral vascular disease": "Généraliste",
-        "Deep vein thrombosis": "Généraliste",
-        "Thrombus": "Généraliste",
-        "Decubitus ulcer": "Généraliste",
-        "Incontinence": "Généraliste",
-        "Paroxysmal\u00a0dyspnea": "Généraliste",
-        "Deglutition disorder": "Généraliste"
-    }
 
-    specialty = disease_to_specialty_map.get(disease_name, "Généraliste")
-    normalized_specialty = normalize_string(specialty)
-    print(f"Pour la maladie '{disease_name}', la spécialité déterminée est: '{specialty}' (normalisée: '{normalized_specialty}')")
-    
-    found_doctors_names = []
-    for doctor in doctors_data:
-        normalized_doctor_specialty = normalize_string(doctor['specialty'])
-        print(f"Comparaison: Médecin spécialité '{normalized_doctor_specialty}' avec spécialité cible '{normalized_specialty}'")
-        if normalized_doctor_specialty == normalized_specialty:
-            found_doctors_names.append(doctor['name'])
-    print(f"Médecins trouvés pour '{specialty}': {found_doctors_names}")
-    return found_doctors_names
+def llm_text(prompt, max_tokens, stream, fallback_message, context):
+    """Texte du LLM, complet ou morceau par morceau.
+
+    Si l'appel échoue avant le premier morceau, `fallback_message` est renvoyé à
+    la place ; une erreur en cours de flux arrête le texte là où il en est.
+    """
+    emitted = False
+    try:
+        if stream:
+            # En flux, la durée comprend l'envoi des morceaux au client
+            with STAGE_SECONDS.time(stage='llm'):
+                for chunk in llm.stream(prompt, temperature=0.7, max_tokens=max_tokens):
+                    emitted = True
+                    yield chunk
+        else:
+            with STAGE_SECONDS.time(stage='llm'):
+                text = llm.chat(prompt, temperature=0.7, max_tokens=max_tokens)
+            yield text
+    except Exception as e:
+        logger.warning("Erreur lors de l'appel à Cohere pour %s: %s", context, e)
+        if not emitted:
+            yield fallback_message
 
 @app.route('/cohere_chat', methods=['POST'])
 def cohere_chat():
     user_message = request.json.get('message')
     if not user_message:
         return jsonify({"error": "No message provided"}), 400
-    
+
+    logger.debug("Prompt Cohere pour /cohere_chat: %s", user_message)
+    if wants_event_stream(request.json):
+        def events():
+            try:
+                for chunk in llm.stream(user_message, temperature=0.7, max_tokens=1000):
+                    yield 'message', chunk
+            except Exception as e:
+                logger.warning("Erreur lors de l'appel à Cohere pour /cohere_chat: %s", e)
+                yield 'error', {"error": str(e)}
+        return event_stream_response(events())
+
     try:
-        print(f"Prompt Cohere pour /cohere_chat: {user_message}")
-        response = co.chat(
-            message=user_message,
-            model="command-r-plus", # Ou un autre modèle Cohere approprié
-            temperature=0.7,
-            max_tokens=1000 # Augmenter le nombre de tokens
-        )
-        print(f"Réponse brute de Cohere pour /cohere_chat: {response.text}")
-        return jsonify({"message": response.text}) # Changer 'response' en 'message' pour correspondre à ChatResponse
+        response_text = llm.chat(user_message, temperature=0.7, max_tokens=1000) # Augmenter le nombre de tokens
+        logger.debug("Réponse brute de Cohere pour /cohere_chat: %s", response_text)
+        return jsonify({"message": response_text}) # Changer 'response' en 'message' pour correspondre à ChatResponse
     except Exception as e:
-        print(f"Erreur lors de l'appel à Cohere pour /cohere_chat: {e}")
+        logger.warning("Erreur lors de l'appel à Cohere pour /cohere_chat: %s", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Vivacité : le processus répond
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Disponibilité : modèle entraîné, médecins et lexique d'urgence chargés
+    knowledge = knowledge_reloader.current
+    checks = {
+        "model": knowledge.model is not None,
+        "doctors": len(knowledge.doctor_index) > 0,
+        "urgency_lexicon": len(urgency_detector) > 0,
+    }
+    ready = all(checks.values())
+    return jsonify({"status": "ready" if ready else "not_ready", "checks": checks,
+                    "model_version": knowledge.version, "rag_mode": rag_client.mode,
+                    "rag_circuit": rag_client.breaker.state if rag_client.breaker is not None else None}), 200 if ready else 503
+
+def shutdown():
+    """Arrêt propre d'un worker : termine les appels RAG en cours et les rechargements, puis libère les pools."""
+    knowledge_reloader.shutdown()
+    fanout_executor.shutdown(wait=True)
+    batch_executor.shutdown(wait=True)
+    rag_client.shutdown()
+
+@app.route('/admin/reload', methods=['GET', 'POST'])
+def reload_knowledge():
+    # POST : planifie le rechargement des fichiers modifiés et répond sans l'attendre ;
+    # GET : version active et résultat du dernier rechargement
+    if not is_admin_request():
+        return jsonify({"error": "Accès réservé à l'administration."}), 403
+    if request.method == 'POST':
+        knowledge_reloader.request_reload('admin')
+        return jsonify(knowledge_reloader.stats()), 202
+    return jsonify(knowledge_reloader.stats())
+
+@app.route('/sessions/stats', methods=['GET'])
+def session_stats():
+    return jsonify(session_store.stats())
+
+@app.route('/llm/cache', methods=['GET'])
+def llm_cache_stats():
+    if llm_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(llm_cache.stats(), enabled=True))
+
+def fallback_answer_events(all_symptoms_text, rag_future, stream, model_version, matched_symptoms):
+    """Réponse finale quand aucune maladie ne dépasse le seuil de confiance."""
+    yield 'diagnoses', {"diagnoses": [], "matched_symptoms": matched_symptoms, "model_version": model_version,
+                        "requires_more_info": False}
+
+    rag_info_fallback = rag_future.result()
+    logger.debug("Information RAG (fallback) pour '%s': %s", all_symptoms_text, rag_info_fallback)
+
+    prompt_cohere = f"L'utilisateur décrit les symptômes suivants : '{all_symptoms_text}'. Le système de diagnostic n'a pas pu identifier de maladie spécifique."
+    if rag_info_fallback:
+        prompt_cohere += f" Cependant, j'ai trouvé des informations qui pourraient vous éclairer : {rag_info_fallback}."
+
+    specialty_suggestion = "un médecin généraliste"
+    prompt_cohere += f" Il est recommandé de consulter {specialty_suggestion} pour une évaluation approfondie."
+    prompt_cohere += " En tant qu'assistant médical, veuillez fournir une réponse empathique et rappeler l'importance de consulter un professionnel de la santé. La réponse doit être en français."
+
+    fallback_message = "Bonjour ! Je suis là pour vous aider. D'après ce que vous me décrivez, il est difficile de poser un diagnostic précis pour le moment, et je n'ai pas trouvé d'informations spécifiques dans ma base de connaissances. Il est vraiment important de consulter un médecin ou un professionnel de la santé dès que possible pour obtenir un diagnostic précis et des conseils adaptés à votre situation."
+    for chunk in llm_text(prompt_cohere, 400, stream, fallback_message, "fallback"):
+        yield 'message', chunk
+
+
+def recommended_specialty(disease_name, suggested_doctors):
+    if not suggested_doctors:
+        return "un médecin généraliste"
+    return specialties.specialty_label(specialties.specialty_for_disease(disease_name))
+
+
+def describe_confidence(confidence, candidate_count):
+    """Confiance de la maladie principale : sa part (en %) de la probabilité des pistes retenues (voir candidate_shares)."""
+    if candidate_count <= 1:
+        return "seule piste retenue"
+    return f"{confidence:.0f}% de la probabilité des {candidate_count} pistes retenues"
+
+
+def build_final_prompt(disease_name, confidence, rag_info, specialty_for_disease, candidate_count=1):
+    """Prompt de la réponse finale ; la confiance y est arrondie par tranches (cache LLM)."""
+    prompt_confidence = describe_confidence(bucket_confidence(confidence), candidate_count)
+    prompt_cohere_final = f"En tant qu'assistant médical, reformulez le message suivant de manière plus naturelle et empathique, en insistant sur l'importance de la consultation médicale et en offrant des conseils généraux de bien-être. Le diagnostic principal est : **{disease_name}** ({prompt_confidence}). "
+    if rag_info:
+        prompt_cohere_final += f"Informations supplémentaires du RAG : {rag_info}. "
+    prompt_cohere_final += f"Il est **fortement recommandé de consulter {specialty_for_disease}** pour une évaluation et un diagnostic précis. La réponse doit être en français."
+    return prompt_cohere_final
+
+
+def final_answer_events(diagnoses, rag_future, doctors_future, stream, model_version, matched_symptoms):
+    """Réponse finale : diagnostics et médecins d'abord, puis le texte du LLM nettoyé au fil de l'eau."""
+    top_diagnosis = diagnoses[0]
+    disease_name = top_diagnosis['disease']
+    confidence = top_diagnosis['relative_confidence'] * 100
+
+    suggested_doctors = doctors_future.result()
+    specialty_for_disease = recommended_specialty(disease_name, suggested_doctors)
+
+    yield 'diagnoses', {"diagnoses": diagnoses, "suggested_doctors": suggested_doctors,
+                        "matched_symptoms": matched_symptoms, "model_version": model_version,
+                        "requires_more_info": False}
+
+    rag_info = rag_future.result()
+    logger.debug("Information RAG pour '%s': %s", disease_name, rag_info)
+
+    prompt_cohere_final = build_final_prompt(disease_name, confidence, rag_info, specialty_for_disease, len(diagnoses))
+    logger.debug("Prompt Cohere pour /predict (final): %s", prompt_cohere_final)
+
+    fallback_message = f"Bonjour ! Je suis là pour vous aider. D'après les symptômes que vous avez décrits, il semblerait que nous puissions envisager une piste principale : **{disease_name}** ({describe_confidence(confidence, len(diagnoses))})."
+    if rag_info:
+        fallback_message += f"\n\nPour vous donner plus de contexte, voici quelques informations sur cette condition : {rag_info}."
+    fallback_message += "\n\nIl est crucial de comprendre que ces informations sont des indications basées sur notre base de connaissances et ne remplacent en aucun cas un diagnostic médical formel. Seul un professionnel de la santé qualifié, après un examen approfondi, pourra établir un diagnostic précis."
+    fallback_message += f"\n\n**Nous vous recommandons de consulter {specialty_for_disease}** pour une évaluation plus approfondie."
+    fallback_message += "\n\nEn attendant votre consultation, je vous conseille de bien vous hydrater, de vous reposer et d'éviter tout effort physique intense. Prenez soin de vous."
+    fallback_message += "\n\nN'hésitez pas si vous avez d'autres questions d'ordre général, je suis là pour y répondre. Cependant, pour toute préoccupation concernant votre santé, l'avis médical professionnel reste la priorité absolue."
+
+    # Même nettoyage des espaces que sur le texte complet, appliqué morceau par morceau
+    cleaner = WhitespaceCleaner()
+    response_parts = []
+    for chunk in llm_text(prompt_cohere_final, 1000, stream, fallback_message, "la réponse finale"):
+        cleaned = cleaner.feed(chunk)
+        if cleaned:
+            response_parts.append(cleaned)
+            yield 'message', cleaned
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Réponse Cohere pour /predict (final): %s", ''.join(response_parts))
+
 @app.route('/predict', methods=['POST'])
 def predict():
     data = request.get_json()
     user_symptoms_input = data.get('symptoms', [])
     session_id = data.get('session_id', 'default_session') # Utiliser un ID de session
+    stream = wants_event_stream(data) # Seule la réponse finale est diffusée en flux SSE
+    try:
+        # Position facultative du patient ({"lat": ..., "lng": ...}) pour suggérer les médecins les plus proches
+        patient_location = parse_location(data.get('location') or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    if session_id not in user_sessions:
-        user_sessions[session_id] = {
-            'symptoms_collected': [],
-            'diagnostic_step': 0,
-            'last_question': ''
-        }
-
-    session_state = user_sessions[session_id]
+    # Une session n'est enregistrée qu'à partir des premiers symptômes
+    session_state = session_store.get(session_id) or SessionRecord()
 
     if not user_symptoms_input:
         # Si c'est le début d'une nouvelle session ou si l'utilisateur n'a rien fourni
-        if session_state['diagnostic_step'] == 0:
+        if session_state.diagnostic_step == 0:
             initial_message = "Bonjour ! Je suis votre assistant médical en ligne. Je suis là pour vous aider à mieux comprendre vos symptômes et vous orienter vers les prochaines étapes. Cela ne remplace pas un avis médical. " + DYNAMIC_DIAGNOSTIC_QUESTIONS[0]
-            session_state['last_question'] = initial_message
             return jsonify({
                 "message": initial_message,
                 "requires_more_info": True,
@@ -334,203 +417,160 @@ def predict():
         else:
             return jsonify({"error": "No symptoms provided for current step"}), 400
 
-    # Ajouter les symptômes de l'utilisateur à la liste collectée
-    session_state['symptoms_collected'].extend(user_symptoms_input)
-    all_symptoms_text = " ".join([normalize_string(s) for s in session_state['symptoms_collected']])
-    print(f"Symptômes collectés pour la session {session_id}: {session_state['symptoms_collected']}")
-
-    # Détection des symptômes d'urgence (à chaque étape pour ne rien manquer)
-    is_urgent = False
-    for urgent_symptom in URGENT_SYMPTOMS:
-        if normalize_string(urgent_symptom) in all_symptoms_text:
-            is_urgent = True
-            break
+    # Ajouter les symptômes de l'utilisateur au texte collecté ; seuls les nouveaux sont normalisés
+    with STAGE_SECONDS.time(stage='normalization'):
+        new_symptoms_normalized = [normalize_string(s) for s in user_symptoms_input]
+    session_state.add_symptoms(new_symptoms_normalized)
+    all_symptoms_text = session_state.symptoms_text
+    logger.debug("Symptômes collectés pour la session %s: %s", session_id, all_symptoms_text)
+
+    # Détection des symptômes d'urgence (à chaque étape pour ne rien manquer) :
+    # seuls les nouveaux mots sont analysés, l'état de l'automate est conservé
+    urgent_matches = []
+    with STAGE_SECONDS.time(stage='urgency'):
+        for text in new_symptoms_normalized:
+            matches, session_state.urgency_state, session_state.urgency_offset = urgency_detector.scan(
+                text, session_state.urgency_state, session_state.urgency_offset)
+            urgent_matches.extend(matches)
+    is_urgent = bool(urgent_matches)
 
     if is_urgent:
+        urgent_symptoms = urgency_detector.describe(urgent_matches)
+        logger.info("Symptômes d'urgence détectés pour la session %s: %s", session_id, urgent_symptoms)
+        PREDICT_OUTCOMES.inc(outcome='urgent')
         # Réinitialiser la session après une alerte d'urgence
-        user_sessions.pop(session_id, None)
+        session_store.delete(session_id)
         emergency_message = {
             "message": "🚨 **URGENCE MÉDICALE** 🚨\n\n"
                        "Les symptômes que vous décrivez sont **potentiellement graves** et nécessitent une **attention médicale immédiate**.\n\n"
                        "**Veuillez consulter un professionnel de la santé sans délai.**\n\n"
                        "Cet assistant ne peut pas remplacer un avis médical d'urgence. Votre sécurité est notre priorité absolue.",
+            "urgent_symptoms": urgent_symptoms,
             "requires_more_info": False
         }
         return jsonify(emergency_message), 200
 
     # Passer à l'étape suivante du diagnostic
-    session_state['diagnostic_step'] += 1
+    session_state.diagnostic_step += 1
 
-    if session_state['diagnostic_step'] < len(DYNAMIC_DIAGNOSTIC_QUESTIONS):
+    if session_state.diagnostic_step < len(DYNAMIC_DIAGNOSTIC_QUESTIONS):
         # Poser la prochaine question
-        session_state['last_question'] = DYNAMIC_DIAGNOSTIC_QUESTIONS[session_state['diagnostic_step']]
+        session_store.save(session_id, session_state)
+        PREDICT_OUTCOMES.inc(outcome='question')
+        next_question = DYNAMIC_DIAGNOSTIC_QUESTIONS[session_state.diagnostic_step]
         return jsonify({
-            "message": session_state['last_question'],
+            "message": next_question,
             "requires_more_info": True,
-            "next_question": session_state['last_question']
+            "next_question": next_question
         }), 200
     else:
         # Toutes les questions ont été posées, procéder au diagnostic final
-        print(f"Diagnostic final pour la session {session_id} avec symptômes: {all_symptoms_text}")
+        logger.debug("Diagnostic final pour la session %s avec symptômes: %s", session_id, all_symptoms_text)
 
-        X_user = vectorizer.transform([all_symptoms_text])
-        print(f"X_user (forme): {X_user.shape}")
+        # Instantané de la base lu une seule fois : un rechargement pendant la réponse ne la modifie pas
+        knowledge = knowledge_reloader.current
+        model = knowledge.model
 
         # Prédiction des probabilités
         if model is None:
-            user_sessions.pop(session_id, None)
+            session_store.delete(session_id)
             return jsonify({"error": "Le modèle n'a pas été entraîné.", "requires_more_info": False}), 500
-        
-        probabilities = model.predict_proba(X_user)[0]
-        print(f"Probabilités de prédiction (top 5): {np.argsort(probabilities)[::-1][:5]} -> {[model.classes_[i] for i in np.argsort(probabilities)[::-1][:5]]} avec probabilités {[round(probabilities[i], 4) for i in np.argsort(probabilities)[::-1][:5]]}")
-        print(f"Classes du modèle: {model.classes_}")
-        
+
+        # Symptômes du vocabulaire contrôlé reconnus dans le texte : le modèle score ce vecteur
+        # binaire, ou le TF-IDF du texte si aucun symptôme n'est reconnu
+        symptom_extractor = knowledge.symptom_extractor
+        with STAGE_SECONDS.time(stage='vectorization'):
+            symptom_matches = symptom_extractor.extract(all_symptoms_text)
+            symptom_ids = symptom_extractor.symptom_ids(symptom_matches)
+        matched_symptoms = symptom_extractor.describe(symptom_matches)
+        logger.debug("Symptômes reconnus pour la session %s: %s", session_id, matched_symptoms)
+        with STAGE_SECONDS.time(stage='scoring'):
+            probabilities = model.predict_proba(all_symptoms_text, symptom_ids)
+            # Classes proches de la plus probable (voir DEFAULT_THRESHOLD), déjà triées
+            candidates = model.top_classes(probabilities)
+            shares = candidate_shares(probabilities, candidates)
+
+        # La maladie principale est connue dès maintenant (probabilité la plus haute).
+        # Le service RAG et la suggestion de médecins sont lancés en parallèle pendant
+        # la construction des diagnostics ; sans diagnostic, RAG reçoit les symptômes.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Probabilités de prédiction (top 5): %s",
+                         [(str(model.classes[i]), round(float(probabilities[i]), 4)) for i in candidates[:5]])
+        if candidates.size:
+            top_disease = str(model.classes[candidates[0]])
+            rag_future = fanout_executor.submit(rag_lookup, top_disease)
+            doctors_future = fanout_executor.submit(get_suggested_doctors, top_disease, location=patient_location,
+                                                    knowledge=knowledge)
+        else:
+            rag_future = fanout_executor.submit(rag_lookup, all_symptoms_text)
+
         # Association des probabilités aux maladies
         diagnoses = []
-        for i, disease in enumerate(model.classes_):
-            confidence = probabilities[i]
-            if confidence > 0.01: # Seuil de confiance ajusté à 0.01
-                associated_symptoms = symptoms_db.get(disease, [])
-                diagnoses.append({"disease": disease, "confidence": round(confidence, 2), "associated_symptoms": associated_symptoms})
-                
-        # Tri par confiance
-        diagnoses = sorted(diagnoses, key=lambda d: d['confidence'], reverse=True)
-        print(f"Diagnostics finaux: {diagnoses}")
+        for i, share in zip(candidates, shares):
+            disease = str(model.classes[i])
+            associated_symptoms = knowledge.symptoms_db.get(disease, [])
+            diagnoses.append({"disease": disease, "confidence": round(probabilities[i], 2),
+                              "relative_confidence": round(float(share), 2), "associated_symptoms": associated_symptoms})
+        logger.debug("Diagnostics finaux: %s", diagnoses)
         
-        # Construction de la réponse améliorée avec RAG
-        if not diagnoses:
-            rag_info_fallback = ""
-            try:
-                rag_response_fallback = requests.post(RAG_SERVICE_URL, json={"query": all_symptoms_text})
-                if rag_response_fallback.status_code == 200:
-                    rag_data_fallback = rag_response_fallback.json()
-                    if "response" in rag_data_fallback and rag_data_fallback["response"] == "Je n'ai pas trouvé d'informations pertinentes pour votre requête dans ma base de connaissances.":
-                        rag_info_fallback = ""
-                    else:
-                        rag_info_fallback = f"Classe: {rag_data_fallback.get('classe', 'N/A')}, Bloc: {rag_data_fallback.get('bloc', 'N/A')}, Chapitre: {rag_data_fallback.get('chapitre', 'N/A')}."
-                    print(f"Information RAG (fallback) pour '{all_symptoms_text}': {rag_info_fallback}")
-                else:
-                    print(f"Erreur lors de l'appel au service RAG (fallback): {rag_response_fallback.status_code} - {rag_response_fallback.text}")
-            except requests.exceptions.RequestException as e:
-                print(f"Impossible de se connecter au service RAG (fallback): {e}")
+        session_store.delete(session_id) # Réinitialiser la session après le diagnostic final
 
-            try:
-                prompt_cohere = f"L'utilisateur décrit les symptômes suivants : '{all_symptoms_text}'. Le système de diagnostic n'a pas pu identifier de maladie spécifique."
-                if rag_info_fallback:
-                    prompt_cohere += f" Cependant, j'ai trouvé des informations qui pourraient vous éclairer : {rag_info_fallback}."
-                
-                specialty_suggestion = "un médecin généraliste"
-                prompt_cohere += f" Il est recommandé de consulter {specialty_suggestion} pour une évaluation approfondie."
-                prompt_cohere += " En tant qu'assistant médical, veuillez fournir une réponse empathique et rappeler l'importance de consulter un professionnel de la santé. La réponse doit être en français."
-                
-                cohere_response = co.chat(
-                    message=prompt_cohere,
-                    model="command-r-plus",
-                    temperature=0.7,
-                    max_tokens=400
-                )
-                response_message = cohere_response.text
-            except Exception as e:
-                print(f"Erreur lors de l'appel à Cohere pour fallback: {e}")
-                response_message = "Bonjour ! Je suis là pour vous aider. D'après ce que vous me décrivez, il est difficile de poser un diagnostic précis pour le moment, et je n'ai pas trouvé d'informations spécifiques dans ma base de connaissances. Il est vraiment important de consulter un médecin ou un professionnel de la santé dès que possible pour obtenir un diagnostic précis et des conseils adaptés à votre situation."
-            
-            user_sessions.pop(session_id, None) # Réinitialiser la session
-            return jsonify({"message": response_message, "diagnoses": [], "requires_more_info": False})
-
-        top_diagnosis = diagnoses[0]
-        disease_name = top_diagnosis['disease']
-        confidence = top_diagnosis['confidence'] * 100
-
-        rag_info = ""
-        try:
-            rag_response = requests.post(RAG_SERVICE_URL, json={"query": disease_name})
-            if rag_response.status_code == 200:
-                rag_data = rag_response.json()
-                if "response" in rag_data and rag_data["response"] == "Je n'ai pas trouvé d'informations pertinentes pour votre requête dans ma base de connaissances.":
-                    rag_info = ""
-                else:
-                    rag_info = f"Classe: {rag_data.get('classe', 'N/A')}, Bloc: {rag_data.get('bloc', 'N/A')}, Chapitre: {rag_data.get('chapitre', 'N/A')}."
-                print(f"Information RAG pour '{disease_name}': {rag_info}")
-            else:
-                print(f"Erreur lors de l'appel au service RAG: {rag_response.status_code} - {rag_response.text}")
-        except requests.exceptions.RequestException as e:
-            print(f"Impossible de se connecter au service RAG: {e}")
-
-        suggested_doctors_names = get_suggested_doctors(disease_name)
-        specialty_for_disease = "un médecin généraliste"
-        if suggested_doctors_names:
-            disease_to_specialty_map = {
-                "Hypertensive disease": "Cardiologue", "Coronary arteriosclerosis": "Cardiologue", "Coronary heart disease": "Cardiologue", "Myocardial infarction": "Cardiologue", "Cardiomyopathy": "Cardiologue", "Tricuspid valve insufficiency": "Cardiologue", "Stenosis aortic valve": "Cardiologue", "Failure heart congestive": "Cardiologue", "Failure heart": "Cardiologue", "Tachycardia sinus": "Cardiologue",
-                "Diabetes": "Endocrinologue", "Hyperglycemia": "Endocrinologue", "Ketoacidosis diabetic": "Endocrinologue",
-                "Depression mental": "Psychiatre", "Depressive disorder": "Psychiatre", "Anxiety state": "Psychiatre", "Psychotic disorder": "Psychiatre", "Bipolar disorder": "Psychiatre", "Schizophrenia": "Psychiatre", "Personality disorder": "Psychiatre", "Delusion": "Psychiatre", "Affect labile": "Psychiatre", "Manic disorder": "Psychiatre", "Suicide attempt": "Psychiatre", "Dependence": "Psychiatre", "Chronic alcoholic intoxication": "Psychiatre",
-                "Pneumonia": "Pneumologue", "Asthma": "Pneumologue", "Bronchitis": "Pneumologue", "Respiratory failure": "Pneumologue", "Emphysema pulmonary": "Pneumologue", "Pneumothorax": "Pneumologue", "Upper respiratory infection": "Pneumologue", "Spasm bronchial": "Pneumologue", "Pneumocystis\u00a0carinii\u00a0pneumonia": "Pneumologue", "Pneumonia aspiration": "Pneumologue", "Hypertension pulmonary": "Pneumologue",
-                "Infection urinary tract": "Néphrologue", "Insufficiency renal": "Néphrologue", "Chronic kidney failure": "Néphrologue", "Kidney failure acute": "Néphrologue", "Kidney disease": "Néphrologue", "Pyelonephritis": "Néphrologue", "Benign prostatic hypertrophy": "Urologue", "Malignant neoplasm of prostate": "Urologue", "Carcinoma prostate": "Urologue",
-                "Gastroesophageal reflux disease": "Gastro-entérologue", "Hepatitis c": "Gastro-entérologue", "Cirrhosis": "Gastro-entérologue", "Pancreatitis": "Gastro-entérologue", "Cholecystitis": "Gastro-entérologue", "Cholelithiasis": "Gastro-entérologue", "Biliary calculus": "Gastro-entérologue", "Ileus": "Gastro-entérologue", "Hernia": "Gastro-entérologue", "Ulcer peptic": "Gastro-entérologue", "Diverticulitis": "Gastro-entérologue", "Diverticulosis": "Gastro-entérologue", "Gastritis": "Gastro-entérologue", "Gastroenteritis": "Gastro-entérologue", "Primary carcinoma of the liver cells": "Gastro-entérologue", "Hemorrhoids": "Gastro-entérologue", "Hernia\u00a0hiatal": "Gastro-entérologue", "Colitis": "Gastro-entérologue", "Hepatitis b": "Gastro-entérologue", "Hepatitis": "Gastro-entérologue", "Malignant tumor of colon": "Gastro-entérologue", "Carcinoma colon": "Gastro-entérologue",
-                "Accident\u00a0cerebrovascular": "Neurologue", "Dementia": "Neurologue", "Epilepsy": "Neurologue", "Hemiparesis": "Neurologue", "Transient ischemic attack": "Neurologue", "Paranoia": "Neurologue", "Parkinson disease": "Neurologue", "Encephalopathy": "Neurologue", "Alzheimer's disease": "Neurologue", "Neuropathy": "Neurologue", "Migraine disorders": "Neurologue", "Tonic-clonic epilepsy": "Neurologue", "Tonic-clonic seizures": "Neurologue", "Delirium": "Neurologue", "Aphasia": "Neurologue", "Confusion": "Neurologue",
-                "Malignant neoplasms": "Oncologue", "Primary malignant neoplasm": "Oncologue", "Carcinoma": "Oncologue", "Malignant neoplasm of breast": "Oncologue", "Carcinoma breast": "Oncologue", "Malignant neoplasm of lung": "Oncologue", "Carcinoma of lung": "Oncologue", "Neoplasm": "Oncologue", "Neoplasm metastasis": "Oncologue", "Lymphatic diseases": "Oncologue", "Lymphoma": "Oncologue", "Melanoma": "Oncologue", "Malignant\u00a0neoplasms": "Oncologue",
-                "Arthritis": "Rhumatologue", "Osteoporosis": "Rhumatologue", "Degenerative\u00a0polyarthritis": "Rhumatologue", "Gout": "Rhumatologue",
-                "Cellulitis": "Dermatologue", "Exanthema": "Dermatologue", "Candidiasis": "Dermatologue", "Oralcandidiasis": "Dermatologue",
-                "Anemia": "Hématologue", "Thrombocytopaenia": "Hématologue", "Pancytopenia": "Hématologue", "Neutropenia": "Hématologue", "Sickle cell anemia": "Hématologue",
-                "Allergie": "Allergologue",
-                "Angine": "ORL",
-                "Rhume": "Généraliste", "Grippe": "Généraliste", "COVID-19": "Généraliste", "Infection": "Généraliste", "Septicemia": "Généraliste", "Systemic infection": "Généraliste", "Sepsis (invertebrate)": "Généraliste", "Bacteremia": "Généraliste", "Influenza": "Généraliste", "Dehydration": "Généraliste", "Hypoglycemia": "Généraliste", "Overload fluid": "Généraliste", "Obesity": "Généraliste", "Obesity morbid": "Généraliste", "Hypercholesterolemia": "Généraliste", "Hyperlipidemia": "Généraliste", "Ischemia": "Généraliste", "Peripheral vascular disease": "Généraliste", "Deep vein thrombosis": "Généraliste", "Thrombus": "Généraliste", "Decubitus ulcer": "Généraliste", "Incontinence": "Généraliste", "Paroxysmal\u00a0dyspnea": "Généraliste", "Deglutition disorder": "Généraliste"
-            }
-            specialty_for_disease = disease_to_specialty_map.get(disease_name, "un médecin généraliste")
-            specialty_for_disease = f"un {specialty_for_disease}" if specialty_for_disease != "Généraliste" else "un médecin généraliste"
-
-        try:
-            prompt_cohere_final = f"En tant qu'assistant médical, reformulez le message suivant de manière plus naturelle et empathique, en insistant sur l'importance de la consultation médicale et en offrant des conseils généraux de bien-être. Le diagnostic principal est : **{disease_name}** (avec une probabilité de {confidence:.0f}%). "
-            if rag_info:
-                prompt_cohere_final += f"Informations supplémentaires du RAG : {rag_info}. "
-            prompt_cohere_final += f"Il est **fortement recommandé de consulter {specialty_for_disease}** pour une évaluation et un diagnostic précis. La réponse doit être en français."
-            
-            cohere_final_response = co.chat(
-                message=prompt_cohere_final,
-                model="command-r-plus",
-                temperature=0.7,
-                max_tokens=1000
-            )
-            response_message = cohere_final_response.text
-            response_message = re.sub(r'\n\s*\n', '\n\n', response_message).strip()
-            response_message = re.sub(r' {2,}', ' ', response_message)
-            print(f"Prompt Cohere pour /predict (final): {prompt_cohere_final}")
-            print(f"Réponse Cohere pour /predict (final): {response_message}")
-        except Exception as e:
-            print(f"Erreur lors de l'appel à Cohere pour la réponse finale: {e}")
-            response_message = f"Bonjour ! Je suis là pour vous aider. D'après les symptômes que vous avez décrits, il semblerait que nous puissions envisager une piste principale : **{disease_name}** (avec une probabilité de {confidence:.0f}%)."
-            if rag_info:
-                response_message += f"\n\nPour vous donner plus de contexte, voici quelques informations sur cette condition : {rag_info}."
-            response_message += "\n\nIl est crucial de comprendre que ces informations sont des indications basées sur notre base de connaissances et ne remplacent en aucun cas un diagnostic médical formel. Seul un professionnel de la santé qualifié, après un examen approfondi, pourra établir un diagnostic précis."
-            response_message += f"\n\n**Nous vous recommandons de consulter {specialty_for_disease}** pour une évaluation plus approfondie."
-            response_message += "\n\nEn attendant votre consultation, je vous conseille de bien vous hydrater, de vous reposer et d'éviter tout effort physique intense. Prenez soin de vous."
-            response_message += "\n\nN'hésitez pas si vous avez d'autres questions d'ordre général, je suis là pour y répondre. Cependant, pour toute préoccupation concernant votre santé, l'avis médical professionnel reste la priorité absolue."
-            response_message = re.sub(r'\n\s*\n', '\n\n', response_message).strip()
-            response_message = re.sub(r' {2,}', ' ', response_message)
-            print(f"Réponse Cohere pour /predict (fallback): {response_message}")
-
-        user_sessions.pop(session_id, None) # Réinitialiser la session après le diagnostic final
-        return jsonify({"message": response_message, "diagnoses": diagnoses, "requires_more_info": False})
-
-# Fonction utilitaire pour normaliser les chaînes
-def normalize_string(text):
-    text = ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn') # Supprimer les accents
-    text = text.lower()
-    text = re.sub(r'\W', ' ', text) # Supprimer la ponctuation
-    tokens = word_tokenize(text, language='french')
-    tokens = [word for word in tokens if word.isalpha() and word not in stop_words]
-    return ' '.join(tokens)
-
-if __name__ == '__main__':
-    app.run(debug=True, port=5001)
-
-# Fonction utilitaire pour normaliser les chaînes
-def normalize_string(text):
-    text = ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn') # Supprimer les accents
-    text = text.lower()
-    text = re.sub(r'\W', ' ', text) # Supprimer la ponctuation
-    tokens = word_tokenize(text, language='french')
-    tokens = [word for word in tokens if word.isalpha() and word not in stop_words]
-    return ' '.join(tokens)
+        # Construction de la réponse améliorée avec RAG : en flux SSE, les diagnostics
+        # partent tout de suite et le texte du LLM suit au fil de sa génération
+        PREDICT_OUTCOMES.inc(outcome='diagnosis' if diagnoses else 'fallback')
+        if not diagnoses:
+            events = fallback_answer_events(all_symptoms_text, rag_future, stream, knowledge.version, matched_symptoms)
+        else:
+            events = final_answer_events(diagnoses, rag_future, doctors_future, stream, knowledge.version,
+                                         matched_symptoms)
+        if stream:
+            return event_stream_response(events)
+        return jsonify(collect_events(events))
+
+def enrich_batch_result(result, with_rag, with_llm, knowledge=None):
+    """Complète un résultat de /predict/batch avec l'extrait RAG et/ou le texte du LLM pour la maladie principale."""
+    if not result.get('diagnoses'):
+        return result
+    top_diagnosis = result['diagnoses'][0]
+    disease_name = top_diagnosis['disease']
+    rag_info = rag_lookup(disease_name) if with_rag else ""
+    if with_rag:
+        result['rag'] = rag_info
+    if with_llm:
+        specialty_for_disease = recommended_specialty(disease_name, get_suggested_doctors(disease_name, knowledge=knowledge))
+        prompt = build_final_prompt(disease_name, top_diagnosis['relative_confidence'] * 100, rag_info,
+                                    specialty_for_disease, len(result['diagnoses']))
+        text = "".join(llm_text(prompt, 1000, False, "", f"/predict/batch ({disease_name})"))
+        result['message'] = WhitespaceCleaner.clean(text) or None
+    return result
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """Diagnostic sans session de nombreux jeux de symptômes, en JSON Lines (voir batch.py).
+
+    Paramètres : k (diagnostics par ligne), rag=1 et llm=1 pour enrichir la
+    maladie principale (désactivés par défaut).
+    """
+    try:
+        k = int(request.args.get('k', batch.DEFAULT_TOP_K))
+    except ValueError:
+        return jsonify({"error": "Le paramètre 'k' doit être un entier."}), 400
+    if not 1 <= k <= batch.MAX_TOP_K:
+        return jsonify({"error": f"Le paramètre 'k' doit être compris entre 1 et {batch.MAX_TOP_K}."}), 400
+    with_rag = request.args.get('rag') == '1'
+    with_llm = request.args.get('llm') == '1'
+
+    # Tout le lot est scoré avec la même version de la base
+    knowledge = knowledge_reloader.current
+    enrich = None
+    if with_rag or with_llm:
+        enrich = lambda result: enrich_batch_result(result, with_rag, with_llm, knowledge)
+    # Le corps est lu ligne à ligne pendant que les résultats partent : ni l'entrée ni la sortie n'est gardée en mémoire
+    results = batch.iter_results(request.stream, knowledge.model, urgency_detector, k=k, enrich=enrich,
+                                 executor=batch_executor, model_version=knowledge.version,
+                                 symptom_extractor=knowledge.symptom_extractor)
+    return Response(stream_with_context(batch.to_jsonl(results)), mimetype='application/x-ndjson')
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
+    # Serveur de développement ; en production : gunicorn -c gunicorn.conf.py app:app
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', port=5001)
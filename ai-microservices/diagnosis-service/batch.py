@@ -0,0 +1,141 @@
+"""Diagnostic par lots, sans session, au format JSON Lines.
+
+Chaque ligne d'entrée est un objet {"id": ..., "symptoms": [...]} (l'id est
+facultatif ; "symptoms" peut aussi être une chaîne). Chaque ligne de sortie
+reprend l'id et donne au plus k diagnostics, les plus probables, avec leur
+spécialité, les symptômes reconnus, les symptômes d'urgence détectés et la
+version du modèle. Une ligne invalide produit {"line": n, "error": ...} sans
+interrompre le lot.
+
+Les lignes sont traitées par paquets de BATCH_CHUNK_SIZE : chaque paquet est
+normalisé et vectorisé en une matrice, puis scoré en un seul appel à
+predict_proba_many. La mémoire reste bornée quelle que soit la taille du fichier.
+
+L'enrichissement (RAG, LLM) passe par un pool réservé aux lots, jamais par celui
+de /predict : au plus BATCH_ENRICH_WORKERS appels sont en cours par lot, les
+suivants ne sont soumis qu'au fil des résultats rendus.
+"""
+import json
+import os
+from collections import deque
+
+from shared.text_normalization import normalize_string
+import specialties
+from diagnosis_model import DEFAULT_THRESHOLD, candidate_shares
+
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 256))
+BATCH_ENRICH_WORKERS = int(os.environ.get('BATCH_ENRICH_WORKERS', 4))
+DEFAULT_TOP_K = 3
+MAX_TOP_K = 20
+
+
+def parse_item(line):
+    """(id, symptômes) d'une ligne JSON ; ValueError si elle est invalide."""
+    try:
+        item = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON invalide : {e.msg}") from None
+    if not isinstance(item, dict):
+        raise ValueError("Chaque ligne doit être un objet JSON.")
+    symptoms = item.get('symptoms')
+    if isinstance(symptoms, str):
+        symptoms = [symptoms]
+    if not isinstance(symptoms, list) or not symptoms or not all(isinstance(s, str) for s in symptoms):
+        raise ValueError("Le champ 'symptoms' doit être une liste non vide de chaînes.")
+    return item.get('id'), symptoms
+
+
+def score_chunk(items, model, urgency_detector, k=DEFAULT_TOP_K, threshold=DEFAULT_THRESHOLD, model_version=None,
+                symptom_extractor=None):
+    """Résultats d'un paquet de (numéro de ligne, id, symptômes), scorés en une seule matrice.
+
+    Avec symptom_extractor, chaque ligne est scorée sur ses symptômes reconnus (TF-IDF du texte sinon).
+    """
+    normalized = [[normalize_string(s) for s in symptoms] for _, _, symptoms in items]
+    texts = [" ".join(symptoms) for symptoms in normalized]
+    symptom_matches = [symptom_extractor.extract(text) for text in texts] if symptom_extractor is not None else None
+    symptom_ids = [symptom_extractor.symptom_ids(matches) for matches in symptom_matches] if symptom_matches else None
+    probabilities = model.predict_proba_many(texts, symptom_ids)
+    results = []
+    for position, ((line_number, item_id, _), symptoms, row) in enumerate(zip(items, normalized, probabilities)):
+        urgent_matches = []
+        state = offset = 0
+        for text in symptoms:
+            matches, state, offset = urgency_detector.scan(text, state, offset)
+            urgent_matches.extend(matches)
+        diagnoses = []
+        candidates = model.top_classes(row, k=k, threshold=threshold)
+        for i, share in zip(candidates, candidate_shares(row, candidates)):
+            disease = str(model.classes[i])
+            diagnoses.append({"disease": disease, "confidence": round(float(row[i]), 2),
+                              "relative_confidence": round(float(share), 2),
+                              "specialty": specialties.specialty_for_disease(disease)})
+        result = {"line": line_number, "id": item_id, "diagnoses": diagnoses}
+        if symptom_matches is not None:
+            result["matched_symptoms"] = symptom_extractor.names(symptom_matches[position])
+        result.update(urgent=bool(urgent_matches), urgent_symptoms=urgency_detector.describe(urgent_matches))
+        if model_version is not None:
+            result["model_version"] = model_version
+        results.append(result)
+    return results
+
+
+def iter_results(lines, model, urgency_detector, k=DEFAULT_TOP_K, threshold=DEFAULT_THRESHOLD,
+                 enrich=None, executor=None, chunk_size=BATCH_CHUNK_SIZE, model_version=None, symptom_extractor=None):
+    """Résultats ligne à ligne, dans l'ordre d'entrée ; les lignes vides sont ignorées.
+
+    `enrich(result)` complète chaque résultat (RAG, texte du LLM), en parallèle
+    sur `executor` s'il est fourni (voir map_bounded).
+    """
+    def flush(chunk):
+        results = score_chunk(chunk, model, urgency_detector, k, threshold, model_version,
+                              symptom_extractor) if chunk else []
+        if enrich is not None:
+            results = map_bounded(executor, enrich, results) if executor is not None else map(enrich, results)
+        return results
+
+    chunk = []
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        if not line.strip():
+            continue
+        try:
+            item_id, symptoms = parse_item(line)
+        except ValueError as e:
+            # Les résultats valides qui précèdent sortent d'abord, pour garder l'ordre
+            yield from flush(chunk)
+            chunk = []
+            yield {"line": line_number, "error": str(e)}
+            continue
+        chunk.append((line_number, item_id, symptoms))
+        if len(chunk) >= chunk_size:
+            yield from flush(chunk)
+            chunk = []
+    yield from flush(chunk)
+
+
+def map_bounded(executor, function, items, max_in_flight=BATCH_ENRICH_WORKERS):
+    """Comme executor.map, dans l'ordre, mais avec au plus max_in_flight tâches soumises à la fois.
+
+    executor.map soumettrait tout le paquet d'un coup et remplirait la file du pool pour
+    toute la durée du paquet.
+    """
+    items = iter(items)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Client déconnecté : les tâches pas encore commencées ne sont pas exécutées
+        for future in pending:
+            future.cancel()
+
+
+def to_jsonl(results):
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + "\n"
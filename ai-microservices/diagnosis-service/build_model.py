@@ -0,0 +1,100 @@
+"""Compile hors ligne le modèle de diagnostic en bundle NumPy.
+
+Usage :
+    python build_model.py [--output FICHIER] [--verify N]
+
+Le service charge ensuite ce bundle au démarrage au lieu de réentraîner
+TfidfVectorizer et les MultinomialNB, et n'importe pas scikit-learn. Avec
+--verify, les probabilités du bundle sont comparées à celles de scikit-learn
+sur les maladies d'entraînement, N combinaisons aléatoires de leurs mots et N
+combinaisons aléatoires de symptômes.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from diagnosis_model import DIAGNOSIS_MODEL_PATH, DiagnosisModel, symptom_matrix, training_data
+
+DISEASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diseases_symptoms.json')
+
+
+def verify(model, symptoms_db, count, seed=0):
+    """Requêtes vérifiées et celles dont les probabilités diffèrent de celles de scikit-learn."""
+    from scipy import sparse
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+
+    texts, labels = training_data(symptoms_db)
+    vectorizer = TfidfVectorizer()
+    reference = MultinomialNB().fit(vectorizer.fit_transform(texts), labels)
+
+    rng = random.Random(seed)
+    words = " ".join(texts).split()
+    queries = texts + [" ".join(rng.choice(words) for _ in range(rng.randint(1, 30))) for _ in range(count)]
+    expected = reference.predict_proba(vectorizer.transform(queries))
+    mismatches = [query for query, row in zip(queries, expected) if not np.array_equal(model.predict_proba(query), row)]
+
+    # Symptômes : le vecteur binaire de chaque maladie, puis des sous-ensembles aléatoires
+    matrix = symptom_matrix(symptoms_db, model.symptoms)
+    symptom_reference = MultinomialNB().fit(matrix, labels)
+    symptom_queries = [np.flatnonzero(row).tolist() for row in matrix if row.any()]
+    symptom_queries += [sorted(rng.sample(range(len(model.symptoms)), rng.randint(1, 10))) for _ in range(count)]
+    features = np.zeros((len(symptom_queries), len(model.symptoms)))
+    for row, ids in enumerate(symptom_queries):
+        features[row, ids] = 1.0
+    # Matrice creuse : scikit-learn accumule alors les symptômes dans l'ordre des colonnes, comme le bundle
+    expected = symptom_reference.predict_proba(sparse.csr_matrix(features))
+    mismatches += [[model.symptoms[i] for i in ids] for ids, row in zip(symptom_queries, expected)
+                   if not np.array_equal(model.predict_proba("", ids), row)]
+
+    # La maladie principale (premier candidat) doit être l'argmax des probabilités
+    mismatches += [query for query in queries if not _top_is_argmax(model, model.predict_proba(query))]
+    mismatches += [[model.symptoms[i] for i in ids] for ids in symptom_queries
+                   if not _top_is_argmax(model, model.predict_proba("", ids))]
+    return queries + symptom_queries, mismatches
+
+
+def _top_is_argmax(model, probabilities):
+    candidates = model.top_classes(probabilities)
+    return not candidates.size or candidates[0] == np.argmax(probabilities)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile le modèle de diagnostic en bundle NumPy.")
+    parser.add_argument('--output', default=DIAGNOSIS_MODEL_PATH, help="Fichier .npz du bundle")
+    parser.add_argument('--verify', type=int, default=0, metavar='N',
+                        help="Compare les probabilités à scikit-learn sur N textes aléatoires en plus "
+                             "des textes d'entraînement")
+    args = parser.parse_args()
+
+    with open(DISEASES_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    symptoms_db = data.get('diseases', {})
+    if not symptoms_db:
+        raise SystemExit("diseases_symptoms.json ne contient aucune maladie.")
+
+    start = time.perf_counter()
+    model = DiagnosisModel.train(symptoms_db, data.get('symptoms', []))
+    model.save(args.output)
+    elapsed = time.perf_counter() - start
+    print(f"Modèle écrit dans {args.output} : {len(model)} classes, {len(model.terms)} termes, "
+          f"{len(model.symptoms)} symptômes, "
+          f"{os.path.getsize(args.output) / 1024:.0f} Kio ({elapsed:.1f} s).")
+
+    if args.verify:
+        queries, mismatches = verify(DiagnosisModel.load(args.output), symptoms_db, args.verify)
+        print(f"Vérification : {len(queries) - len(mismatches)}/{len(queries)} distributions identiques "
+              f"et classements cohérents.")
+        if mismatches:
+            for query in mismatches[:10]:
+                print(f"  Probabilités ou classement différents pour : {query!r}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
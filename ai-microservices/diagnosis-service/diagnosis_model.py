@@ -0,0 +1,331 @@
+"""Modèle de diagnostic compilé : Bayes naïf multinomial en NumPy seul.
+
+Deux jeux de caractéristiques partagent les mêmes classes et log-priors :
+
+- les symptômes du vocabulaire contrôlé (diseases_symptoms.json), reconnus
+  dans le texte par SymptomExtractor : chaque maladie est un vecteur binaire
+  sur ces symptômes, et une requête n'est qu'une liste d'identifiants ;
+- le TF-IDF des mots du texte, utilisé quand aucun symptôme n'est reconnu.
+
+Le modèle est entraîné une fois avec scikit-learn (build_model.py, ou au
+démarrage si le bundle est absent ou périmé) puis exporté dans un fichier .npz :
+vocabulaire, idf, symptômes, log-probabilités par classe, log-priors et
+libellés. Le service ne fait ensuite que sommer quelques lignes de
+log-probabilités et un log-sum-exp par requête, sans importer scikit-learn.
+
+Les calculs reprennent ceux de TfidfVectorizer (paramètres par défaut) et de
+MultinomialNB.predict_proba, dans le même ordre d'opérations : les
+probabilités sont identiques à celles du modèle scikit-learn.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FORMAT_VERSION = 2
+
+DIAGNOSIS_MODEL_PATH = os.environ.get('DIAGNOSIS_MODEL_PATH', os.path.join(SERVICE_DIR, 'model', 'diagnosis_model.npz'))
+
+# token_pattern par défaut de TfidfVectorizer
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+# Diagnostics retournés par /predict. Sur 150 maladies, les probabilités a posteriori du
+# modèle sur symptômes sont plates (1 à 5 % pour la première) : le seuil absolu, une fois
+# et demie le hasard, n'écarte que les classes sans rapport. Seules les classes d'au moins
+# RELATIVE_THRESHOLD fois la probabilité de la première sont gardées, DEFAULT_TOP_K au plus.
+DEFAULT_THRESHOLD = 0.01
+RELATIVE_THRESHOLD = 0.5
+DEFAULT_TOP_K = 5
+
+
+class ModelBundleError(Exception):
+    pass
+
+
+def training_data(symptoms_db):
+    """Textes et libellés d'entraînement : une entrée par maladie, symptômes joints par des espaces."""
+    return [" ".join(s) for s in symptoms_db.values()], list(symptoms_db.keys())
+
+
+def symptom_vocabulary(symptoms_db, all_symptoms=()):
+    """Symptômes du modèle : la liste contrôlée, puis ceux des maladies qui n'y figurent pas."""
+    symptoms = []
+    seen = set()
+    for symptom in [*all_symptoms, *(s for disease_symptoms in symptoms_db.values() for s in disease_symptoms)]:
+        if symptom and symptom not in seen:
+            seen.add(symptom)
+            symptoms.append(symptom)
+    return symptoms
+
+
+def symptom_matrix(symptoms_db, symptoms):
+    """Matrice binaire maladies × symptômes, lignes dans l'ordre de symptoms_db."""
+    ids = {symptom: symptom_id for symptom_id, symptom in enumerate(symptoms)}
+    matrix = np.zeros((len(symptoms_db), len(symptoms)), dtype=np.float64)
+    for row, disease_symptoms in enumerate(symptoms_db.values()):
+        matrix[row, [ids[s] for s in disease_symptoms if s in ids]] = 1.0
+    return matrix
+
+
+def source_digest(symptoms_db, all_symptoms=()):
+    """Empreinte de la base des maladies et des symptômes, pour détecter un bundle périmé."""
+    payload = json.dumps({'diseases': symptoms_db, 'symptoms': list(all_symptoms)}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DiagnosisModel:
+
+    def __init__(self, terms, idf, feature_log_prob, symptoms, symptom_log_prob, class_log_prior, classes,
+                 manifest=None):
+        self.terms = terms
+        self.vocabulary = {term: column for column, term in enumerate(terms)}
+        self.idf = idf
+        # Termes × classes : la ligne d'un terme est contiguë, le produit ne lit que les termes de la requête
+        self.feature_log_prob = np.ascontiguousarray(feature_log_prob)
+        self.symptoms = symptoms
+        # Symptômes × classes, même disposition
+        self.symptom_log_prob = np.ascontiguousarray(symptom_log_prob)
+        self.class_log_prior = class_log_prior
+        self.classes = classes
+        self.manifest = manifest or {}
+
+    def __len__(self):
+        return len(self.classes)
+
+    @property
+    def source_sha256(self):
+        return self.manifest.get('source_sha256')
+
+    @classmethod
+    def train(cls, symptoms_db, all_symptoms=()):
+        """Entraîne les deux MultinomialNB (symptômes, TF-IDF) puis compile le résultat.
+
+        scikit-learn n'est importé qu'ici.
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+        import sklearn
+
+        texts, labels = training_data(symptoms_db)
+        vectorizer = TfidfVectorizer()
+        model = MultinomialNB()
+        model.fit(vectorizer.fit_transform(texts), labels)
+
+        symptoms = symptom_vocabulary(symptoms_db, all_symptoms)
+        symptom_model = MultinomialNB()
+        symptom_model.fit(symptom_matrix(symptoms_db, symptoms), labels)
+
+        terms = [None] * len(vectorizer.vocabulary_)
+        for term, column in vectorizer.vocabulary_.items():
+            terms[column] = term
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'source_sha256': source_digest(symptoms_db, all_symptoms),
+            'sklearn_version': sklearn.__version__,
+            'symptoms': len(symptoms),
+        }
+        # Mêmes libellés d'entraînement : classes et log-priors sont ceux des deux modèles
+        return cls(terms, np.asarray(vectorizer.idf_, dtype=np.float64), model.feature_log_prob_.T,
+                   symptoms, symptom_model.feature_log_prob_.T,
+                   model.class_log_prior_, np.asarray(model.classes_, dtype=str), manifest)
+
+    def save(self, path=DIAGNOSIS_MODEL_PATH):
+        """Écrit le bundle dans un fichier temporaire puis le renomme (remplacement atomique)."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}.npz"
+        np.savez(tmp_path,
+                 manifest=np.array(json.dumps(self.manifest)),
+                 terms=np.asarray(self.terms, dtype=str),
+                 idf=self.idf,
+                 feature_log_prob=self.feature_log_prob,
+                 symptoms=np.asarray(self.symptoms, dtype=str),
+                 symptom_log_prob=self.symptom_log_prob,
+                 class_log_prior=self.class_log_prior,
+                 classes=self.classes)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=DIAGNOSIS_MODEL_PATH):
+        with np.load(path, allow_pickle=False) as bundle:
+            manifest = json.loads(str(bundle['manifest']))
+            if manifest.get('format_version') != FORMAT_VERSION:
+                raise ModelBundleError(
+                    f"Version de format {manifest.get('format_version')} non supportée (attendue : {FORMAT_VERSION}). "
+                    f"Reconstruisez le modèle avec build_model.py."
+                )
+            return cls(bundle['terms'].tolist(), bundle['idf'], bundle['feature_log_prob'],
+                       bundle['symptoms'].tolist(), bundle['symptom_log_prob'],
+                       bundle['class_log_prior'], bundle['classes'], manifest)
+
+    def transform(self, text):
+        """Vecteur TF-IDF creux d'un texte : (colonnes triées, poids normalisés L2)."""
+        counts = {}
+        vocabulary = self.vocabulary
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            column = vocabulary.get(token)
+            if column is not None:
+                counts[column] = counts.get(column, 0) + 1
+        columns = np.fromiter(sorted(counts), dtype=np.intp, count=len(counts))
+        weights = np.fromiter((counts[c] for c in columns), dtype=np.float64, count=len(columns)) * self.idf[columns]
+        # Norme accumulée terme à terme, comme la normalisation creuse de scikit-learn
+        norm = 0.0
+        for weight in weights.tolist():
+            norm += weight * weight
+        if norm:
+            weights /= np.sqrt(norm)
+        return columns, weights
+
+    def transform_many(self, texts):
+        """Matrice TF-IDF creuse de plusieurs textes, au format CSR : (indptr, colonnes, poids)."""
+        rows = [self.transform(text) for text in texts]
+        indptr = np.zeros(len(rows) + 1, dtype=np.intp)
+        np.cumsum([len(columns) for columns, _ in rows], out=indptr[1:])
+        if not rows:
+            return indptr, np.empty(0, dtype=np.intp), np.empty(0)
+        return indptr, np.concatenate([columns for columns, _ in rows]), np.concatenate([weights for _, weights in rows])
+
+    @staticmethod
+    def symptom_features(symptom_ids):
+        """Vecteur binaire creux des symptômes reconnus : (identifiants triés, poids 1)."""
+        columns = np.unique(np.asarray(symptom_ids, dtype=np.intp))
+        return columns, np.ones(len(columns))
+
+    def symptom_features_many(self, symptom_ids):
+        """Matrice binaire creuse de plusieurs listes de symptômes, au format CSR : (indptr, colonnes, poids)."""
+        rows = [self.symptom_features(ids) for ids in symptom_ids]
+        indptr = np.zeros(len(rows) + 1, dtype=np.intp)
+        np.cumsum([len(columns) for columns, _ in rows], out=indptr[1:])
+        if not rows:
+            return indptr, np.empty(0, dtype=np.intp), np.empty(0)
+        return indptr, np.concatenate([columns for columns, _ in rows]), np.concatenate([weights for _, weights in rows])
+
+    def joint_log_likelihood(self, text, symptom_ids=None):
+        if symptom_ids:
+            (columns, weights), table = self.symptom_features(symptom_ids), self.symptom_log_prob
+        else:
+            (columns, weights), table = self.transform(text), self.feature_log_prob
+        jll = np.zeros(len(self.classes))
+        # Produit creux × dense : une ligne de log-probabilités par caractéristique présente, dans l'ordre des colonnes
+        for column, weight in zip(columns.tolist(), weights.tolist()):
+            jll += weight * table[column]
+        return jll + self.class_log_prior
+
+    def joint_log_likelihood_many(self, texts, symptom_ids=None):
+        """Une ligne par texte ; les textes dont symptom_ids[i] est non vide sont scorés sur leurs symptômes."""
+        if symptom_ids is None:
+            symptom_ids = [None] * len(texts)
+        jll = np.zeros((len(texts), len(self.classes)))
+        by_symptoms = np.array([bool(ids) for ids in symptom_ids], dtype=bool)
+        rows = np.flatnonzero(by_symptoms)
+        if len(rows):
+            jll[rows] = _accumulate(self.symptom_features_many([symptom_ids[i] for i in rows]),
+                                    self.symptom_log_prob)
+        rows = np.flatnonzero(~by_symptoms)
+        if len(rows):
+            jll[rows] = _accumulate(self.transform_many([texts[i] for i in rows]), self.feature_log_prob)
+        return jll + self.class_log_prior
+
+    def predict_proba_many(self, texts, symptom_ids=None):
+        """Probabilités de chaque classe (colonnes dans l'ordre de self.classes), une ligne par texte."""
+        return _normalize_log_likelihood(self.joint_log_likelihood_many(texts, symptom_ids))
+
+    def predict_proba(self, text, symptom_ids=None):
+        """Probabilités de chaque classe (dans l'ordre de self.classes) pour un texte.
+
+        Avec des symptômes reconnus, seuls ceux-ci sont scorés ; sinon, le TF-IDF du texte.
+        """
+        return _normalize_log_likelihood(self.joint_log_likelihood(text, symptom_ids)[None, :])[0]
+
+    def top_classes(self, probabilities, k=DEFAULT_TOP_K, threshold=DEFAULT_THRESHOLD, relative=RELATIVE_THRESHOLD):
+        """Indices des classes de probabilité > threshold et >= relative × la plus haute,
+        par probabilité décroissante ; avec k, seules les k premières sont retournées.
+
+        Le tri porte sur les probabilités exactes (l'arrondi n'intervient que dans les
+        réponses) : la première classe est toujours l'argmax. À égalité exacte, l'ordre
+        des classes est conservé. Au plus 1/threshold classes peuvent dépasser le seuil :
+        argpartition ne trie que celles-là.
+        """
+        limit = len(probabilities)
+        if threshold > 0:
+            limit = min(limit, int(1 / threshold))
+        if limit <= 0 or k == 0:
+            return np.empty(0, dtype=np.intp)
+        if limit < len(probabilities):
+            selected = np.argpartition(probabilities, -limit)[-limit:]
+        else:
+            selected = np.arange(len(probabilities))
+        floor = relative * probabilities[selected].max()
+        selected = np.sort(selected[(probabilities[selected] > threshold) & (probabilities[selected] >= floor)])
+        order = np.argsort(-probabilities[selected], kind='stable')
+        return selected[order[:k]]
+
+
+def candidate_shares(probabilities, candidates):
+    """Part de chaque candidat dans la probabilité de l'ensemble des candidats retenus.
+
+    C'est la confiance présentée au LLM : sur des probabilités plates, « 2 % » pour la
+    maladie principale n'apprend rien, sa part parmi les pistes retenues si.
+    """
+    retained = probabilities[candidates]
+    total = retained.sum()
+    return retained / total if total > 0 else retained
+
+
+def _accumulate(features, table):
+    """Produit creux (indptr, colonnes, poids) × table dense, une ligne de résultat par ligne creuse.
+
+    Contributions de toutes les caractéristiques en une opération, puis la p-ième de
+    chaque ligne est ajoutée à l'étape p. L'accumulation suit ainsi l'ordre des
+    colonnes, comme scikit-learn, tout en traitant toutes les lignes d'un coup.
+    """
+    indptr, columns, weights = features
+    lengths = np.diff(indptr)
+    jll = np.zeros((len(lengths), table.shape[1]))
+    contributions = weights[:, None] * table[columns]
+    for position in range(int(lengths.max(initial=0))):
+        rows = np.flatnonzero(lengths > position)
+        jll[rows] += contributions[indptr[rows] + position]
+    return jll
+
+
+def _normalize_log_likelihood(jll):
+    """exp(jll - logsumexp(jll)) par ligne ; le maximum est sorti de la somme pour la précision."""
+    jll_max = jll.max(axis=1, keepdims=True)
+    is_max = jll == jll_max
+    max_count = is_max.sum(axis=1, keepdims=True, dtype=np.float64)
+    shifted = np.where(is_max, -np.inf, jll) - jll_max
+    total = np.exp(shifted).sum(axis=1, keepdims=True) / max_count
+    return np.exp(jll - (np.log1p(total) + np.log(max_count) + jll_max))
+
+
+def load_or_train(symptoms_db, all_symptoms=(), path=DIAGNOSIS_MODEL_PATH):
+    """Charge le bundle s'il correspond à la base des maladies ; sinon réentraîne (et réécrit le bundle).
+
+    Retourne (modèle, origine) avec origine 'bundle' ou 'trained'.
+    """
+    digest = source_digest(symptoms_db, all_symptoms)
+    if os.path.exists(path):
+        try:
+            model = DiagnosisModel.load(path)
+        except (ModelBundleError, OSError, ValueError, KeyError) as e:
+            logger.warning("Bundle du modèle illisible (%s), réentraînement.", e)
+        else:
+            if model.source_sha256 == digest:
+                return model, 'bundle'
+            logger.warning("Bundle du modèle périmé (diseases_symptoms.json a changé), réentraînement.")
+    model = DiagnosisModel.train(symptoms_db, all_symptoms)
+    try:
+        model.save(path)
+    except OSError as e:
+        logger.warning("Impossible d'écrire le bundle du modèle %s: %s", path, e)
+    return model, 'trained'
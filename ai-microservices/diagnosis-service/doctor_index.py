@@ -0,0 +1,176 @@
+"""Index des médecins par spécialité normalisée, construit une fois au chargement.
+
+La note et la distance (« 2,5 km ») sont converties en nombres et le score de
+chaque médecin est précalculé : une recherche coûte un accès au dictionnaire
+puis une sélection par tas des N meilleurs, en O(n log N) sur les seuls
+médecins de la spécialité.
+
+Les médecins qui ont des coordonnées (`lat`, `lng`) sont aussi placés dans un
+arbre k-d par spécialité (et un arbre global), sur la sphère unité en
+coordonnées cartésiennes : la distance euclidienne (corde) y est monotone en
+la distance du grand cercle, les k plus proches voisins sont donc exacts.
+"""
+import heapq
+import math
+import os
+import re
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from shared.text_normalization import normalize_string
+
+# Poids du score de classement : note (sur 5) moins distance (en km)
+RATING_WEIGHT = float(os.environ.get('DOCTOR_RATING_WEIGHT', 1.0))
+DISTANCE_WEIGHT = float(os.environ.get('DOCTOR_DISTANCE_WEIGHT', 0.5))
+DEFAULT_LIMIT = int(os.environ.get('SUGGESTED_DOCTORS_LIMIT', 5))
+MAX_NEAREST = 100
+
+EARTH_RADIUS_KM = 6371.0088
+
+_DISTANCE_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*(km|m)?\b', re.IGNORECASE)
+
+
+def parse_distance_km(value):
+    """« 2,5 km » -> 2.5, « 800 m » -> 0.8 ; None si la distance est absente ou illisible."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _DISTANCE_RE.search(value or '')
+    if not match:
+        return None
+    distance = float(match.group(1).replace(',', '.'))
+    if (match.group(2) or 'km').lower() == 'm':
+        distance /= 1000.0
+    return distance
+
+
+def format_distance_km(distance):
+    # Même présentation que dans doctors.json : « 2,5 km »
+    return f"{distance:.1f} km".replace('.', ',')
+
+
+def to_unit_vectors(lat, lng):
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lng = np.radians(np.asarray(lng, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)], axis=-1)
+
+
+def chord_to_km(chord):
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord) / 2.0, 1.0))
+
+
+def km_to_chord(distance_km):
+    return 2.0 * math.sin(min(distance_km / EARTH_RADIUS_KM, math.pi) / 2.0)
+
+
+def parse_coordinate(value, limit):
+    try:
+        coordinate = float(value)
+    except (TypeError, ValueError):
+        return None
+    return coordinate if math.isfinite(coordinate) and -limit <= coordinate <= limit else None
+
+
+class _SpatialBucket:
+    """Arbre k-d des médecins géolocalisés d'une spécialité."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.tree = cKDTree(to_unit_vectors([e['lat'] for e in entries], [e['lng'] for e in entries]))
+
+    def query(self, point, k, max_distance_km=None):
+        k = min(k, len(self.entries))
+        upper_bound = km_to_chord(max_distance_km) if max_distance_km is not None else np.inf
+        chords, positions = self.tree.query(point, k=k, distance_upper_bound=upper_bound)
+        chords, positions = np.atleast_1d(chords), np.atleast_1d(positions)
+        found = np.isfinite(chords)
+        return [(self.entries[p], d) for p, d in zip(positions[found], chord_to_km(chords[found]))]
+
+
+def parse_rating(value):
+    try:
+        return float(str(value).replace(',', '.'))
+    except ValueError:
+        return None
+
+
+class DoctorIndex:
+
+    def __init__(self, doctors, rating_weight=RATING_WEIGHT, distance_weight=DISTANCE_WEIGHT):
+        self.rating_weight = rating_weight
+        self.distance_weight = distance_weight
+        # spécialité normalisée -> [(score, position dans le fichier, médecin)]
+        self._by_specialty = {}
+        for position, doctor in enumerate(doctors):
+            entry = dict(doctor)
+            entry['rating_value'] = parse_rating(doctor.get('rating'))
+            entry['distance_km'] = parse_distance_km(doctor.get('distance'))
+            entry['lat'] = parse_coordinate(doctor.get('lat'), 90.0)
+            entry['lng'] = parse_coordinate(doctor.get('lng'), 180.0)
+            key = normalize_string(doctor.get('specialty', ''))
+            self._by_specialty.setdefault(key, []).append((self.score(entry), position, entry))
+        self.size = len(doctors)
+
+        # Arbres k-d : un par spécialité et un pour toutes les spécialités (clé None)
+        self._spatial = {}
+        located_all = []
+        for key, entries in self._by_specialty.items():
+            located = [entry for _, _, entry in entries if entry['lat'] is not None and entry['lng'] is not None]
+            if located:
+                self._spatial[key] = _SpatialBucket(located)
+                located_all.extend(located)
+        if located_all:
+            self._spatial[None] = _SpatialBucket(located_all)
+        self.located = len(located_all)
+
+    def score(self, doctor):
+        # Note manquante comptée 0, distance manquante comptée comme très éloignée
+        rating = doctor['rating_value'] or 0.0
+        distance = doctor['distance_km'] if doctor['distance_km'] is not None else 1e6
+        return self.rating_weight * rating - self.distance_weight * distance
+
+    def __len__(self):
+        return self.size
+
+    def specialties(self):
+        return list(self._by_specialty)
+
+    def top(self, specialty, limit=DEFAULT_LIMIT):
+        """Les `limit` meilleurs médecins de la spécialité, du meilleur score au moins bon.
+
+        À score égal, l'ordre du fichier est conservé.
+        """
+        entries = self._by_specialty.get(normalize_string(specialty), [])
+        best = heapq.nsmallest(limit, entries, key=lambda entry: (-entry[0], entry[1]))
+        return [entry[2] for entry in best]
+
+    def nearest(self, lat, lng, specialty=None, k=DEFAULT_LIMIT, max_distance_km=None):
+        """Les `k` médecins géolocalisés les plus proches de (lat, lng), du plus proche au plus éloigné.
+
+        Chaque médecin est retourné avec sa distance calculée (`distance_km`,
+        `distance`). Sans spécialité, tous les médecins sont candidats.
+        """
+        bucket = self._spatial.get(normalize_string(specialty) if specialty else None)
+        if bucket is None or k <= 0:
+            return []
+        point = to_unit_vectors(lat, lng)
+        return [
+            dict(entry, distance_km=round(float(distance), 3), distance=format_distance_km(distance))
+            for entry, distance in bucket.query(point, k, max_distance_km)
+        ]
+
+
+def public_doctor(entry):
+    """Champs d'un médecin exposés par l'API (sans les champs calculés internes)."""
+    doctor = {
+        "name": entry.get('name'),
+        "specialty": entry.get('specialty'),
+        "rating": entry.get('rating'),
+        "distance": entry.get('distance'),
+        "distance_km": entry.get('distance_km'),
+    }
+    if entry.get('lat') is not None and entry.get('lng') is not None:
+        doctor["lat"] = entry['lat']
+        doctor["lng"] = entry['lng']
+    return doctor
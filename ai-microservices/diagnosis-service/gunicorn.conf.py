@@ -0,0 +1,35 @@
+"""Configuration gunicorn du service de diagnostic (production).
+
+Usage (depuis ai-microservices/diagnosis-service) :
+    gunicorn -c gunicorn.conf.py app:app
+
+Variables : BIND (0.0.0.0:5001), WEB_CONCURRENCY (un worker par cœur),
+GUNICORN_THREADS, GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT. Avec plusieurs
+workers, les quatre étapes d'une conversation peuvent être servies par des
+workers différents : SESSION_BACKEND vaut alors sqlite par défaut, et le
+démarrage est refusé avec SESSION_BACKEND=memory. METRICS_DIR permet à
+GET /metrics d'additionner les métriques de tous les workers.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from shared.serving import settings
+
+serving_settings = settings(default_port=5001)
+# Lu par session_store.py à l'import de l'application (preload_app), donc avant le fork
+if serving_settings['workers'] > 1:
+    os.environ.setdefault('SESSION_BACKEND', 'sqlite')
+globals().update(serving_settings)
+
+
+def when_ready(server):
+    # Application chargée, workers pas encore lancés : des sessions en mémoire du processus
+    # seraient perdues dès que deux étapes d'une conversation changent de worker
+    from session_store import MemorySessionStore
+    app_module = sys.modules.get('app')
+    if server.cfg.workers > 1 and isinstance(getattr(app_module, 'session_store', None), MemorySessionStore):
+        server.log.error("SESSION_BACKEND=memory est incompatible avec %d workers : utilisez SESSION_BACKEND=sqlite "
+                         "ou un seul worker (WEB_CONCURRENCY=1).", server.cfg.workers)
+        raise SystemExit(1)
@@ -0,0 +1,263 @@
+"""Base de connaissances du service (maladies, modèle, synonymes, médecins), rechargeable à chaud.
+
+Une KnowledgeBase est un instantané immuable : chaque requête lit une seule
+fois `reloader.current` et garde cet instantané jusqu'à la fin (y compris
+pendant une réponse en flux), même si un rechargement a lieu entre-temps.
+
+Le rechargement se fait dans un thread dédié, jamais dans un thread de
+requête, puis le nouvel instantané remplace l'ancien par une simple
+affectation. Seuls les composants dont le fichier a changé sont reconstruits :
+un changement de doctors.json ne reconstruit que l'index des médecins, un
+changement de symptom_synonyms.json que l'extracteur de symptômes. Le TF-IDF
+couple toutes les maladies (idf, normes), une modification de
+diseases_symptoms.json réentraîne donc le modèle complet (et l'extracteur, qui
+suit ses symptômes), hors du chemin des requêtes.
+
+Les changements sont détectés par POST /admin/reload ou, toutes les
+KNOWLEDGE_RELOAD_INTERVAL secondes (0 pour désactiver), par comparaison des
+dates de modification. Avec plusieurs workers gunicorn, chaque worker
+surveille les fichiers ; la version ne dépend que de leur contenu et est
+donc la même dans tous les workers.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from diagnosis_model import load_or_train, source_digest
+from doctor_index import DoctorIndex
+from symptom_extractor import SYMPTOM_SYNONYMS_PATH, SymptomExtractor, load_symptom_synonyms
+
+logger = logging.getLogger(__name__)
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DISEASES_PATH = os.environ.get('DISEASES_PATH', os.path.join(SERVICE_DIR, 'diseases_symptoms.json'))
+DOCTORS_PATH = os.environ.get('DOCTORS_PATH', os.path.join(SERVICE_DIR, 'doctors.json'))
+KNOWLEDGE_RELOAD_INTERVAL = float(os.environ.get('KNOWLEDGE_RELOAD_INTERVAL', 10))
+
+# Base minimale utilisée si diseases_symptoms.json est absent, illisible ou vide
+FALLBACK_DISEASES = {
+    "Rhume": ["éternuements", "nez qui coule", "mal de gorge", "toux"],
+    "Grippe": ["fièvre", "frissons", "douleurs musculaires", "fatigue", "maux de tête"]
+}
+
+
+def file_signature(path):
+    """(date de modification, taille) d'un fichier, ou None s'il n'existe pas."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_diseases(path=DISEASES_PATH):
+    """(maladies -> symptômes, liste des symptômes), avec la base minimale en secours."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        symptoms_db = data.get('diseases', {})
+        all_symptoms = data.get('symptoms', [])
+    except FileNotFoundError:
+        logger.error("Le fichier %s n'a pas été trouvé.", path)
+        symptoms_db, all_symptoms = {}, []
+    except json.JSONDecodeError:
+        logger.error("Impossible de décoder %s. Vérifiez le format JSON.", path)
+        symptoms_db, all_symptoms = {}, []
+
+    if not symptoms_db:
+        logger.warning("La base de données des maladies est vide. Le modèle ne sera pas entraîné.")
+        symptoms_db = FALLBACK_DISEASES
+        all_symptoms = list(set([symptom for symptoms in symptoms_db.values() for symptom in symptoms]))
+    return symptoms_db, all_symptoms
+
+
+def load_doctors(path=DOCTORS_PATH):
+    """(liste des médecins, empreinte du contenu)."""
+    try:
+        with open(path, 'rb') as f:
+            payload = f.read()
+        return json.loads(payload.decode('utf-8')), hashlib.sha256(payload).hexdigest()
+    except FileNotFoundError:
+        logger.error("Le fichier %s n'a pas été trouvé.", path)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        logger.error("Impossible de décoder %s. Vérifiez le format JSON.", path)
+    return [], hashlib.sha256(b'').hexdigest()
+
+
+class KnowledgeBase:
+
+    def __init__(self, symptoms_db, all_symptoms, model, model_origin, symptom_extractor, synonyms_sha256,
+                 doctor_index, doctors_sha256, signatures):
+        self.symptoms_db = symptoms_db
+        self.all_symptoms = all_symptoms
+        self.model = model
+        self.model_origin = model_origin
+        self.symptom_extractor = symptom_extractor
+        self.synonyms_sha256 = synonyms_sha256
+        self.doctor_index = doctor_index
+        self.doctors_sha256 = doctors_sha256
+        # Signatures des fichiers sources au moment du chargement
+        self.signatures = signatures
+        self.loaded_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    @property
+    def version(self):
+        """Version de la base : empreintes du contenu des maladies, des médecins et des synonymes."""
+        return f"{self.model.source_sha256[:8]}-{self.doctors_sha256[:8]}-{self.synonyms_sha256[:8]}"
+
+    @staticmethod
+    def current_signatures():
+        return {'diseases': file_signature(DISEASES_PATH), 'doctors': file_signature(DOCTORS_PATH),
+                'synonyms': file_signature(SYMPTOM_SYNONYMS_PATH)}
+
+    @classmethod
+    def load(cls, previous=None):
+        """Charge la base ; les composants inchangés depuis `previous` sont repris tels quels.
+
+        Retourne (base, composants reconstruits).
+        """
+        signatures = cls.current_signatures()
+        rebuilt = []
+
+        if previous is not None and signatures['diseases'] == previous.signatures['diseases']:
+            symptoms_db, all_symptoms = previous.symptoms_db, previous.all_symptoms
+            model, model_origin = previous.model, previous.model_origin
+        else:
+            symptoms_db, all_symptoms = load_diseases()
+            if previous is not None and source_digest(symptoms_db, all_symptoms) == previous.model.source_sha256:
+                # Fichier touché mais contenu identique
+                model, model_origin = previous.model, previous.model_origin
+            else:
+                model, model_origin = load_or_train(symptoms_db, all_symptoms)
+                rebuilt.append('model')
+            logger.info("Base de données des maladies chargée: %d maladies.", len(symptoms_db))
+
+        model_changed = previous is None or model is not previous.model
+        if not model_changed and signatures['synonyms'] == previous.signatures['synonyms']:
+            symptom_extractor, synonyms_sha256 = previous.symptom_extractor, previous.synonyms_sha256
+        else:
+            synonyms, synonyms_sha256 = load_symptom_synonyms()
+            if not model_changed and synonyms_sha256 == previous.synonyms_sha256:
+                symptom_extractor = previous.symptom_extractor
+            else:
+                # Les identifiants de l'extracteur sont les positions des symptômes du modèle
+                symptom_extractor = SymptomExtractor(model.symptoms, synonyms)
+                rebuilt.append('symptoms')
+                logger.info("Extracteur de symptômes: %d symptômes, %d expressions.", len(model.symptoms), len(symptom_extractor))
+
+        if previous is not None and signatures['doctors'] == previous.signatures['doctors']:
+            doctor_index, doctors_sha256 = previous.doctor_index, previous.doctors_sha256
+        else:
+            doctors, doctors_sha256 = load_doctors()
+            if previous is not None and doctors_sha256 == previous.doctors_sha256:
+                doctor_index = previous.doctor_index
+            else:
+                doctor_index = DoctorIndex(doctors)
+                rebuilt.append('doctors')
+                logger.info("Index des médecins: %d médecins (%d géolocalisés), %d spécialités.",
+                            len(doctor_index), doctor_index.located, len(doctor_index.specialties()))
+
+        return cls(symptoms_db, all_symptoms, model, model_origin, symptom_extractor, synonyms_sha256,
+                   doctor_index, doctors_sha256, signatures), rebuilt
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'diseases': len(self.symptoms_db),
+            'model_origin': self.model_origin,
+            'model_built_at': self.model.manifest.get('built_at'),
+            'symptoms': len(self.model.symptoms),
+            'symptom_phrases': len(self.symptom_extractor),
+            'doctors': len(self.doctor_index),
+        }
+
+
+class KnowledgeReloader:
+    """Détient l'instantané actif et le remplace après un rechargement en arrière-plan."""
+
+    def __init__(self, knowledge, interval=KNOWLEDGE_RELOAD_INTERVAL):
+        self.current = knowledge
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._pending = None
+        self._stop = threading.Event()
+        self.reloads = 0
+        self.failures = 0
+        self.last_reload = None
+
+    def ensure_started(self):
+        """Démarre le thread de rechargement et la surveillance dans ce processus (une fois par worker)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Les threads ne survivent pas au fork : un pool et un surveillant par processus
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='knowledge-reload')
+            self._pending = None
+            if self.interval > 0:
+                threading.Thread(target=self._watch, name='knowledge-watch', daemon=True).start()
+            self._pid = os.getpid()
+
+    def request_reload(self, reason):
+        """Planifie un rechargement sans attendre ; les demandes concurrentes partagent le même."""
+        self.ensure_started()
+        with self._lock:
+            if self._pending is None or self._pending.done():
+                self._pending = self._executor.submit(self._reload, reason)
+            return self._pending
+
+    def _reload(self, reason):
+        start = time.perf_counter()
+        previous = self.current
+        try:
+            knowledge, rebuilt = KnowledgeBase.load(previous)
+        except Exception as e:
+            self.failures += 1
+            self.last_reload = {'reason': reason, 'error': str(e), 'at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            logger.exception("Erreur lors du rechargement de la base de connaissances (%s), version conservée : %s", reason, e)
+            return self.last_reload
+        # Remplacement atomique : les requêtes en cours gardent l'instantané qu'elles ont lu
+        self.current = knowledge
+        self.reloads += 1
+        self.last_reload = {
+            'reason': reason,
+            'at': knowledge.loaded_at,
+            'previous_version': previous.version,
+            'version': knowledge.version,
+            'rebuilt': rebuilt,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+        }
+        if rebuilt:
+            logger.info("Base de connaissances rechargée (%s) : %s -> %s, reconstruit : %s.",
+                        reason, previous.version, knowledge.version, ', '.join(rebuilt))
+        return self.last_reload
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            if KnowledgeBase.current_signatures() != self.current.signatures:
+                self.request_reload('fichier modifié')
+
+    def stats(self):
+        pending = self._pending
+        return {
+            'active': self.current.describe(),
+            'reload_in_progress': pending is not None and not pending.done(),
+            'watch_interval_seconds': self.interval,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'last_reload': self.last_reload,
+        }
+
+    def shutdown(self):
+        self._stop.set()
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,99 @@
+"""Accès au modèle de langage : Cohere en production, réponse simulée hors ligne.
+
+LLM_BACKEND=cohere (par défaut) appelle l'API Cohere avec COHERE_API_KEY.
+LLM_BACKEND=fake renvoie un texte fixe découpé en morceaux, avec un délai
+LLM_FAKE_DELAY (secondes) entre morceaux : le mode streaming se teste ainsi
+sans réseau ni clé d'API.
+
+Les deux backends exposent chat() (texte complet) et stream() (morceaux de
+texte au fil de leur génération).
+"""
+import os
+import re
+import time
+
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'cohere')
+LLM_MODEL = os.environ.get('LLM_MODEL', "command-r-plus")
+LLM_FAKE_DELAY = float(os.environ.get('LLM_FAKE_DELAY', 0.02))
+
+
+class CohereBackend:
+
+    def __init__(self, api_key=None, model=LLM_MODEL):
+        import cohere # Importation de Cohere (inutile avec le backend simulé)
+        self.client = cohere.Client(api_key if api_key is not None else os.environ.get("COHERE_API_KEY"))
+        self.model = model
+
+    def chat(self, message, temperature=0.7, max_tokens=1000):
+        response = self.client.chat(message=message, model=self.model, temperature=temperature, max_tokens=max_tokens)
+        return response.text
+
+    def stream(self, message, temperature=0.7, max_tokens=1000):
+        for event in self.client.chat_stream(message=message, model=self.model, temperature=temperature,
+                                             max_tokens=max_tokens):
+            if getattr(event, 'event_type', None) == "text-generation":
+                yield event.text
+
+
+class FakeBackend:
+
+    REPLY = ("Bonjour ! Je comprends votre inquiétude.  \n\n\n"
+             "D'après les éléments décrits, il est important de consulter un professionnel de la santé"
+             " pour une évaluation précise.   \n  \n"
+             "En attendant, reposez-vous et hydratez-vous bien. Prenez soin de vous.\n")
+
+    def __init__(self, delay=LLM_FAKE_DELAY, reply=REPLY):
+        self.delay = delay
+        self.reply = reply
+        self.model = 'fake'
+
+    def chat(self, message, temperature=0.7, max_tokens=1000):
+        return self.reply
+
+    def stream(self, message, temperature=0.7, max_tokens=1000):
+        # Morceaux de quelques mots, espaces compris, comme les événements text-generation
+        for chunk in re.findall(r'\S*\s*', self.reply):
+            if chunk:
+                if self.delay:
+                    time.sleep(self.delay)
+                yield chunk
+
+
+def create_backend(name=LLM_BACKEND):
+    if name == 'fake':
+        return FakeBackend()
+    if name == 'cohere':
+        return CohereBackend()
+    raise ValueError(f"LLM_BACKEND inconnu : {name!r} (attendu : cohere ou fake)")
+
+
+class WhitespaceCleaner:
+    """Nettoyage incrémental équivalent à, sur le texte complet :
+
+        text = re.sub(r'\\n\\s*\\n', '\\n\\n', text).strip()
+        text = re.sub(r' {2,}', ' ', text)
+
+    Ces remplacements ne touchent que des suites d'espaces : un morceau est
+    émis jusqu'à son dernier caractère non blanc, et la suite d'espaces finale
+    est gardée en attente jusqu'au morceau suivant : celle qui termine le texte
+    n'est jamais émise, comme avec strip().
+    """
+
+    def __init__(self):
+        self._pending = ''
+        self._started = False
+
+    def feed(self, chunk):
+        text = self._pending + chunk
+        end = len(text.rstrip())
+        self._pending = text[end:]
+        text = text[:end]
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return self.clean(text)
+
+    @staticmethod
+    def clean(text):
+        text = re.sub(r'\n\s*\n', '\n\n', text)
+        return re.sub(r' {2,}', ' ', text)
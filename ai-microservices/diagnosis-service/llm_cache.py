@@ -0,0 +1,196 @@
+"""Cache persistant (SQLite) des réponses du LLM.
+
+Les prompts de /predict sont des gabarits (maladie, confiance, extrait RAG,
+spécialité) : les mêmes reviennent toute la journée. La clé est le prompt
+canonicalisé (Unicode NFC, espaces fusionnés) plus le modèle, la température
+et max_tokens. Les entrées expirent après LLM_CACHE_TTL secondes et les moins
+récemment utilisées sont évincées au-delà de LLM_CACHE_MAX_ENTRIES.
+
+Une erreur SQLite n'interrompt jamais une requête : elle compte comme un
+défaut de cache.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', '1') not in ('0', 'false', 'False')
+LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH', os.path.join(SERVICE_DIR, '.cache', 'llm_cache.sqlite3'))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 10000))
+LLM_CACHE_TTL = float(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))
+# Pas d'arrondi (en points de pourcentage) de la confiance citée dans le prompt final :
+# 1 la laisse inchangée, 5 ou 10 font partager la même réponse à des confiances voisines
+LLM_CACHE_CONFIDENCE_BUCKET = int(os.environ.get('LLM_CACHE_CONFIDENCE_BUCKET', 1))
+
+logger = logging.getLogger(__name__)
+
+
+def canonicalize_prompt(prompt):
+    return ' '.join(unicodedata.normalize('NFC', prompt).split())
+
+
+def bucket_confidence(confidence, bucket=LLM_CACHE_CONFIDENCE_BUCKET):
+    """Confiance (en %) arrondie au multiple de `bucket` le plus proche, sans descendre sous `bucket`."""
+    if bucket <= 1:
+        return confidence
+    return max(bucket, int(round(confidence / bucket)) * bucket)
+
+
+class LlmCache:
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL,
+                 clock=time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.errors = 0
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = None
+        self._pid = None
+        conn = self._connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            ' key TEXT PRIMARY KEY, response TEXT NOT NULL,'
+            ' created_at REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        conn.commit()
+
+    def _connection(self):
+        # Une connexion SQLite ne doit pas traverser un fork (workers gunicorn) : chaque processus ouvre la sienne
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def make_key(prompt, **params):
+        payload = json.dumps([canonicalize_prompt(prompt), sorted(params.items())], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = self._clock()
+        with self._lock:
+            try:
+                conn = self._connection()
+                row = conn.execute('SELECT response, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+                if row is not None and now - row[1] > self.ttl_seconds:
+                    conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                    conn.commit()
+                    self.expirations += 1
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                conn.execute('UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?', (now, key))
+                conn.commit()
+            except sqlite3.Error as e:
+                self._record_error('lecture', e)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = self._clock()
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    'INSERT OR REPLACE INTO responses (key, response, created_at, last_access) VALUES (?, ?, ?, ?)',
+                    (key, response, now, now),
+                )
+                conn.execute('DELETE FROM responses WHERE created_at < ?', (now - self.ttl_seconds,))
+                excess = self._count() - self.max_entries
+                if excess > 0:
+                    conn.execute(
+                        'DELETE FROM responses WHERE key IN '
+                        '(SELECT key FROM responses ORDER BY last_access LIMIT ?)', (excess,))
+                    self.evictions += excess
+                conn.commit()
+            except sqlite3.Error as e:
+                self._record_error('écriture', e)
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute('DELETE FROM responses')
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            try:
+                entries = self._count()
+            except sqlite3.Error:
+                entries = None
+            lookups = self.hits + self.misses
+            return {
+                'path': self.path,
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'confidence_bucket': LLM_CACHE_CONFIDENCE_BUCKET,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'errors': self.errors,
+            }
+
+    def _count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def _record_error(self, operation, error):
+        self.errors += 1
+        logger.warning("Cache LLM indisponible (%s) : %s", operation, error)
+
+
+class CachedBackend:
+    """Backend LLM (voir llm.py) précédé du cache : même interface chat()/stream()."""
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+        self.model = backend.model
+
+    def _key(self, message, temperature, max_tokens):
+        return self.cache.make_key(message, model=self.model, temperature=temperature, max_tokens=max_tokens)
+
+    def chat(self, message, temperature=0.7, max_tokens=1000):
+        key = self._key(message, temperature, max_tokens)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        response = self.backend.chat(message, temperature=temperature, max_tokens=max_tokens)
+        self.cache.put(key, response)
+        return response
+
+    def stream(self, message, temperature=0.7, max_tokens=1000):
+        key = self._key(message, temperature, max_tokens)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        # La réponse n'est mise en cache que si le flux est allé jusqu'au bout
+        parts = []
+        for chunk in self.backend.stream(message, temperature=temperature, max_tokens=max_tokens):
+            parts.append(chunk)
+            yield chunk
+        self.cache.put(key, ''.join(parts))
@@ -0,0 +1,125 @@
+"""Test de charge des stockages de sessions : N conversations simultanées en trois étapes.
+
+Usage :
+    python load_test_sessions.py [--sessions 100000] [--backend memory|sqlite] [--workers 4]
+
+Chaque étape traite toutes les sessions dans un ordre aléatoire (lecture,
+ajout de symptômes, écriture), comme des conversations entrelacées. Avec
+--backend sqlite, les sessions d'une étape sont réparties au hasard entre
+--workers processus : une session passe d'un worker à l'autre entre deux
+étapes, ce que le stockage partagé doit supporter. On vérifie à la fin que
+chaque session a bien ses trois étapes, puis on mesure l'expiration et
+l'éviction.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from multiprocessing import Pool
+
+from session_store import MemorySessionStore, SessionRecord, SqliteSessionStore
+
+STEPS = 3
+_worker_store = None
+
+
+def run_step(store, session_ids, step):
+    latencies = []
+    for session_id in session_ids:
+        start = time.perf_counter()
+        record = store.get(session_id) or SessionRecord()
+        record.add_symptoms([f"symptome{step} {session_id}"])
+        record.diagnostic_step += 1
+        store.save(session_id, record)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _init_worker(path, ttl):
+    global _worker_store
+    _worker_store = SqliteSessionStore(path, max_entries=10 ** 9, ttl_seconds=ttl)
+
+
+def _worker_step(args):
+    return run_step(_worker_store, *args)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1e6
+
+
+def check(store, session_ids):
+    for session_id in session_ids:
+        record = store.get(session_id)
+        expected = " ".join(f"symptome{step} {session_id}" for step in range(STEPS))
+        if record is None or record.diagnostic_step != STEPS or record.symptoms_text != expected:
+            raise SystemExit(f"Session {session_id} incohérente : {record and record.to_json()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    session_ids = [f"session-{i}" for i in range(args.sessions)]
+    ttl = 3600.0
+
+    if args.backend == 'memory':
+        tracemalloc.start()
+        store = MemorySessionStore(max_entries=args.sessions, ttl_seconds=ttl)
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix='sessions-')
+        path = os.path.join(tmp_dir, 'sessions.sqlite3')
+        store = SqliteSessionStore(path, max_entries=10 ** 9, ttl_seconds=ttl)
+        pool = Pool(args.workers, initializer=_init_worker, initargs=(path, ttl))
+
+    start = time.perf_counter()
+    latencies = []
+    for step in range(STEPS):
+        order = session_ids[:]
+        rng.shuffle(order)
+        if args.backend == 'memory':
+            latencies.extend(run_step(store, order, step))
+        else:
+            chunks = [(order[i::args.workers], step) for i in range(args.workers)]
+            for chunk_latencies in pool.map(_worker_step, chunks):
+                latencies.extend(chunk_latencies)
+    elapsed = time.perf_counter() - start
+
+    operations = len(latencies)
+    print(f"{args.backend} : {args.sessions} sessions x {STEPS} étapes en {elapsed:.2f} s "
+          f"({operations / elapsed:,.0f} étapes/s), latence p50 {percentile(latencies, 0.5):.1f} µs, "
+          f"p99 {percentile(latencies, 0.99):.1f} µs")
+    if args.backend == 'memory':
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"Mémoire des sessions : {current / 1e6:.1f} Mo ({current / args.sessions:.0f} octets/session), pic {peak / 1e6:.1f} Mo")
+        tracemalloc.stop()
+
+    check(store, session_ids)
+    print("Contenu des sessions vérifié.")
+
+    # Expiration et éviction : horloge avancée au-delà du TTL pour la moitié des sessions
+    if args.backend == 'memory':
+        now = [0.0]
+        bounded = MemorySessionStore(max_entries=args.sessions // 2, ttl_seconds=10, clock=lambda: now[0])
+        for i, session_id in enumerate(session_ids):
+            now[0] = 0.0 if i < args.sessions // 4 else 20.0
+            bounded.save(session_id, SessionRecord())
+        print(f"Stockage borné à {args.sessions // 2} sessions : {bounded.stats()}")
+    else:
+        pool.close()
+        pool.join()
+        store.ttl_seconds = 0.0
+        store.purge()
+        print(f"Après expiration : {store.stats()}")
+
+
+if __name__ == '__main__':
+    main()
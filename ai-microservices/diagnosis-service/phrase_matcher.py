@@ -0,0 +1,95 @@
+"""Automate d'Aho-Corasick sur des séquences de mots normalisés.
+
+Toutes les expressions sont compilées une fois dans un seul automate : un texte
+est parcouru en une passe, quel que soit le nombre d'expressions, et chaque
+correspondance est alignée sur des frontières de mots. L'état de l'automate peut
+être conservé entre deux appels pour reprendre l'analyse d'un texte qui s'allonge
+(les symptômes collectés au fil de la conversation).
+"""
+from collections import deque
+
+
+class PhraseMatch:
+
+    __slots__ = ('value', 'phrase', 'start', 'end')
+
+    def __init__(self, value, phrase, start, end):
+        self.value = value
+        self.phrase = phrase
+        # Positions en mots dans le texte analysé : [start, end[
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f'PhraseMatch({self.value!r}, {self.phrase!r}, {self.start}, {self.end})'
+
+
+class PhraseMatcher:
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        # Sorties de chaque état : (valeur, expression, longueur en mots)
+        self._outputs = [[]]
+        # Expressions distinctes : build() recopie des sorties d'un état à l'autre
+        self._phrases = 0
+        self._built = False
+
+    def add(self, phrase, value):
+        """Ajoute une expression déjà normalisée (mots séparés par des espaces)."""
+        if self._built:
+            raise RuntimeError("L'automate est déjà compilé.")
+        words = phrase.split()
+        if not words:
+            return
+        state = 0
+        for word in words:
+            next_state = self._goto[state].get(word)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+                self._goto[state][word] = next_state
+            state = next_state
+        if all(output[1] != phrase for output in self._outputs[state]):
+            self._outputs[state].append((value, phrase, len(words)))
+            self._phrases += 1
+
+    def build(self):
+        """Calcule les liens d'échec (parcours en largeur) et fusionne les sorties."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(word, 0)
+                self._outputs[child] = self._outputs[child] + self._outputs[self._fail[child]]
+        self._built = True
+        return self
+
+    def __len__(self):
+        return self._phrases
+
+    def scan(self, words, state=0, offset=0):
+        """Parcourt `words` depuis `state` ; `offset` est la position du premier mot.
+
+        Retourne (correspondances, état final) : l'état final permet de reprendre
+        l'analyse si d'autres mots suivent.
+        """
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        matches = []
+        for position, word in enumerate(words, start=offset):
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            for value, phrase, length in outputs[state]:
+                matches.append(PhraseMatch(value, phrase, position + 1 - length, position + 1))
+        return matches, state
+
+    def find_all(self, text):
+        """Correspondances dans un texte normalisé complet."""
+        return self.scan(text.split())[0]
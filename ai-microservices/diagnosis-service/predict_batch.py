@@ -0,0 +1,71 @@
+"""Diagnostic par lots en ligne de commande, même format que POST /predict/batch.
+
+Usage :
+    python predict_batch.py [ENTRÉE.jsonl] [-o SORTIE.jsonl] [-k 3] [--rag] [--llm]
+
+Sans fichier, l'entrée est lue sur stdin ; sans -o, les résultats sont écrits
+sur stdout. Sans --rag ni --llm, seul le modèle est chargé (ni Flask, ni
+service RAG, ni LLM) ; avec l'une de ces options, le service complet est
+importé pour enrichir la maladie principale de chaque ligne.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# Rendre importable le paquet shared/ commun aux services
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import batch
+from diagnosis_model import DEFAULT_THRESHOLD
+from knowledge_base import KnowledgeBase
+from urgency import UrgencyDetector
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', nargs='?', help="Fichier JSON Lines d'entrée (stdin par défaut)")
+    parser.add_argument('-o', '--output', help="Fichier JSON Lines de sortie (stdout par défaut)")
+    parser.add_argument('-k', type=int, default=batch.DEFAULT_TOP_K, help="Diagnostics par ligne")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="Confiance minimale")
+    parser.add_argument('--rag', action='store_true', help="Ajoute l'extrait RAG de la maladie principale")
+    parser.add_argument('--llm', action='store_true', help="Ajoute le texte du LLM pour la maladie principale")
+    parser.add_argument('--chunk-size', type=int, default=batch.BATCH_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    enrich = executor = None
+    if args.rag or args.llm:
+        import app
+        knowledge, urgency_detector = app.knowledge_reloader.current, app.urgency_detector
+        enrich = lambda result: app.enrich_batch_result(result, args.rag, args.llm, knowledge)
+        executor = app.fanout_executor
+    else:
+        knowledge, _ = KnowledgeBase.load()
+        urgency_detector = UrgencyDetector.from_file()
+
+    source = open(args.input, 'r', encoding='utf-8') if args.input else sys.stdin
+    target = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    start = time.perf_counter()
+    total = errors = urgent = 0
+    try:
+        results = batch.iter_results(source, knowledge.model, urgency_detector, k=args.k, threshold=args.threshold,
+                                     enrich=enrich, executor=executor, chunk_size=args.chunk_size,
+                                     model_version=knowledge.version,
+                                     symptom_extractor=knowledge.symptom_extractor)
+        for result in results:
+            total += 1
+            errors += 'error' in result
+            urgent += bool(result.get('urgent'))
+            target.write(json.dumps(result, ensure_ascii=False) + "\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    elapsed = time.perf_counter() - start
+    print(f"{total} lignes ({errors} erreurs, {urgent} urgences) en {elapsed:.1f} s, "
+          f"{total / elapsed if elapsed else 0:.0f} lignes/s.", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
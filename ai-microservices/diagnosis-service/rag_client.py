@@ -0,0 +1,207 @@
+"""Clients du service RAG : HTTP (par défaut) ou recherche en processus, selon RAG_MODE.
+
+RAG_MODE=http : connexions persistantes, délais bornés, nouvelles tentatives
+et disjoncteur vers RAG_SERVICE_URL. Un service RAG lent ou arrêté ne doit jamais bloquer /predict : chaque appel
+est borné par les délais de connexion et de lecture, et après
+RAG_BREAKER_THRESHOLD échecs consécutifs le disjoncteur s'ouvre et les appels
+échouent immédiatement pendant RAG_BREAKER_RESET secondes. Un seul appel
+d'essai est ensuite autorisé pour refermer le circuit.
+
+RAG_MODE=local : le paquet rag_core de RAG_SERVICE_DIR est importé et
+l'artefact d'index (RAG_INDEX_DIR, construit par build_index.py) est ouvert en
+memmap dans ce processus ; la recherche est le même code que /rag, sans saut
+HTTP. Les dépendances de rag-service/requirements.txt doivent être installées.
+Sans artefact lisible, le client HTTP est utilisé.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+RAG_MODE = os.environ.get('RAG_MODE', 'http')
+RAG_SERVICE_DIR = os.environ.get(
+    'RAG_SERVICE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rag-service'))
+RAG_SERVICE_URL = os.environ.get('RAG_SERVICE_URL', "http://127.0.0.1:5002/rag") # URL du service RAG
+RAG_CONNECT_TIMEOUT = float(os.environ.get('RAG_CONNECT_TIMEOUT', 0.5))
+RAG_READ_TIMEOUT = float(os.environ.get('RAG_READ_TIMEOUT', 2.0))
+RAG_RETRIES = int(os.environ.get('RAG_RETRIES', 1))
+RAG_POOL_SIZE = int(os.environ.get('RAG_POOL_SIZE', 16))
+RAG_BREAKER_THRESHOLD = int(os.environ.get('RAG_BREAKER_THRESHOLD', 5))
+RAG_BREAKER_RESET = float(os.environ.get('RAG_BREAKER_RESET', 30.0))
+
+NO_RESULT_MESSAGE = "Je n'ai pas trouvé d'informations pertinentes pour votre requête dans ma base de connaissances."
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=RAG_BREAKER_THRESHOLD, reset_timeout=RAG_BREAKER_RESET, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def before_call(self):
+        """Lève CircuitOpenError si l'appel ne doit pas être tenté."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.OPEN or (state == self.HALF_OPEN and self._trial_in_flight):
+                raise CircuitOpenError("Disjoncteur RAG ouvert")
+            if state == self.HALF_OPEN:
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+    def _current_state(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+
+def summarize(rag_data):
+    """Résumé « Classe: ..., Bloc: ..., Chapitre: ... » d'une réponse de /rag pour le prompt, "" si rien n'est trouvé."""
+    if rag_data.get("response") == NO_RESULT_MESSAGE:
+        return ""
+    return f"Classe: {rag_data.get('classe', 'N/A')}, Bloc: {rag_data.get('bloc', 'N/A')}, Chapitre: {rag_data.get('chapitre', 'N/A')}."
+
+
+class HttpRagClient:
+
+    mode = 'http'
+
+    def __init__(self, url=RAG_SERVICE_URL, connect_timeout=RAG_CONNECT_TIMEOUT, read_timeout=RAG_READ_TIMEOUT,
+                 retries=RAG_RETRIES, pool_size=RAG_POOL_SIZE, breaker=None):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker or CircuitBreaker()
+        # Nouvelles tentatives sur erreur de connexion et 502/503/504 seulement :
+        # un délai de lecture dépassé n'est pas retenté pour garder la latence bornée
+        retry = Retry(total=retries, connect=retries, read=0, status=retries, backoff_factor=0.1,
+                      status_forcelist=(502, 503, 504), allowed_methods=frozenset(['POST']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def search(self, query):
+        """Réponse JSON de /rag pour `query`.
+
+        Lève CircuitOpenError, requests.exceptions.RequestException ou
+        ValueError (réponse illisible) en cas d'échec.
+        """
+        self.breaker.before_call()
+        try:
+            response = self.session.post(self.url, json={"query": query}, timeout=self.timeout)
+            if response.status_code >= 500:
+                raise requests.exceptions.HTTPError(f"{response.status_code} - {response.text}", response=response)
+            result = response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        if response.status_code != 200:
+            raise requests.exceptions.HTTPError(f"{response.status_code} - {response.text}", response=response)
+        return result
+
+    def lookup(self, query):
+        """Résumé « Classe: ..., Bloc: ..., Chapitre: ... » pour le prompt, ou "" si rien n'est trouvé."""
+        try:
+            rag_data = self.search(query)
+        except CircuitOpenError:
+            logger.info("Service RAG ignoré pour '%s': disjoncteur ouvert", query)
+            return ""
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning("Impossible d'interroger le service RAG pour '%s': %s", query, e)
+            return ""
+        return summarize(rag_data)
+
+    def shutdown(self):
+        self.session.close()
+
+
+class LocalRagClient:
+    """Recherche en processus dans l'artefact d'index, même interface que HttpRagClient (sans disjoncteur)."""
+
+    mode = 'local'
+    breaker = None
+
+    def __init__(self, service_dir=RAG_SERVICE_DIR, index_dir=None):
+        service_dir = os.path.abspath(service_dir)
+        if service_dir not in sys.path:
+            sys.path.append(service_dir)
+        from rag_core.artifact import DEFAULT_INDEX_DIR
+        from rag_core.client import LocalRagClient as IndexClient
+        from rag_core.query_cache import QueryCache
+        self.index_dir = index_dir or DEFAULT_INDEX_DIR
+        # IndexUnavailableError (RuntimeError) si l'artefact est absent ou illisible
+        self._client = IndexClient.from_artifact(self.index_dir, cache=QueryCache())
+
+    @property
+    def index_version(self):
+        return self._client.indexes.current.version
+
+    def search(self, query):
+        """Réponse de /rag pour `query`, calculée dans ce processus."""
+        return self._client.search(query)
+
+    def lookup(self, query):
+        """Comme HttpRagClient.lookup."""
+        try:
+            rag_data = self.search(query)
+        except RuntimeError as e:
+            logger.warning("Impossible d'interroger l'index RAG local pour '%s': %s", query, e)
+            return ""
+        return summarize(rag_data)
+
+    def shutdown(self):
+        self._client.shutdown()
+
+
+def create_rag_client(mode=RAG_MODE):
+    """Client RAG selon RAG_MODE (http ou local) ; repli sur HTTP si l'index local ne peut pas être ouvert."""
+    if mode == 'local':
+        try:
+            client = LocalRagClient()
+            logger.info("Recherche RAG en processus sur l'index %s (%s).", client.index_version, client.index_dir)
+            return client
+        except (ImportError, RuntimeError) as e:
+            logger.warning("Index RAG local indisponible, repli sur le service HTTP %s : %s", RAG_SERVICE_URL, e)
+    elif mode != 'http':
+        raise ValueError(f"RAG_MODE inconnu : {mode} (http ou local)")
+    return HttpRagClient()
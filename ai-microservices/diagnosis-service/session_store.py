@@ -0,0 +1,238 @@
+"""Stockage des sessions de diagnostic (les quatre étapes de /predict).
+
+Deux implémentations, choisies par SESSION_BACKEND :
+
+- memory (par défaut) : dictionnaire ordonné du processus, borné à
+  SESSION_MAX_ENTRIES sessions (éviction LRU) et expirant après SESSION_TTL
+  secondes sans activité ;
+- sqlite : base SQLite en mode WAL (SESSION_DB_PATH) partagée par tous les
+  workers d'une même machine, avec la même expiration.
+
+Une session n'est qu'un SessionRecord compact : l'étape, le texte normalisé
+des symptômes collectés et l'état de l'analyse d'urgence.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory')
+SESSION_TTL = float(os.environ.get('SESSION_TTL', 1800))
+SESSION_MAX_ENTRIES = int(os.environ.get('SESSION_MAX_ENTRIES', 100000))
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', os.path.join(SERVICE_DIR, '.cache', 'sessions.sqlite3'))
+
+
+class SessionRecord:
+
+    __slots__ = ('diagnostic_step', 'symptoms_count', 'symptoms_text', 'urgency_state', 'urgency_offset')
+
+    def __init__(self, diagnostic_step=0, symptoms_count=0, symptoms_text='', urgency_state=0, urgency_offset=0):
+        self.diagnostic_step = diagnostic_step
+        # Nombre de symptômes saisis et leur texte normalisé, joint par des espaces
+        self.symptoms_count = symptoms_count
+        self.symptoms_text = symptoms_text
+        # Reprise de l'analyse d'urgence là où l'étape précédente s'est arrêtée
+        self.urgency_state = urgency_state
+        self.urgency_offset = urgency_offset
+
+    def add_symptoms(self, normalized_symptoms):
+        """Ajoute des symptômes normalisés ; même texte que " ".join(de tous les symptômes)."""
+        if not normalized_symptoms:
+            return
+        added = " ".join(normalized_symptoms)
+        self.symptoms_text = f"{self.symptoms_text} {added}" if self.symptoms_count else added
+        self.symptoms_count += len(normalized_symptoms)
+
+    def to_json(self):
+        return json.dumps([self.diagnostic_step, self.symptoms_count, self.symptoms_text,
+                           self.urgency_state, self.urgency_offset], ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, payload):
+        return cls(*json.loads(payload))
+
+
+class MemorySessionStore:
+
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES, ttl_seconds=SESSION_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        # session_id -> (dernier accès, SessionRecord), du plus ancien au plus récent :
+        # l'expiration étant glissante, les sessions expirées sont toujours en tête
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and self._clock() - entry[0] > self.ttl_seconds:
+                del self._sessions[session_id]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def save(self, session_id, record):
+        with self._lock:
+            now = self._clock()
+            self._sessions[session_id] = (now, record)
+            self._sessions.move_to_end(session_id)
+            self._purge(now)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            self._purge(self._clock())
+            return {
+                'backend': 'memory',
+                'sessions': len(self._sessions),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+            }
+
+    def _purge(self, now):
+        while self._sessions:
+            oldest_id, (last_access, _) = next(iter(self._sessions.items()))
+            if now - last_access > self.ttl_seconds:
+                self.expirations += 1
+            elif len(self._sessions) > self.max_entries:
+                self.evictions += 1
+            else:
+                break
+            del self._sessions[oldest_id]
+
+
+class SqliteSessionStore:
+    """Sessions partagées entre processus : une connexion par thread, écritures sérialisées par SQLite."""
+
+    # Nombre d'écritures entre deux purges des sessions expirées ou en excès
+    PURGE_EVERY = 1000
+
+    def __init__(self, path=SESSION_DB_PATH, max_entries=SESSION_MAX_ENTRIES, ttl_seconds=SESSION_TTL,
+                 clock=time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                     ' session_id TEXT PRIMARY KEY, record TEXT NOT NULL, last_access REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)')
+        conn.commit()
+
+    def _connection(self):
+        # Une connexion par thread, rouverte après un fork (workers gunicorn)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10.0)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, session_id):
+        conn = self._connection()
+        row = conn.execute('SELECT record, last_access FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        if row is not None and self._clock() - row[1] > self.ttl_seconds:
+            with conn:
+                conn.execute('DELETE FROM sessions WHERE session_id = ? AND last_access = ?', (session_id, row[1]))
+            with self._lock:
+                self.expirations += 1
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return SessionRecord.from_json(row[0])
+
+    def save(self, session_id, record):
+        conn = self._connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO sessions (session_id, record, last_access) VALUES (?, ?, ?)',
+                         (session_id, record.to_json(), self._clock()))
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.PURGE_EVERY == 0
+        if purge:
+            self.purge()
+
+    def delete(self, session_id):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def purge(self):
+        conn = self._connection()
+        with conn:
+            expired = conn.execute('DELETE FROM sessions WHERE last_access < ?',
+                                   (self._clock() - self.ttl_seconds,)).rowcount
+            excess = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0] - self.max_entries
+            evicted = 0
+            if excess > 0:
+                evicted = conn.execute('DELETE FROM sessions WHERE session_id IN '
+                                       '(SELECT session_id FROM sessions ORDER BY last_access LIMIT ?)',
+                                       (excess,)).rowcount
+        with self._lock:
+            self.expirations += expired
+            self.evictions += evicted
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+    def stats(self):
+        self.purge()
+        sessions = len(self)
+        with self._lock:
+            # Compteurs propres à ce processus ; le nombre de sessions est celui de la base partagée
+            return {
+                'backend': 'sqlite',
+                'path': self.path,
+                'sessions': sessions,
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+            }
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    if backend == 'memory':
+        return MemorySessionStore()
+    if backend == 'sqlite':
+        return SqliteSessionStore()
+    raise ValueError(f"SESSION_BACKEND inconnu : {backend!r} (attendu : memory ou sqlite)")
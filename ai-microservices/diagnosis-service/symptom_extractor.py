@@ -0,0 +1,91 @@
+"""Reconnaissance des symptômes du vocabulaire contrôlé dans le texte libre du patient.
+
+Les symptômes de diseases_symptoms.json et leurs synonymes (symptom_synonyms.json :
+formulations françaises et anglaises courantes) sont normalisés comme le texte du
+patient (minuscules, accents et mots vides supprimés) puis compilés une seule fois
+dans un PhraseMatcher : le texte est parcouru en une passe, quel que soit le nombre
+d'expressions. Parmi des correspondances qui se chevauchent, la plus à gauche puis
+la plus longue est retenue (« douleur thoracique » plutôt que « douleur »).
+
+L'identifiant d'un symptôme est sa position dans la liste des symptômes du modèle.
+"""
+import hashlib
+import json
+import logging
+import os
+
+from phrase_matcher import PhraseMatcher
+from shared.text_normalization import normalize_string
+
+logger = logging.getLogger(__name__)
+
+SYMPTOM_SYNONYMS_PATH = os.environ.get(
+    'SYMPTOM_SYNONYMS_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'symptom_synonyms.json'),
+)
+
+
+def load_symptom_synonyms(path=SYMPTOM_SYNONYMS_PATH):
+    """({symptôme: [synonymes]}, empreinte du contenu) ; sans fichier, seuls les libellés sont reconnus."""
+    try:
+        with open(path, 'rb') as f:
+            payload = f.read()
+        data = json.loads(payload.decode('utf-8'))
+        synonyms = {}
+        for entry in data.get('symptoms', []):
+            synonyms.setdefault(entry['symptom'], []).extend(entry.get('synonyms', []))
+        return synonyms, hashlib.sha256(payload).hexdigest()
+    except FileNotFoundError:
+        logger.warning("Le fichier %s n'a pas été trouvé.", path)
+    except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+        logger.error("Impossible de décoder %s. Vérifiez le format JSON.", path)
+    return {}, hashlib.sha256(b'').hexdigest()
+
+
+class SymptomExtractor:
+
+    def __init__(self, symptoms, synonyms=None):
+        self.symptoms = list(symptoms)
+        self.matcher = PhraseMatcher()
+        for symptom_id, symptom in enumerate(self.symptoms):
+            self.matcher.add(normalize_string(symptom), symptom_id)
+        # Libellés comparés espaces normalisés : certains contiennent des espaces insécables
+        ids = {" ".join(symptom.split()): symptom_id for symptom_id, symptom in enumerate(self.symptoms)}
+        unknown = []
+        for symptom, phrases in (synonyms or {}).items():
+            symptom_id = ids.get(" ".join(symptom.split()))
+            if symptom_id is None:
+                unknown.append(symptom)
+                continue
+            for phrase in phrases:
+                self.matcher.add(normalize_string(phrase), symptom_id)
+        if unknown:
+            logger.warning("Synonymes ignorés pour des symptômes inconnus du modèle : %s.", ', '.join(unknown))
+        self.matcher.build()
+
+    def __len__(self):
+        return len(self.matcher)
+
+    def extract(self, normalized_text):
+        """Symptômes reconnus dans un texte normalisé, sans chevauchement, dans l'ordre du texte."""
+        selected = []
+        end = 0
+        for match in sorted(self.matcher.find_all(normalized_text), key=lambda m: (m.start, m.start - m.end)):
+            if match.start >= end:
+                selected.append(match)
+                end = match.end
+        return selected
+
+    @staticmethod
+    def symptom_ids(matches):
+        """Identifiants distincts des symptômes reconnus, triés : le vecteur binaire creux du modèle."""
+        return sorted({match.value for match in matches})
+
+    def names(self, matches):
+        return [self.symptoms[symptom_id] for symptom_id in self.symptom_ids(matches)]
+
+    def describe(self, matches):
+        return [
+            {"symptome": self.symptoms[match.value], "expression": match.phrase, "debut": match.start, "fin": match.end}
+            for match in matches
+        ]
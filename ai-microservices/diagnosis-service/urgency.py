@@ -0,0 +1,58 @@
+"""Détection des symptômes d'urgence à partir d'un lexique chargé depuis un fichier.
+
+Chaque symptôme d'urgence et ses synonymes sont normalisés puis compilés une
+seule fois dans un PhraseMatcher : le coût d'une analyse ne dépend que de la
+longueur du texte, pas de la taille du lexique.
+"""
+import json
+import os
+
+from phrase_matcher import PhraseMatcher
+from shared.text_normalization import normalize_string
+
+URGENCY_LEXICON_PATH = os.environ.get(
+    'URGENCY_LEXICON_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'urgent_symptoms.json'),
+)
+
+
+def load_urgency_lexicon(path=URGENCY_LEXICON_PATH):
+    """Retourne {symptôme d'urgence: [synonymes]} lu depuis le fichier JSON."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {entry['symptom']: list(entry.get('synonyms', [])) for entry in data.get('symptoms', [])}
+
+
+class UrgencyDetector:
+
+    def __init__(self, lexicon):
+        self.symptoms = list(lexicon)
+        self.matcher = PhraseMatcher()
+        for symptom, synonyms in lexicon.items():
+            for phrase in [symptom] + synonyms:
+                self.matcher.add(normalize_string(phrase), symptom)
+        self.matcher.build()
+
+    @classmethod
+    def from_file(cls, path=URGENCY_LEXICON_PATH):
+        return cls(load_urgency_lexicon(path))
+
+    def __len__(self):
+        return len(self.matcher)
+
+    def scan(self, normalized_text, state=0, offset=0):
+        """Analyse la suite d'un texte normalisé à partir de l'état `state`.
+
+        `offset` est le nombre de mots déjà analysés : les positions retournées
+        sont relatives au texte complet. Retourne (correspondances, état, offset).
+        """
+        words = normalized_text.split()
+        matches, state = self.matcher.scan(words, state, offset)
+        return matches, state, offset + len(words)
+
+    @staticmethod
+    def describe(matches):
+        return [
+            {"symptome": match.value, "expression": match.phrase, "debut": match.start, "fin": match.end}
+            for match in matches
+        ]
@@ -0,0 +1,62 @@
+"""Pré-remplit le cache LLM avec la réponse finale de /predict pour chaque maladie connue.
+
+Usage (au déploiement, service RAG démarré si possible) :
+    python warm_llm_cache.py [--confidences 10 20 ...] [--limit N] [--dry-run]
+
+Pour chaque maladie du modèle, le prompt est construit exactement comme dans
+/predict : extrait RAG, spécialité recommandée et confiance. Sans
+--confidences, la confiance utilisée est celle que le modèle donne à la
+maladie pour ses propres symptômes. Les prompts déjà en cache ne coûtent
+aucun appel.
+"""
+import argparse
+import time
+
+import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--confidences', type=float, nargs='*', default=None,
+                        help="Confiances (en %%) à pré-calculer pour chaque maladie")
+    parser.add_argument('--limit', type=int, default=None, help="Nombre maximal de maladies")
+    parser.add_argument('--dry-run', action='store_true', help="Affiche les prompts sans appeler le LLM")
+    args = parser.parse_args()
+
+    knowledge = app.knowledge_reloader.current
+    if knowledge.model is None:
+        raise SystemExit("Le modèle n'a pas été entraîné : rien à pré-calculer.")
+    if app.llm_cache is None and not args.dry_run:
+        raise SystemExit("Le cache LLM est désactivé (LLM_CACHE_ENABLED=0).")
+
+    diseases = [str(disease) for disease in knowledge.model.classes[:args.limit]]
+    own_confidences = {}
+    if args.confidences is None:
+        for position, disease in enumerate(diseases):
+            text = " ".join(app.normalize_string(s) for s in knowledge.symptoms_db.get(disease, []))
+            # Même scoring que /predict : symptômes reconnus, TF-IDF du texte sinon
+            symptom_ids = knowledge.symptom_extractor.symptom_ids(knowledge.symptom_extractor.extract(text))
+            own_confidences[disease] = round(knowledge.model.predict_proba(text, symptom_ids)[position], 2) * 100
+
+    start = time.perf_counter()
+    prompts = set()
+    for disease in diseases:
+        rag_info = app.rag_client.lookup(disease)
+        specialty_for_disease = app.recommended_specialty(disease, app.get_suggested_doctors(disease, knowledge=knowledge))
+        for confidence in args.confidences or [own_confidences[disease]]:
+            prompt = app.build_final_prompt(disease, confidence, rag_info, specialty_for_disease)
+            if prompt in prompts:
+                continue
+            prompts.add(prompt)
+            if args.dry_run:
+                print(prompt)
+            else:
+                app.llm.chat(prompt, temperature=0.7, max_tokens=1000)
+
+    print(f"{len(prompts)} prompts pour {len(diseases)} maladies en {time.perf_counter() - start:.1f} s.")
+    if app.llm_cache is not None:
+        print(f"Cache LLM : {app.llm_cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,163 +1,122 @@
-import json
-import pandas as pd
-from flask import Flask, request, jsonify
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-import re
+import hmac
+import logging
 import os
-from PyPDF2 import PdfReader
+import sys
+
+# Rendre importable le paquet shared/ commun aux services
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask, request, jsonify
+
+from shared.metrics import REGISTRY as metrics, instrument_app
+from shared.profiling import install_profiling
+
+from rag_core.artifact import load_index
+from rag_core.client import LocalRagClient
+from rag_core.generations import IndexManager
+from rag_core.ingestion import build_index
+from rag_core.index import SOURCES
+from rag_core.query_cache import QueryCache
+from rag_core.retrieval import DEFAULT_TOP_K, MAX_BATCH_QUERIES, MAX_TOP_K
+from rag_core.stats_cube import DIMENSIONS, CubeManager
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Initialiser le TfidfVectorizer
-vectorizer = TfidfVectorizer()
+# Durée des requêtes par route et GET /metrics (format Prometheus) ; étapes de recherche : rag_core/retrieval.py
+instrument_app(app)
+
 
-# Fonction pour extraire le texte d'un PDF
-def extract_text_from_pdf(pdf_path):
-    text = ""
+def load_rag_index():
+    # Charger l'artefact prébuilt (build_index.py) ; reconstruire en mémoire seulement s'il n'existe pas
     try:
-        with open(pdf_path, 'rb') as file:
-            reader = PdfReader(file)
-            for page_num in range(len(reader.pages)):
-                text += reader.pages[page_num].extract_text()
+        index = load_index()
+        if index is not None:
+            logger.info("Index RAG %s chargé depuis l'artefact (%d lignes).", index.version, len(index))
+            return index
+        logger.info("Aucun artefact d'index trouvé, construction de l'index en mémoire.")
     except Exception as e:
-        print(f"Erreur lors de l'extraction du texte du PDF {pdf_path}: {e}")
-    return text
-
-# Charger les données
-try:
-    # Obtenir le chemin absolu du répertoire du script
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # Construire les chemins absolus vers les fichiers de données
-    csv_path = os.path.join(script_dir, '..', '..', 'src', 'app', 'data', 'Data in text format (CSV).csv')
-    json_path = os.path.join(script_dir, '..', 'diagnosis-service', 'diseases_symptoms.json')
-    pdf_dir = os.path.join(script_dir, '..', '..', 'src', 'app', 'data')
-
-    # Charger les données CSV
-    df = pd.read_csv(csv_path, sep=';')
-    # Nettoyer et préparer les données
-    df['cause_initiale_classe'] = df['cause_initiale_classe'].fillna('')
-    df['cause_initiale_bloc'] = df['cause_initiale_bloc'].fillna('')
-    df['cause_initiale_chapitre'] = df['cause_initiale_chapitre'].fillna('')
-    
-    # Combiner les colonnes pertinentes pour la recherche
-    df['combined_text'] = df['cause_initiale_classe'] + ' ' + \
-                          df['cause_initiale_bloc'] + ' ' + \
-                          df['cause_initiale_chapitre']
-    
-    # Charger les données de diseases_symptoms.json
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            diseases_data = json.load(f)
-        
-        # Créer un DataFrame à partir des données de maladies et symptômes
-        diseases_list = []
-        for disease, symptoms in diseases_data['diseases'].items():
-            diseases_list.append({
-                'disease_name': disease,
-                'symptoms': ' '.join(symptoms)
-            })
-        df_diseases = pd.DataFrame(diseases_list)
-        
-        # Charger les données PDF
-        pdf_texts = []
-        pdf_filenames = []
-        for filename in os.listdir(pdf_dir):
-            if filename.endswith('.pdf'):
-                pdf_path = os.path.join(pdf_dir, filename)
-                text = extract_text_from_pdf(pdf_path)
-                if text:
-                    pdf_texts.append(text)
-                    pdf_filenames.append(filename)
-        
-        df_pdfs = pd.DataFrame({
-            'pdf_name': pdf_filenames,
-            'content': pdf_texts
-        })
-
-        # Prétraitement du texte
-        nltk.download('punkt', quiet=True)
-        nltk.download('stopwords', quiet=True)
-        stop_words = set(stopwords.words('french'))
-
-        def preprocess_text(text):
-            text = text.lower()
-            text = re.sub(r'\W', ' ', text) # Supprimer la ponctuation
-            tokens = word_tokenize(text, language='french')
-            tokens = [word for word in tokens if word.isalpha() and word not in stop_words]
-            return ' '.join(tokens)
-
-        df['processed_text'] = df['combined_text'].apply(preprocess_text)
-        df_diseases['processed_text'] = df_diseases['symptoms'].apply(preprocess_text)
-        df_pdfs['processed_text'] = df_pdfs['content'].apply(preprocess_text)
-
-        # Combiner tous les textes traités pour la vectorisation
-        combined_processed_texts = df['processed_text'].tolist() + \
-                                   df_diseases['processed_text'].tolist() + \
-                                   df_pdfs['processed_text'].tolist()
-
-        # Créer la matrice TF-IDF pour tous les textes
-        tfidf_matrix = vectorizer.fit_transform(combined_processed_texts)
-        
-        # Créer un DataFrame combiné pour retrouver l'origine des résultats
-        df_combined = pd.concat([
-            df, 
-            df_diseases.rename(columns={'disease_name': 'cause_initiale_classe', 'symptoms': 'combined_text'}),
-            df_pdfs.rename(columns={'pdf_name': 'cause_initiale_classe', 'content': 'combined_text'})
-        ], ignore_index=True)
-        df_combined['source'] = ['csv'] * len(df) + ['json'] * len(df_diseases) + ['pdf'] * len(df_pdfs)
-
-    except FileNotFoundError:
-        print("Fichier diseases_symptoms.json ou PDF non trouvé. Le service RAG fonctionnera uniquement avec les données CSV.")
-        # Fallback to CSV only if JSON/PDFs are not found
-        nltk.download('punkt', quiet=True)
-        nltk.download('stopwords', quiet=True)
-        stop_words = set(stopwords.words('french'))
-
-        def preprocess_text(text):
-            text = text.lower()
-            text = re.sub(r'\W', ' ', text)
-            tokens = word_tokenize(text, language='french')
-            tokens = [word for word in tokens if word.isalpha() and word not in stop_words]
-            return ' '.join(tokens)
-
-        df['processed_text'] = df['combined_text'].apply(preprocess_text)
-        tfidf_matrix = vectorizer.fit_transform(df['processed_text'].tolist())
-        df_combined = df
-        df_combined['source'] = ['csv'] * len(df)
+        logger.warning("Erreur lors du chargement de l'artefact d'index, construction en mémoire : %s", e)
 
+    try:
+        return build_index()
     except Exception as e:
-        print(f"Erreur lors du chargement ou du traitement des données (JSON/PDF) : {e}")
-        # Fallback to CSV only if JSON/PDF processing fails
-        nltk.download('punkt', quiet=True)
-        nltk.download('stopwords', quiet=True)
-        stop_words = set(stopwords.words('french'))
-
-        def preprocess_text(text):
-            text = text.lower()
-            text = re.sub(r'\W', ' ', text)
-            tokens = word_tokenize(text, language='french')
-            tokens = [word for word in tokens if word.isalpha() and word not in stop_words]
-            return ' '.join(tokens)
-
-        df['processed_text'] = df['combined_text'].apply(preprocess_text)
-        tfidf_matrix = vectorizer.fit_transform(df['processed_text'].tolist())
-        df_combined = df
-        df_combined['source'] = ['csv'] * len(df)
-
-except Exception as e:
-    print(f"Erreur lors du chargement ou du traitement du fichier CSV : {e}")
-    df = None
-    tfidf_matrix = None
-    df_combined = None
+        logger.error("Erreur lors du chargement ou du traitement du fichier CSV : %s", e)
+        return None
+
+
+# Génération active de l'index : chaque requête lit index_manager.current une seule fois
+index_manager = IndexManager(load_rag_index())
+
+# Cache des résultats par requête normalisée et options, vidé dès que la version de l'index change
+query_cache = QueryCache(
+    max_entries=int(os.environ.get('RAG_CACHE_SIZE', 2048)),
+    ttl_seconds=float(os.environ.get('RAG_CACHE_TTL', 600)),
+)
+
+# Recherche en processus (rag_core/client.py) : le même client sert /rag et le mode RAG_MODE=local du diagnostic
+rag_client = LocalRagClient(index_manager, query_cache)
+
+# Cube des décès pour /stats, mis à jour au démarrage avec les seules lignes ajoutées au CSV
+stats_manager = CubeManager.open()
+
+# Jauges lues à chaque GET /metrics
+metrics.gauge('rag_query_cache_entries', "Résultats en cache dans ce processus.", lambda: query_cache.stats()['entries'])
+metrics.gauge('rag_query_cache_lookups', "Lectures du cache de requêtes de ce processus, par résultat.",
+              lambda: {'hit': query_cache.hits, 'miss': query_cache.misses}, ('result',))
+metrics.gauge('rag_index_rows', "Lignes vivantes de la génération active de l'index.",
+              lambda: len(index_manager.current) if index_manager.current is not None else None)
+metrics.gauge('rag_index_segments', "Segments de la génération active de l'index.",
+              lambda: len(index_manager.current.segments) if index_manager.current is not None else None)
+metrics.gauge('rag_index_updates', "Mises à jour de l'index faites par ce processus, par type.",
+              lambda: {'ingest': index_manager.ingests, 'merge': index_manager.merges, 'reload': index_manager.reloads},
+              ('kind',))
+
+# Jeton attendu dans l'en-tête X-Admin-Token pour les routes d'administration
+ADMIN_TOKEN = os.environ.get('RAG_ADMIN_TOKEN')
+
+
+def is_admin_request():
+    # Comparaison en temps constant, sur les octets (compare_digest refuse les chaînes non ASCII)
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(),
+                                                     ADMIN_TOKEN.encode())
+
+
+# Profilage à la demande (en-tête X-Profile des administrateurs) ou par tirage au sort (PROFILE_SAMPLE_RATE),
+# profils consultables par GET /admin/profiles (voir shared/profiling.py)
+profiler = install_profiling(app, is_admin_request, sample_paths=('/rag', '/rag/batch'))
+
+
+@app.before_request
+def start_index_manager():
+    # Thread de fusion et surveillance de l'artefact, démarrés dans chaque worker après le fork
+    index_manager.ensure_started()
+    stats_manager.ensure_started()
+
+
+def shutdown():
+    index_manager.shutdown()
+    stats_manager.shutdown()
+
+
+def parse_search_options(data):
+    # Options communes à /rag et /rag/batch : nombre de résultats et filtre de source
+    try:
+        k = min(max(int(data.get('k', DEFAULT_TOP_K)), 1), MAX_TOP_K)
+    except (TypeError, ValueError):
+        return None, None, "Le paramètre 'k' doit être un entier."
+    source = data.get('source')
+    if source is not None and source not in SOURCES:
+        return None, None, f"Source inconnue : {source}. Valeurs possibles : {', '.join(SOURCES)}."
+    return k, source, None
+
 
 @app.route('/rag', methods=['POST'])
 def rag_service():
-    if df_combined is None or tfidf_matrix is None:
+    if index_manager.current is None:
         return jsonify({"error": "Base de connaissances non disponible. Erreur de chargement des données."}), 500
 
     data = request.get_json()
@@ -166,48 +125,155 @@ def rag_service():
     if not user_query:
         return jsonify({"response": "Veuillez fournir une requête."})
 
-    # Prétraiter la requête de l'utilisateur
-    processed_query = preprocess_text(user_query)
-    query_vector = vectorizer.transform([processed_query])
-
-    # Calculer la similarité cosinus
-    similarities = cosine_similarity(query_vector, tfidf_matrix)
-    
-    # Obtenir l'index de la maladie la plus similaire
-    most_similar_index = similarities.argmax()
-    
-    # Récupérer les informations de la maladie la plus pertinente
-    if similarities[0, most_similar_index] > 0.1:  # Seuil de similarité
-        relevant_info = df_combined.iloc[most_similar_index]
-        
-        response_message = {
-            "source": relevant_info['source'],
-            "similarite": float(similarities[0, most_similar_index])
-        }
-        
-        if relevant_info['source'] == 'csv':
-            response_message.update({
-                "classe": relevant_info['cause_initiale_classe'],
-                "bloc": relevant_info['cause_initiale_bloc'],
-                "chapitre": relevant_info['cause_initiale_chapitre'],
-                "annee_deces": str(relevant_info['annee_deces']),
-                "sexe": relevant_info['sexe'],
-                "classe_age": relevant_info['classe_age']
-            })
-        elif relevant_info['source'] == 'json':
-            response_message.update({
-                "maladie": relevant_info['cause_initiale_classe'],
-                "symptomes": relevant_info['combined_text']
-            })
-        elif relevant_info['source'] == 'pdf':
-            response_message.update({
-                "document_pdf": relevant_info['cause_initiale_classe'],
-                "contenu_extrait": relevant_info['combined_text'][:500] + "..." # Limiter le contenu pour la réponse
-            })
+    k, source, error = parse_search_options(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    return jsonify(rag_client.search(user_query, k, source))
+
+@app.route('/rag/batch', methods=['POST'])
+def rag_batch():
+    if index_manager.current is None:
+        return jsonify({"error": "Base de connaissances non disponible. Erreur de chargement des données."}), 500
+
+    data = request.get_json()
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        return jsonify({"error": "Le champ 'queries' doit être une liste de chaînes."}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({"error": f"Au plus {MAX_BATCH_QUERIES} requêtes par lot."}), 400
+
+    k, source, error = parse_search_options(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Une liste de résultats par requête, dans l'ordre des requêtes
+    return jsonify({"resultats": rag_client.search_many(queries, k, source)})
+
+@app.route('/stats', methods=['GET', 'POST'])
+def stats():
+    # Décès filtrés et regroupés par cause, année, sexe et classe d'âge (voir rag_core/stats_cube.py)
+    cube = stats_manager.current
+    if cube is None:
+        return jsonify({"error": "Statistiques non disponibles. Erreur de chargement des données."}), 500
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Corps JSON attendu."}), 400
+        filters = data.get('filters', {})
+        group_by = data.get('group_by', [])
     else:
-        response_message = {"response": "Je n'ai pas trouvé d'informations pertinentes pour votre requête dans ma base de connaissances."}
+        # GET /stats?cause_initiale_classe=...&group_by=annee_deces : paramètres répétables
+        filters = {name: request.args.getlist(name) for name in request.args if name != 'group_by'}
+        group_by = request.args.getlist('group_by')
+    if not isinstance(filters, dict):
+        return jsonify({"error": "Le champ 'filters' doit être un objet dimension -> valeur(s)."}), 400
+    if not isinstance(group_by, list) or not all(isinstance(dimension, str) for dimension in group_by):
+        return jsonify({"error": "Le champ 'group_by' doit être une liste de dimensions."}), 400
+
+    try:
+        total, groups = cube.query(filters, group_by)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"version": cube.version, "filters": filters, "group_by": group_by,
+                    "total": total, "resultats": groups})
+
+@app.route('/stats/dimensions', methods=['GET'])
+def stats_dimensions():
+    cube = stats_manager.current
+    if cube is None:
+        return jsonify({"error": "Statistiques non disponibles. Erreur de chargement des données."}), 500
+    return jsonify({"version": cube.version,
+                    "dimensions": {dimension: cube.dimension_values(dimension) for dimension in DIMENSIONS}})
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Vivacité : le processus répond
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Disponibilité : un index est chargé et interrogeable
+    index = index_manager.current
+    if index is None:
+        return jsonify({"status": "not_ready", "index": None}), 503
+    return jsonify({"status": "ready", "index": {"version": index.version, "origin": index.origin, "rows": len(index)}})
+
+@app.route('/rag/cache', methods=['GET'])
+def rag_cache_stats():
+    return jsonify(query_cache.stats())
+
+@app.route('/admin/reload', methods=['POST'])
+def reload_rag_index():
+    # Recharge l'artefact actif (par exemple après build_index.py) sans redémarrer le service
+    if not is_admin_request():
+        return jsonify({"error": "Accès réservé à l'administration."}), 403
+
+    previous = index_manager.current
+    previous_version = previous.version if previous is not None else None
+    index = load_rag_index()
+    if index is None:
+        return jsonify({"error": "Rechargement impossible, l'index actuel est conservé."}), 500
+    index_manager.publish(index)
+    if index.version != previous_version:
+        query_cache.clear()
+    return jsonify({"version": index.version, "previous_version": previous_version, "rows": len(index)})
+
+@app.route('/admin/ingest', methods=['POST'])
+def ingest():
+    # Ajoute des lignes CSV, des fichiers du dossier de données et/ou supprime des lignes,
+    # puis publie la nouvelle génération de l'index
+    if not is_admin_request():
+        return jsonify({"error": "Accès réservé à l'administration."}), 403
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Corps JSON attendu."}), 400
+    rows = data.get('rows', [])
+    csv_files = data.get('csv_files', [])
+    pdf_files = data.get('pdf_files', [])
+    deletions = data.get('delete', [])
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        return jsonify({"error": "Le champ 'rows' doit être une liste d'objets."}), 400
+    if not all(isinstance(files, list) for files in (csv_files, pdf_files)):
+        return jsonify({"error": "Les champs 'csv_files' et 'pdf_files' doivent être des listes de noms de fichiers."}), 400
+    if not isinstance(deletions, list) or not all(isinstance(filters, dict) and filters for filters in deletions):
+        return jsonify({"error": "Le champ 'delete' doit être une liste de filtres (objets colonne -> valeur)."}), 400
+    if index_manager.current is None:
+        return jsonify({"error": "Base de connaissances non disponible. Erreur de chargement des données."}), 500
+
+    try:
+        report = index_manager.ingest(rows, csv_files, pdf_files, deletions, merge_now=bool(data.get('merge')))
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Erreur lors de la mise à jour de l'index, génération conservée : %s", e)
+        return jsonify({"error": "Mise à jour impossible, l'index actuel est conservé."}), 500
+    return jsonify(dict(report, index=index_manager.current.describe()))
+
+@app.route('/admin/stats', methods=['GET', 'POST'])
+def refresh_stats():
+    # POST : ajoute au cube les lignes ajoutées à la fin du CSV (reconstruction si le début a changé)
+    if not is_admin_request():
+        return jsonify({"error": "Accès réservé à l'administration."}), 403
+    if request.method == 'POST':
+        try:
+            stats_manager.refresh()
+        except (OSError, ValueError) as e:
+            logger.exception("Échec de la mise à jour du cube statistique, version conservée : %s", e)
+            return jsonify({"error": "Mise à jour impossible, le cube actuel est conservé."}), 500
+    cube = stats_manager.current
+    return jsonify({"cube": cube.describe() if cube is not None else None, "last_refresh": stats_manager.last_refresh,
+                    "refreshes": stats_manager.refreshes, "reloads": stats_manager.reloads})
 
-    return jsonify(response_message)
+@app.route('/admin/index', methods=['GET'])
+def index_stats():
+    # Segments de la génération active, derniers ajouts et fusions (avec leurs durées)
+    if not is_admin_request():
+        return jsonify({"error": "Accès réservé à l'administration."}), 403
+    return jsonify(index_manager.stats())
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5002)
+    # Serveur de développement ; en production : gunicorn -c gunicorn.conf.py app:app
+    app.run(host='0.0.0.0', port=5002, debug=os.environ.get('FLASK_DEBUG') == '1')
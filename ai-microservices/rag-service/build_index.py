@@ -0,0 +1,68 @@
+"""Construit hors ligne l'artefact d'index du service RAG.
+
+Usage :
+    python build_index.py [--output DOSSIER] [--keep N] [--verify N]
+
+Le service charge ensuite cet artefact au démarrage au lieu de relire le CSV,
+les PDF et de réajuster le TfidfVectorizer.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+# Rendre importable le paquet shared/ commun aux services
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rag_core.artifact import DEFAULT_INDEX_DIR, artifact_lock, save_index
+from rag_core.ingestion import build_index
+from rag_core.retrieval import compare_with_exhaustive
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construit l'artefact d'index TF-IDF du service RAG.")
+    parser.add_argument('--output', default=DEFAULT_INDEX_DIR, help="Dossier racine de l'artefact")
+    parser.add_argument('--keep', type=int, default=2, help='Nombre de versions conservées sur disque')
+    parser.add_argument('--verify', type=int, default=0, metavar='N',
+                        help="Vérifie sur N requêtes tirées du corpus que l'index inversé classe "
+                             "comme le calcul exhaustif")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    start = time.perf_counter()
+    index = build_index()
+    # Le verrou évite d'écraser un ajout en cours dans le service (POST /admin/ingest)
+    with artifact_lock(args.output):
+        version = save_index(index, args.output, keep=args.keep)
+    elapsed = time.perf_counter() - start
+
+    print(f"Index {version} écrit dans {args.output} : {len(index)} lignes, {index.terms} termes ({elapsed:.1f} s).")
+
+    if args.verify:
+        queries = sample_queries(index, args.verify)
+        mismatches = compare_with_exhaustive(index, queries, k=10)
+        print(f"Vérification : {len(queries) - len(mismatches)}/{len(queries)} classements identiques.")
+        if mismatches:
+            for query in mismatches[:10]:
+                print(f"  Classement différent pour : {query!r}")
+            sys.exit(1)
+
+
+def sample_queries(index, count, seed=0):
+    # Requêtes de 1 à 4 mots consécutifs tirées de lignes aléatoires de l'index
+    rng = random.Random(seed)
+    texts = index.base.metadata.columns['combined_text']
+    queries = []
+    while len(queries) < count and len(texts):
+        words = texts[rng.randrange(len(texts))].split()
+        if words:
+            size = rng.randint(1, min(4, len(words)))
+            start = rng.randrange(len(words) - size + 1)
+            queries.append(' '.join(words[start:start + size]))
+    return queries
+
+
+if __name__ == '__main__':
+    main()
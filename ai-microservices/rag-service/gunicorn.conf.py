@@ -0,0 +1,20 @@
+"""Configuration gunicorn du service RAG (production).
+
+Usage (depuis ai-microservices/rag-service) :
+    gunicorn -c gunicorn.conf.py app:app
+
+Variables : BIND (0.0.0.0:5002), WEB_CONCURRENCY (un worker par cœur),
+GUNICORN_THREADS, GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT. L'index est
+chargé une fois dans le processus maître ; les matrices projetées en mémoire
+(build_index.py) sont de plus partagées par le cache de pages du système.
+Avec plusieurs workers, METRICS_DIR permet à GET /metrics d'additionner les
+métriques de tous les workers.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from shared.serving import settings
+
+globals().update(settings(default_port=5002))
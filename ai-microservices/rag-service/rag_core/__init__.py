@@ -0,0 +1 @@
+"""Coeur du service RAG : ingestion du corpus, index TF-IDF et artefact persisté."""
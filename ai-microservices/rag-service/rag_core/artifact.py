@@ -0,0 +1,228 @@
+"""Artefact d'index persisté sur disque et chargé en memmap au démarrage du service.
+
+Arborescence :
+
+    <racine>/CURRENT                              nom de la version active
+    <racine>/<version>/manifest.json              segments, paramètres du vectorizer, statistiques
+    <racine>/<version>/vocabulary.json
+    <racine>/<version>/idf.npy                    idf de la génération
+    <racine>/<version>/document_frequencies.npy   fréquences documentaires à jour
+    <racine>/<version>/deleted/<segment>.npy      lignes supprimées d'un segment depuis la fusion
+    <racine>/segments/<segment>/counts.{data,indices,indptr}.npy    comptes bruts des termes
+    <racine>/segments/<segment>/tfidf.{data,indices,indptr}.npy     matrice CSR brute
+    <racine>/segments/<segment>/postings.{data,indices,indptr}.npy  matrice termes × lignes normalisée
+    <racine>/segments/<segment>/max_weights.npy                     poids maximal par terme
+    <racine>/segments/<segment>/metadata/                           colonnes de df_combined
+
+Un segment n'est jamais modifié une fois écrit : une version ne fait que
+référencer ses segments, et un ajout n'écrit que le nouveau delta. Les
+segments qu'aucune version conservée ne référence sont supprimés.
+
+Les tableaux sont ouverts avec mmap_mode='r' : plusieurs workers partagent
+les mêmes pages du cache du système au lieu d'en garder chacun une copie.
+"""
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from scipy import sparse
+
+from .index import VECTORIZER_PARAMS, RagIndex, Segment, query_vectorizer
+from .metadata import MetadataTable
+
+FORMAT_VERSION = 5
+
+DEFAULT_INDEX_DIR = os.environ.get(
+    'RAG_INDEX_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'index')
+)
+
+SEGMENTS_DIR = 'segments'
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def save_index(index, root_dir=DEFAULT_INDEX_DIR, keep=2):
+    """Écrit la génération sous le nom index.version puis bascule CURRENT dessus de manière atomique.
+
+    Seuls les segments absents du disque sont écrits.
+    """
+    os.makedirs(os.path.join(root_dir, SEGMENTS_DIR), exist_ok=True)
+    version = index.version
+    version_dir = os.path.join(root_dir, version)
+    if not os.path.isdir(version_dir):
+        for segment in index.segments:
+            _save_segment(root_dir, segment)
+
+        tmp_dir = os.path.join(root_dir, f'.tmp-{version}-{uuid.uuid4().hex[:8]}')
+        os.makedirs(os.path.join(tmp_dir, 'deleted'))
+        vectorizer = index.vectorizer
+        with open(os.path.join(tmp_dir, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump(list(vectorizer.vocabulary), f, ensure_ascii=False)
+        np.save(os.path.join(tmp_dir, 'idf.npy'), np.asarray(vectorizer.idf_, dtype=np.float64))
+        np.save(os.path.join(tmp_dir, 'document_frequencies.npy'), index.document_frequencies)
+        for segment in index.segments:
+            if segment.deleted is not None:
+                np.save(os.path.join(tmp_dir, 'deleted', f'{segment.segment_id}.npy'), segment.deleted)
+
+        params = vectorizer.get_params()
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'version': version,
+            'generation': index.generation,
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'terms': index.terms,
+            'n_docs': int(index.n_docs),
+            'segments': [{'id': segment.segment_id, 'rows': len(segment), 'terms': segment.n_terms,
+                          'deleted': segment.deleted is not None}
+                         for segment in index.segments],
+            'vectorizer': {name: list(params[name]) if isinstance(params[name], tuple) else params[name]
+                           for name in VECTORIZER_PARAMS},
+            'build_report': index.build_report,
+        }
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(tmp_dir, version_dir)
+
+    _write_current(root_dir, version)
+    _prune_versions(root_dir, keep, version)
+    return version
+
+
+def active_version(root_dir=DEFAULT_INDEX_DIR):
+    """Nom de la version active, ou None s'il n'y a pas d'artefact."""
+    try:
+        with open(os.path.join(root_dir, 'CURRENT'), 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def load_index(root_dir=DEFAULT_INDEX_DIR, mmap_mode='r'):
+    """Charge la version active de l'artefact, ou retourne None s'il n'y en a pas."""
+    version = active_version(root_dir)
+    if version is None:
+        return None
+    version_dir = os.path.join(root_dir, version)
+
+    with open(os.path.join(version_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ArtifactError(
+            f"Version de format {manifest.get('format_version')} non supportée (attendue : {FORMAT_VERSION}). "
+            f"Reconstruisez l'index avec build_index.py."
+        )
+
+    with open(os.path.join(version_dir, 'vocabulary.json'), 'r', encoding='utf-8') as f:
+        terms = json.load(f)
+    params = dict(manifest['vectorizer'])
+    params['ngram_range'] = tuple(params['ngram_range'])
+    vectorizer = query_vectorizer(terms, np.load(os.path.join(version_dir, 'idf.npy')), params)
+
+    segments = []
+    for entry in manifest['segments']:
+        deleted = None
+        if entry['deleted']:
+            deleted = np.load(os.path.join(version_dir, 'deleted', f"{entry['id']}.npy"))
+        segments.append(_load_segment(root_dir, entry, deleted, mmap_mode))
+
+    return RagIndex(vectorizer, segments, np.load(os.path.join(version_dir, 'document_frequencies.npy')),
+                    manifest['n_docs'], version=manifest['version'], origin='artifact',
+                    build_report=manifest.get('build_report'), generation=manifest.get('generation', 0))
+
+
+@contextmanager
+def artifact_lock(root_dir=DEFAULT_INDEX_DIR):
+    """Verrou exclusif entre processus sur l'artefact, pour une lecture-modification-écriture."""
+    os.makedirs(root_dir, exist_ok=True)
+    with open(os.path.join(root_dir, '.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _save_segment(root_dir, segment):
+    segment_dir = os.path.join(root_dir, SEGMENTS_DIR, segment.segment_id)
+    if os.path.isdir(segment_dir):
+        return
+    tmp_dir = os.path.join(root_dir, SEGMENTS_DIR, f'.tmp-{segment.segment_id}-{uuid.uuid4().hex[:8]}')
+    os.makedirs(tmp_dir)
+    _save_csr(tmp_dir, 'counts', segment.counts)
+    _save_csr(tmp_dir, 'tfidf', segment.tfidf_matrix)
+    _save_csr(tmp_dir, 'postings', segment.term_doc_matrix)
+    np.save(os.path.join(tmp_dir, 'max_weights.npy'), segment.inverted_index.max_weights)
+    segment.metadata.save(os.path.join(tmp_dir, 'metadata'))
+    os.rename(tmp_dir, segment_dir)
+
+
+def _load_segment(root_dir, entry, deleted, mmap_mode):
+    segment_dir = os.path.join(root_dir, SEGMENTS_DIR, entry['id'])
+    rows, terms = entry['rows'], entry['terms']
+    return Segment(
+        entry['id'],
+        counts=_load_csr(segment_dir, 'counts', (rows, terms), mmap_mode),
+        tfidf_matrix=_load_csr(segment_dir, 'tfidf', (rows, terms), mmap_mode),
+        metadata=MetadataTable.load(os.path.join(segment_dir, 'metadata'), mmap_mode=mmap_mode),
+        term_doc_matrix=_load_csr(segment_dir, 'postings', (terms, rows), mmap_mode),
+        max_weights=np.load(os.path.join(segment_dir, 'max_weights.npy'), mmap_mode=mmap_mode),
+        deleted=deleted,
+    )
+
+
+def _save_csr(directory, name, matrix):
+    np.save(os.path.join(directory, f'{name}.data.npy'), matrix.data)
+    np.save(os.path.join(directory, f'{name}.indices.npy'), matrix.indices)
+    np.save(os.path.join(directory, f'{name}.indptr.npy'), matrix.indptr)
+
+
+def _load_csr(directory, name, shape, mmap_mode):
+    return sparse.csr_matrix(
+        (
+            np.load(os.path.join(directory, f'{name}.data.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, f'{name}.indices.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, f'{name}.indptr.npy'), mmap_mode=mmap_mode),
+        ),
+        shape=shape,
+        copy=False,
+    )
+
+
+def _write_current(root_dir, version):
+    tmp_path = os.path.join(root_dir, f'.CURRENT-{uuid.uuid4().hex[:8]}')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(root_dir, 'CURRENT'))
+
+
+def _prune_versions(root_dir, keep, current):
+    # Les versions les plus anciennes d'abord ; la version active n'est jamais supprimée
+    versions = sorted(
+        (name for name in os.listdir(root_dir)
+         if not name.startswith('.') and name not in ('CURRENT', SEGMENTS_DIR, current)
+         and os.path.isdir(os.path.join(root_dir, name))),
+        key=lambda name: os.path.getmtime(os.path.join(root_dir, name))
+    )
+    for name in versions[:max(len(versions) - (keep - 1), 0)]:
+        shutil.rmtree(os.path.join(root_dir, name), ignore_errors=True)
+
+    # Segments qu'aucune version restante ne référence
+    referenced = set()
+    for name in os.listdir(root_dir):
+        try:
+            with open(os.path.join(root_dir, name, 'manifest.json'), 'r', encoding='utf-8') as f:
+                referenced.update(entry['id'] for entry in json.load(f).get('segments', []))
+        except (OSError, ValueError):
+            continue
+    segments_dir = os.path.join(root_dir, SEGMENTS_DIR)
+    for name in os.listdir(segments_dir):
+        if not name.startswith('.') and name not in referenced:
+            shutil.rmtree(os.path.join(segments_dir, name), ignore_errors=True)
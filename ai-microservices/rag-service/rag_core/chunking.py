@@ -0,0 +1,40 @@
+"""Découpage des PDF en passages chevauchants, avec page et offsets d'origine."""
+import os
+import re
+
+PASSAGE_WORDS = int(os.environ.get('RAG_PASSAGE_WORDS', 120))
+PASSAGE_OVERLAP = int(os.environ.get('RAG_PASSAGE_OVERLAP', 30))
+
+_WORD_RE = re.compile(r'\S+')
+
+
+def chunk_page(text, size=PASSAGE_WORDS, overlap=PASSAGE_OVERLAP):
+    """Découpe le texte d'une page en fenêtres de `size` mots se recouvrant de `overlap` mots.
+
+    Retourne une liste de (debut, fin) : offsets en caractères dans le texte de la page.
+    """
+    if overlap >= size:
+        raise ValueError("Le recouvrement doit être inférieur à la taille des passages.")
+    spans = [match.span() for match in _WORD_RE.finditer(text)]
+    passages = []
+    step = size - overlap
+    for first in range(0, len(spans), step):
+        last = min(first + size, len(spans)) - 1
+        passages.append((spans[first][0], spans[last][1]))
+        if last == len(spans) - 1:
+            break
+    return passages
+
+
+def chunk_pages(pages, size=PASSAGE_WORDS, overlap=PASSAGE_OVERLAP):
+    """Passages d'un document : liste de dicts texte / page (à partir de 1) / debut / fin."""
+    passages = []
+    for page_number, text in enumerate(pages, start=1):
+        for start, end in chunk_page(text, size, overlap):
+            passages.append({
+                'text': text[start:end],
+                'page': page_number,
+                'char_start': start,
+                'char_end': end,
+            })
+    return passages
@@ -0,0 +1,163 @@
+"""Client de recherche en processus : mêmes réponses que POST /rag, sans passer par HTTP.
+
+Le service RAG sert ses routes /rag et /rag/batch avec ce client, et un autre
+service peut l'importer pour interroger directement l'artefact d'index
+(RAG_MODE=local du service de diagnostic) : le classement est le même code
+(retrieval.search), seule la latence du saut HTTP disparaît.
+
+En dehors du service RAG, l'index est suivi en lecture seule par
+ArtifactFollower : l'artefact est ouvert en memmap (les pages sont partagées
+avec les workers du service RAG sur la même machine) et rechargé quand la
+version active change, sans dépendre de l'ingestion (pandas, PyPDF2).
+"""
+import logging
+import os
+import threading
+
+from .artifact import DEFAULT_INDEX_DIR, ArtifactError, active_version, load_index
+from .query_cache import QueryCache
+from .retrieval import DEFAULT_TOP_K, NO_RESULT_MESSAGE, search, search_batch
+
+logger = logging.getLogger(__name__)
+
+RELOAD_INTERVAL = float(os.environ.get('RAG_RELOAD_INTERVAL', 10))
+
+
+class IndexUnavailableError(RuntimeError):
+    pass
+
+
+def search_response(results):
+    """Corps de réponse de /rag pour une liste de résultats."""
+    if not results:
+        return {"response": NO_RESULT_MESSAGE}
+    # Le meilleur passage reste à la racine de la réponse, les k meilleurs dans 'resultats'
+    response = dict(results[0])
+    response["resultats"] = results
+    return response
+
+
+class ArtifactFollower:
+    """Génération de l'artefact d'index en lecture seule, rechargée quand la version active change."""
+
+    def __init__(self, index, root_dir=DEFAULT_INDEX_DIR, interval=RELOAD_INTERVAL):
+        self.current = index
+        self.root_dir = root_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = threading.Event()
+        self.reloads = 0
+
+    @classmethod
+    def open(cls, root_dir=DEFAULT_INDEX_DIR, interval=RELOAD_INTERVAL):
+        """Ouvre l'artefact de `root_dir` ; IndexUnavailableError s'il n'existe pas ou est illisible."""
+        try:
+            index = load_index(root_dir)
+        except ArtifactError as e:
+            raise IndexUnavailableError(f"Artefact d'index illisible dans {root_dir} : {e}") from e
+        if index is None:
+            raise IndexUnavailableError(f"Aucun artefact d'index dans {root_dir} : lancez build_index.py.")
+        return cls(index, root_dir, interval)
+
+    def ensure_started(self):
+        """Démarre la surveillance de l'artefact dans ce processus (une fois par worker)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self.interval > 0:
+                threading.Thread(target=self._watch, name='rag-index-follow', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _sync(self):
+        version = active_version(self.root_dir)
+        if version is None or self.current.version == version:
+            return False
+        index = load_index(self.root_dir)
+        if index is None:
+            return False
+        self.current = index
+        self.reloads += 1
+        logger.info("Index RAG %s rechargé depuis l'artefact (%d lignes)", index.version, len(index))
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sync()
+            except Exception as e:
+                logger.warning("Échec du rechargement de l'artefact d'index, génération conservée : %s", e)
+
+    def shutdown(self):
+        self._stop.set()
+
+
+class LocalRagClient:
+    """Recherche dans la génération active d'un index, avec le cache de requêtes.
+
+    `indexes` est tout objet exposant la génération active dans `current`
+    (IndexManager dans le service RAG, ArtifactFollower ailleurs).
+    """
+
+    mode = 'local'
+
+    def __init__(self, indexes, cache=None):
+        self.indexes = indexes
+        self.cache = cache
+        # Le cache sert la génération publiée, quel que soit l'ordre des versions
+        if cache is not None and cache.reference is None:
+            cache.reference = self._published_version
+
+    def _published_version(self):
+        index = self.indexes.current
+        return index.version if index is not None else None
+
+    @classmethod
+    def from_artifact(cls, root_dir=DEFAULT_INDEX_DIR, interval=RELOAD_INTERVAL, cache=None):
+        return cls(ArtifactFollower.open(root_dir, interval), cache)
+
+    def _index(self):
+        self.indexes.ensure_started()
+        # Une seule lecture de la référence : la recherche reste sur le même index même en cas de rechargement
+        index = self.indexes.current
+        if index is None:
+            raise IndexUnavailableError("Aucun index RAG chargé.")
+        return index
+
+    def search_results(self, query, k=DEFAULT_TOP_K, source=None):
+        """Les k meilleurs passages pour `query` ; IndexUnavailableError si aucun index n'est chargé."""
+        index = self._index()
+        if self.cache is None:
+            return search(index, query, k, source)
+        cache_key = QueryCache.make_key(query, k=k, source=source)
+        results = self.cache.get(index.version, cache_key)
+        if results is None:
+            results = search(index, query, k, source)
+            self.cache.put(index.version, cache_key, results)
+        return results
+
+    def search(self, query, k=DEFAULT_TOP_K, source=None):
+        """Réponse de /rag pour `query`."""
+        return search_response(self.search_results(query, k, source))
+
+    def search_many(self, queries, k=DEFAULT_TOP_K, source=None):
+        """Une liste de résultats par requête, dans l'ordre (réponse de /rag/batch)."""
+        index = self._index()
+        if self.cache is None:
+            return search_batch(index, queries, k, source)
+        # Seules les requêtes absentes du cache sont scorées, en un seul lot
+        cache_keys = [QueryCache.make_key(query, k=k, source=source) for query in queries]
+        results = [self.cache.get(index.version, cache_key) for cache_key in cache_keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            for i, result in zip(missing, search_batch(index, [queries[i] for i in missing], k, source)):
+                results[i] = result
+                self.cache.put(index.version, cache_keys[i], result)
+        return results
+
+    def shutdown(self):
+        shutdown = getattr(self.indexes, 'shutdown', None)
+        if shutdown is not None:
+            shutdown()
@@ -0,0 +1,204 @@
+"""Génération active de l'index, mises à jour et publication par simple affectation.
+
+Chaque requête lit une seule fois `manager.current` et garde cette génération
+jusqu'à sa réponse. Une mise à jour (ajout, suppression, fusion) construit la
+génération suivante à côté de l'active, l'écrit dans l'artefact, puis la
+publie en remplaçant la référence : une requête ne voit jamais un index à
+moitié construit.
+
+Les écritures sont sérialisées par un verrou de fichier sur l'artefact,
+partagé par tous les workers gunicorn. Avant d'écrire, un worker recharge la
+version active si un autre l'a changée ; les autres workers la reprennent
+d'eux-mêmes toutes les RAG_RELOAD_INTERVAL secondes (0 pour désactiver).
+
+Les fusions s'exécutent dans un thread dédié, jamais dans un thread de
+requête ; les ajouts qui arrivent pendant une fusion attendent qu'elle soit
+publiée.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .artifact import DEFAULT_INDEX_DIR, ArtifactError, active_version, artifact_lock, load_index, save_index
+from .ingestion import load_new_rows
+from .updates import add_rows, delete_rows, fold_causes, merge, needs_merge, pending_rows
+
+logger = logging.getLogger(__name__)
+
+RELOAD_INTERVAL = float(os.environ.get('RAG_RELOAD_INTERVAL', 10))
+
+
+class IndexManager:
+    """Détient la génération active de l'index et publie les suivantes."""
+
+    def __init__(self, index, root_dir=DEFAULT_INDEX_DIR, interval=RELOAD_INTERVAL):
+        self.current = index
+        self.root_dir = root_dir
+        self.interval = interval
+        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._pending_merge = None
+        self._stop = threading.Event()
+        self.ingests = 0
+        self.merges = 0
+        self.reloads = 0
+        self.last_ingest = None
+        self.last_merge = None
+
+    def ensure_started(self):
+        """Démarre le thread de fusion et la surveillance de l'artefact dans ce processus (une fois par worker)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Les threads ne survivent pas au fork : un pool et un surveillant par processus
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rag-merge')
+            self._pending_merge = None
+            if self.interval > 0:
+                threading.Thread(target=self._watch, name='rag-index-watch', daemon=True).start()
+            self._pid = os.getpid()
+
+    def publish(self, index):
+        # Remplacement atomique : les requêtes en cours gardent la génération qu'elles ont lue
+        previous, self.current = self.current, index
+        return previous
+
+    def ingest(self, rows=(), csv_files=(), pdf_files=(), deletions=(), merge_now=False):
+        """Ajoute et supprime des lignes, publie la génération obtenue et retourne le compte rendu.
+
+        Lève ValueError pour une demande invalide (avant toute modification de l'index).
+        """
+        start = time.perf_counter()
+        frame, pdf_report = load_new_rows(rows, csv_files, pdf_files)
+        with self._write_lock, artifact_lock(self.root_dir):
+            self._sync()
+            previous = index = self.current
+            if index is None:
+                raise RuntimeError("Aucun index chargé.")
+            # Une cause déjà indexée est remplacée par sa ligne aux comptes cumulés
+            index, updated_causes = fold_causes(index, frame)
+            if len(frame):
+                index = add_rows(index, frame, pdf_report)
+            deleted = 0
+            for filters in deletions:
+                index, removed = delete_rows(index, filters)
+                deleted += removed
+            persisted = index is not previous and self._persist(index)
+            self.publish(index)
+
+        self.ingests += 1
+        self.last_ingest = {
+            'at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'previous_version': previous.version,
+            'version': index.version,
+            'added_rows': len(frame),
+            'updated_causes': updated_causes,
+            'deleted_rows': deleted,
+            'pdf_extraction': pdf_report,
+            'persisted': persisted,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+        }
+        merge_scheduled = merge_now or needs_merge(index)
+        if merge_scheduled:
+            self.request_merge('admin' if merge_now else 'seuil du delta')
+        return dict(self.last_ingest, merge_scheduled=merge_scheduled)
+
+    def request_merge(self, reason):
+        """Planifie une fusion sans attendre ; les demandes concurrentes partagent la même."""
+        self.ensure_started()
+        with self._lock:
+            if self._pending_merge is None or self._pending_merge.done():
+                self._pending_merge = self._executor.submit(self._merge, reason)
+            return self._pending_merge
+
+    def _merge(self, reason):
+        start = time.perf_counter()
+        try:
+            with self._write_lock, artifact_lock(self.root_dir):
+                self._sync()
+                index = self.current
+                if index is None or pending_rows(index) == 0:
+                    return self.last_merge
+                merged = merge(index)
+                persisted = self._persist(merged)
+                self.publish(merged)
+        except Exception as e:
+            self.last_merge = {'reason': reason, 'error': str(e), 'at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            logger.exception("Échec de la fusion de l'index (%s), génération conservée", reason)
+            return self.last_merge
+        self.merges += 1
+        self.last_merge = {
+            'reason': reason,
+            'at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'previous_version': index.version,
+            'version': merged.version,
+            'segments_before': [segment.describe() for segment in index.segments],
+            'rows': len(merged),
+            'terms': merged.terms,
+            'persisted': persisted,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+        }
+        return self.last_merge
+
+    def _persist(self, index):
+        try:
+            save_index(index, self.root_dir)
+            return True
+        except OSError as e:
+            # La génération reste publiée en mémoire dans ce worker
+            logger.warning("Impossible d'écrire la génération %s de l'index : %s", index.version, e)
+            return False
+
+    def _sync(self):
+        """Recharge la version active de l'artefact si un autre processus l'a changée."""
+        version = active_version(self.root_dir)
+        current = self.current
+        if version is None or (current is not None and current.version == version):
+            return False
+        try:
+            index = load_index(self.root_dir)
+        except ArtifactError as e:
+            # Artefact d'un ancien format : la prochaine écriture le remplace
+            logger.warning("Artefact d'index ignoré : %s", e)
+            return False
+        if index is None:
+            return False
+        self.publish(index)
+        self.reloads += 1
+        logger.info("Index RAG %s rechargé depuis l'artefact (%d lignes)", index.version, len(index))
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            if self._write_lock.locked():
+                continue
+            try:
+                with self._write_lock:
+                    self._sync()
+            except Exception as e:
+                logger.warning("Échec du rechargement de l'artefact d'index, génération conservée : %s", e)
+
+    def stats(self):
+        index = self.current
+        pending = self._pending_merge
+        return {
+            'index': index.describe() if index is not None else None,
+            'pending_rows': pending_rows(index) if index is not None else 0,
+            'merge_in_progress': pending is not None and not pending.done(),
+            'watch_interval_seconds': self.interval,
+            'ingests': self.ingests,
+            'merges': self.merges,
+            'reloads': self.reloads,
+            'last_ingest': self.last_ingest,
+            'last_merge': self.last_merge,
+        }
+
+    def shutdown(self):
+        self._stop.set()
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
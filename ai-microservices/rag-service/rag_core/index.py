@@ -0,0 +1,214 @@
+"""Index TF-IDF du service RAG, organisé en segments.
+
+Une génération d'index (RagIndex) se compose d'un segment de base, pondéré à
+la dernière fusion, et au plus d'un segment delta qui reçoit les lignes
+ajoutées depuis (voir updates.py). Les segments partagent le vocabulaire, en
+ajout seul, et le vecteur idf de la génération : leurs scores sont
+directement comparables. Une suppression marque les lignes concernées
+(tombstones), filtrées à la requête puis retirées à la fusion suivante.
+
+Chaque segment garde les comptes bruts de ses termes : une fusion recalcule
+les idf et repondère toutes les lignes sans relire les sources.
+"""
+import time
+import uuid
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from .inverted_index import InvertedIndex
+
+# Sources possibles d'une ligne de l'index
+SOURCES = ('csv', 'json', 'pdf')
+
+# Paramètres du TfidfVectorizer nécessaires pour transformer les requêtes à l'identique
+VECTORIZER_PARAMS = ['lowercase', 'token_pattern', 'ngram_range', 'norm', 'use_idf', 'smooth_idf', 'sublinear_tf']
+
+
+def new_version():
+    """Identifiant d'une génération de l'index, repris comme nom de version de l'artefact.
+
+    Horodatage UTC à la microseconde en tête : l'ordre des chaînes est celui de création.
+    """
+    now = time.time()
+    return f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(now))}.{int(now % 1 * 1e6):06d}-{uuid.uuid4().hex[:8]}"
+
+
+def new_segment_id():
+    return uuid.uuid4().hex[:12]
+
+
+def vectorizer_params(vectorizer):
+    params = vectorizer.get_params()
+    return {name: params[name] for name in VECTORIZER_PARAMS}
+
+
+def query_vectorizer(terms, idf, params=None):
+    """TfidfVectorizer des requêtes sur un vocabulaire figé (termes dans l'ordre des colonnes) et un idf donné."""
+    vectorizer = TfidfVectorizer(vocabulary=terms, **(params or {}))
+    vectorizer.idf_ = idf
+    return vectorizer
+
+
+def smooth_idf(document_frequencies, n_docs):
+    """idf lissé, même calcul que TfidfVectorizer(smooth_idf=True)."""
+    idf = np.full(len(document_frequencies), n_docs + 1, dtype=np.float64)
+    idf /= np.asarray(document_frequencies, dtype=np.float64) + 1.0
+    np.log(idf, out=idf)
+    idf += 1.0
+    return idf
+
+
+def tfidf_rows(counts, idf):
+    """Poids TF-IDF normalisés L2 de lignes de comptes bruts (comme TfidfTransformer).
+
+    L'ordre des termes dans chaque ligne est conservé (astype le retrierait) : les normes
+    sont sommées dans le même ordre que par TfidfVectorizer.
+    """
+    weighted = sparse.csr_matrix(
+        (np.array(counts.data, dtype=np.float64), np.array(counts.indices), np.array(counts.indptr)),
+        shape=counts.shape,
+    )
+    weighted.data *= idf[weighted.indices]
+    return normalize(weighted, norm='l2', copy=False)
+
+
+class Segment:
+    """Bloc de lignes interrogeable : comptes bruts, matrice TF-IDF, postings et métadonnées."""
+
+    def __init__(self, segment_id, counts, tfidf_matrix, metadata, term_doc_matrix=None, max_weights=None,
+                 deleted=None):
+        self.segment_id = segment_id
+        self.counts = counts
+        self.tfidf_matrix = tfidf_matrix
+        self.metadata = metadata
+
+        # Matrice termes × lignes normalisée L2 : la similarité cosinus d'un lot de requêtes
+        # normalisées se réduit à un seul produit creux, sans renormaliser à chaque appel.
+        # Ses lignes sont aussi les postings de l'index inversé.
+        if term_doc_matrix is None:
+            term_doc_matrix = tfidf_matrix.T.tocsr()
+            term_doc_matrix.sort_indices()
+        self.term_doc_matrix = term_doc_matrix
+        self.inverted_index = InvertedIndex(term_doc_matrix, max_weights)
+
+        source_column = metadata.columns['source']
+        self.source_masks = {source: source_column.equals(source) for source in SOURCES}
+
+        # Lignes supprimées depuis la dernière fusion (None : aucune)
+        self.deleted = deleted if deleted is not None and deleted.any() else None
+        self.live_mask = ~self.deleted if self.deleted is not None else None
+
+    @classmethod
+    def from_counts(cls, segment_id, counts, metadata, idf):
+        return cls(segment_id, counts, tfidf_rows(counts, idf), metadata)
+
+    def __len__(self):
+        return self.tfidf_matrix.shape[0]
+
+    @property
+    def n_terms(self):
+        return self.term_doc_matrix.shape[0]
+
+    @property
+    def live_rows(self):
+        return len(self) - (int(self.deleted.sum()) if self.deleted is not None else 0)
+
+    def with_deleted(self, deleted):
+        """Même segment avec un autre masque de suppressions (les matrices sont partagées)."""
+        return Segment(self.segment_id, self.counts, self.tfidf_matrix, self.metadata, self.term_doc_matrix,
+                       self.inverted_index.max_weights, deleted)
+
+    def allowed(self, source=None):
+        """Masque des lignes interrogeables (source demandée, hors suppressions), ou None si toutes le sont."""
+        mask = self.source_masks[source] if source is not None else None
+        if self.live_mask is not None:
+            mask = self.live_mask if mask is None else mask & self.live_mask
+        return mask
+
+    def describe(self):
+        return {
+            'id': self.segment_id,
+            'rows': len(self),
+            'live_rows': self.live_rows,
+            'deleted_rows': len(self) - self.live_rows,
+            'terms': self.n_terms,
+            'nnz': int(self.tfidf_matrix.nnz),
+        }
+
+
+class RagIndex:
+    """Génération de l'index prête à interroger : vectorizer des requêtes, segments et statistiques."""
+
+    def __init__(self, vectorizer, segments, document_frequencies, n_docs, version, origin, build_report=None,
+                 generation=0):
+        self.vectorizer = vectorizer
+        # Segment de base d'abord, puis éventuellement le delta
+        self.segments = segments
+        # Fréquences documentaires et nombre de lignes vivantes, tenus à jour à chaque ajout ou
+        # suppression ; l'idf de la génération (vectorizer.idf_) n'est recalculé qu'à la fusion
+        self.document_frequencies = document_frequencies
+        self.n_docs = n_docs
+        # Identifiant de la génération de l'index (artefact ou construction en mémoire)
+        self.version = version
+        # 'artifact' si chargé depuis le disque, 'memory' si construit au démarrage, 'update'
+        # après un ajout, une suppression ou une fusion
+        self.origin = origin
+        # Compte rendu de construction (extraction des PDF...), repris dans le manifeste
+        self.build_report = build_report or {}
+        self.generation = generation
+        # Identifiant global d'une ligne : position du segment puis rang dans le segment
+        self.segment_offsets = np.cumsum([0] + [len(segment) for segment in segments])
+
+    @classmethod
+    def from_counts(cls, terms, counts, metadata, params, version, origin, build_report=None, generation=0):
+        """Génération à un seul segment, fréquences documentaires et idf calculés sur les comptes `counts`."""
+        n_docs = counts.shape[0]
+        document_frequencies = np.bincount(counts.indices, minlength=len(terms)).astype(np.int64)
+        idf = smooth_idf(document_frequencies, n_docs)
+        segment = Segment.from_counts(new_segment_id(), counts, metadata, idf)
+        return cls(query_vectorizer(terms, idf, params), [segment], document_frequencies, n_docs, version, origin,
+                   build_report, generation)
+
+    def __len__(self):
+        return sum(segment.live_rows for segment in self.segments)
+
+    @property
+    def terms(self):
+        return len(self.vectorizer.vocabulary)
+
+    @property
+    def base(self):
+        return self.segments[0]
+
+    @property
+    def delta(self):
+        return self.segments[1] if len(self.segments) > 1 else None
+
+    def locate(self, global_row):
+        """(segment, rang dans le segment) d'un identifiant global de ligne."""
+        position = int(np.searchsorted(self.segment_offsets, global_row, side='right')) - 1
+        return self.segments[position], int(global_row - self.segment_offsets[position])
+
+    def row(self, global_row):
+        segment, row = self.locate(global_row)
+        return segment.metadata.row(row)
+
+    def transform_queries(self, processed_queries):
+        """Vecteurs TF-IDF normalisés L2 des requêtes déjà prétraitées."""
+        query_matrix = self.vectorizer.transform(processed_queries)
+        if self.vectorizer.norm != 'l2':
+            query_matrix = normalize(query_matrix)
+        return query_matrix
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'generation': self.generation,
+            'origin': self.origin,
+            'rows': len(self),
+            'terms': self.terms,
+            'segments': [segment.describe() for segment in self.segments],
+        }
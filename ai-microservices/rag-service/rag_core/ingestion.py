@@ -0,0 +1,189 @@
+import itertools
+import json
+import logging
+import os
+
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+from shared.text_normalization import preprocess_text
+
+from .chunking import PASSAGE_OVERLAP, PASSAGE_WORDS, chunk_pages
+from .index import RagIndex, new_version, vectorizer_params
+from .metadata import MetadataTable
+from .mortality import aggregate_causes, loads_stats, read_csv_chunks, validate_rows
+from .pdf_extraction import extract_pdf_dir
+
+logger = logging.getLogger(__name__)
+
+# Répertoire du service (parent du paquet rag_core)
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dossier du CSV et des PDF, surchargeable pour construire l'index sur un autre corpus
+DATA_DIR = os.environ.get('RAG_DATA_DIR', os.path.join(SERVICE_DIR, '..', '..', 'src', 'app', 'data'))
+
+CSV_PATH = os.path.join(DATA_DIR, 'Data in text format (CSV).csv')
+JSON_PATH = os.path.join(SERVICE_DIR, '..', 'diagnosis-service', 'diseases_symptoms.json')
+PDF_DIR = DATA_DIR
+
+def load_csv(csv_path=CSV_PATH):
+    """Une ligne par cause distincte du CSV, avec ses comptes agrégés (voir mortality.py)."""
+    return prepare_csv(aggregate_causes(read_csv_chunks(csv_path)))
+
+
+def prepare_csv(df):
+    # Combiner les colonnes pertinentes pour la recherche
+    df['combined_text'] = df['cause_initiale_classe'] + ' ' + \
+                          df['cause_initiale_bloc'] + ' ' + \
+                          df['cause_initiale_chapitre']
+    return df
+
+
+def load_diseases(json_path=JSON_PATH):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        diseases_data = json.load(f)
+
+    # Créer un DataFrame à partir des données de maladies et symptômes
+    diseases_list = []
+    for disease, symptoms in diseases_data['diseases'].items():
+        diseases_list.append({
+            'disease_name': disease,
+            'symptoms': ' '.join(symptoms)
+        })
+    return pd.DataFrame(diseases_list)
+
+
+def load_pdfs(pdf_dir=PDF_DIR, filenames=None):
+    """Retourne le DataFrame des passages des PDF (une ligne par passage) et le compte rendu
+    d'extraction par fichier. Sans filenames, tous les PDF du dossier sont lus."""
+    results = extract_pdf_dir(pdf_dir, filenames=filenames)
+
+    rows = []
+    for result in results:
+        if result.error:
+            continue
+        for passage in chunk_pages(result.pages):
+            rows.append({
+                'pdf_name': result.filename,
+                'content': passage['text'],
+                'page': passage['page'],
+                'char_start': passage['char_start'],
+                'char_end': passage['char_end'],
+            })
+
+    df_pdfs = pd.DataFrame(rows, columns=['pdf_name', 'content', 'page', 'char_start', 'char_end'])
+    return df_pdfs, [result.report() for result in results]
+
+
+def build_corpus():
+    """Charge CSV, JSON et PDF et retourne le DataFrame combiné (avec processed_text)
+    et le compte rendu d'extraction des PDF.
+
+    Lève l'exception de lecture du CSV : sans lui, il n'y a pas de base de connaissances.
+    """
+    df = load_csv()
+    pdf_report = []
+    try:
+        df_diseases = load_diseases()
+        df_pdfs, pdf_report = load_pdfs()
+
+        df['processed_text'] = df['combined_text'].apply(preprocess_text)
+        df_diseases['processed_text'] = df_diseases['symptoms'].apply(preprocess_text)
+        df_pdfs['processed_text'] = df_pdfs['content'].apply(preprocess_text)
+
+        # Créer un DataFrame combiné pour retrouver l'origine des résultats
+        df_combined = pd.concat([
+            df,
+            df_diseases.rename(columns={'disease_name': 'cause_initiale_classe', 'symptoms': 'combined_text'}),
+            df_pdfs.rename(columns={'pdf_name': 'cause_initiale_classe', 'content': 'combined_text'})
+        ], ignore_index=True)
+        df_combined['source'] = ['csv'] * len(df) + ['json'] * len(df_diseases) + ['pdf'] * len(df_pdfs)
+
+    except FileNotFoundError:
+        logger.warning("Fichier diseases_symptoms.json ou PDF non trouvé. Le service RAG fonctionnera uniquement avec les données CSV.")
+        df['processed_text'] = df['combined_text'].apply(preprocess_text)
+        df_combined = df
+        df_combined['source'] = ['csv'] * len(df)
+
+    except Exception as e:
+        logger.error("Erreur lors du chargement ou du traitement des données (JSON/PDF) : %s", e)
+        df['processed_text'] = df['combined_text'].apply(preprocess_text)
+        df_combined = df
+        df_combined['source'] = ['csv'] * len(df)
+
+    return df_combined, pdf_report
+
+
+def load_new_rows(rows=(), csv_files=(), pdf_files=(), data_dir=DATA_DIR):
+    """Lignes à ajouter à un index existant (avec processed_text et source) et compte rendu
+    d'extraction des PDF.
+
+    rows : lignes au format du CSV (dicts) ; csv_files / pdf_files : noms de fichiers de
+    data_dir, le CSV au même format que le fichier principal. Les lignes CSV sont agrégées
+    par cause ; fold_causes (updates.py) y ajoute les comptes des causes déjà indexées.
+    """
+    frames = []
+    # Lignes et fichiers vérifiés (ValueError citant les lignes invalides), puis agrégés
+    # ensemble : une seule ligne par cause pour toute la demande
+    csv_chunks = [validate_rows(read_csv_chunks(data_file(data_dir, filename, '.csv')),
+                                lambda index, filename=filename: f"{filename} ligne {index + 2}")
+                  for filename in csv_files]
+    if rows:
+        csv_chunks.append(validate_rows([pd.DataFrame(list(rows))], lambda index: f"rows[{index}]"))
+    if csv_chunks:
+        df_csv = prepare_csv(aggregate_causes(itertools.chain.from_iterable(csv_chunks)))
+        df_csv['source'] = 'csv'
+        frames.append(df_csv)
+
+    pdf_report = []
+    if pdf_files:
+        for filename in pdf_files:
+            data_file(data_dir, filename, '.pdf')
+        df_pdfs, pdf_report = load_pdfs(data_dir, list(pdf_files))
+        df_pdfs = df_pdfs.rename(columns={'pdf_name': 'cause_initiale_classe', 'content': 'combined_text'})
+        df_pdfs['source'] = 'pdf'
+        frames.append(df_pdfs)
+
+    if not frames:
+        return pd.DataFrame(columns=['combined_text', 'processed_text', 'source']), pdf_report
+    df_new = pd.concat(frames, ignore_index=True)
+    df_new['processed_text'] = df_new['combined_text'].apply(preprocess_text)
+    return df_new, pdf_report
+
+
+def data_file(data_dir, filename, extension=None):
+    """Chemin d'un fichier du dossier de données ; ValueError pour un nom qui en sortirait."""
+    if not isinstance(filename, str) or not filename or os.path.basename(filename) != filename \
+            or filename.startswith('.'):
+        raise ValueError(f"Nom de fichier invalide : {filename!r}.")
+    if extension is not None and not filename.endswith(extension):
+        raise ValueError(f"Le fichier {filename} doit avoir l'extension {extension}.")
+    return os.path.join(data_dir, filename)
+
+
+def build_index():
+    """Construit l'index complet en mémoire : ingestion, prétraitement et pondération TF-IDF.
+
+    Les comptes bruts des termes sont gardés dans le segment : les ajouts et fusions
+    ultérieurs (voir updates.py) repondèrent les lignes sans relire les sources.
+    """
+    df_combined, pdf_report = build_corpus()
+    csv_stats = [loads_stats(text) for text in df_combined.loc[df_combined['source'] == 'csv', 'stats']]
+
+    # Même tokenisation et même vocabulaire (trié) que TfidfVectorizer().fit_transform
+    counter = CountVectorizer()
+    counts = counter.fit_transform(df_combined['processed_text'].tolist()).tocsr()
+
+    return RagIndex.from_counts(
+        terms=counter.get_feature_names_out().tolist(),
+        counts=counts,
+        metadata=MetadataTable.from_frame(df_combined),
+        params=vectorizer_params(TfidfVectorizer()),
+        version=new_version(),
+        origin='memory',
+        build_report={
+            'pdf_extraction': pdf_report,
+            'passages': {'words': PASSAGE_WORDS, 'overlap': PASSAGE_OVERLAP},
+            'csv': {'rows': sum(stats['lignes'] for stats in csv_stats), 'causes': len(csv_stats)},
+        },
+    )
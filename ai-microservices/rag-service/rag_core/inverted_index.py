@@ -0,0 +1,126 @@
+"""Moteur de recherche top-k sur index inversé, avec élagage par bornes de score (MaxScore).
+
+Les postings d'un terme sont la ligne correspondante de la matrice termes × lignes
+normalisée (CSR) : identifiants de lignes triés et poids, stockés tels quels dans
+l'artefact. La borne d'un terme est son poids maximal multiplié par son poids dans
+la requête.
+
+Les termes sont parcourus par borne décroissante. Tant que la somme des bornes des
+termes restants peut encore faire entrer une nouvelle ligne dans le top-k, leurs
+postings sont fusionnés dans les candidats ; ensuite seuls les candidats existants
+sont complétés, et ceux qui ne peuvent plus atteindre le k-ième score sont écartés.
+Une ligne qui ne partage aucun terme avec la requête n'est jamais lue.
+
+Les scores des candidats retenus sont recalculés dans l'ordre des termes de la
+requête, comme le produit creux de référence : les valeurs sont identiques au bit près.
+"""
+import numpy as np
+
+# Marge sur les comparaisons de bornes pour absorber les erreurs d'arrondi des sommes partielles
+BOUND_EPSILON = 1e-9
+
+
+class InvertedIndex:
+
+    def __init__(self, term_doc_matrix, max_weights=None):
+        self.indptr = term_doc_matrix.indptr
+        self.doc_ids = term_doc_matrix.indices
+        self.weights = term_doc_matrix.data
+        self.max_weights = compute_max_weights(term_doc_matrix) if max_weights is None else max_weights
+
+    def postings(self, term):
+        start, end = self.indptr[term], self.indptr[term + 1]
+        return self.doc_ids[start:end], self.weights[start:end]
+
+    def candidates(self, terms, query_weights, k, threshold=0.0, allowed=None):
+        """Lignes pouvant figurer dans le top-k de la requête et leurs scores exacts.
+
+        terms / query_weights : termes de la requête (ordre croissant) et leurs poids.
+        Seules les lignes de score > threshold sont retournées ; le top-k en fait partie.
+        """
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        if len(terms) == 0 or k <= 0:
+            return empty
+
+        bounds = query_weights * self.max_weights[terms]
+        order = np.argsort(-bounds, kind='stable')
+        # remaining[i] : score maximal qu'apportent encore les termes order[i:]
+        remaining = np.append(np.cumsum(bounds[order][::-1])[::-1], 0.0)
+
+        cand_ids, cand_scores = empty
+        kth_score = -np.inf
+        position = 0
+
+        # Phase 1 : les termes restants peuvent encore faire entrer une nouvelle ligne
+        while position < len(order) and _may_admit(remaining[position], kth_score, threshold):
+            term_position = order[position]
+            ids, weights = self.postings(terms[term_position])
+            if allowed is not None:
+                mask = allowed[ids]
+                ids, weights = ids[mask], weights[mask]
+            cand_ids, cand_scores = _merge(cand_ids, cand_scores, ids, weights * query_weights[term_position])
+            kth_score = _kth_largest(cand_scores, k)
+            position += 1
+
+        # Phase 2 : seuls les candidats existants sont complétés, puis élagués par leur borne
+        for position in range(position, len(order) + 1):
+            bound = cand_scores + remaining[position]
+            keep = (bound + BOUND_EPSILON >= kth_score) & (bound + BOUND_EPSILON > threshold)
+            cand_ids, cand_scores = cand_ids[keep], cand_scores[keep]
+            if position == len(order) or len(cand_ids) == 0:
+                break
+            term_position = order[position]
+            ids, weights = self.postings(terms[term_position])
+            locations, hits = _lookup(ids, cand_ids)
+            cand_scores[hits] += weights[locations[hits]] * query_weights[term_position]
+            kth_score = max(kth_score, _kth_largest(cand_scores, k))
+
+        exact = self.score(cand_ids, terms, query_weights)
+        keep = exact > threshold
+        return cand_ids[keep], exact[keep]
+
+    def score(self, doc_ids, terms, query_weights):
+        """Scores exacts de doc_ids, sommés dans l'ordre des termes comme un produit CSR."""
+        scores = np.zeros(len(doc_ids), dtype=np.float64)
+        if len(doc_ids) == 0:
+            return scores
+        for term, query_weight in zip(terms, query_weights):
+            ids, weights = self.postings(term)
+            locations, hits = _lookup(ids, doc_ids)
+            scores[hits] += query_weight * weights[locations[hits]]
+        return scores
+
+
+def compute_max_weights(term_doc_matrix):
+    """Poids maximal de chaque terme sur l'ensemble des lignes (0 pour un terme sans posting)."""
+    indptr = term_doc_matrix.indptr
+    max_weights = np.zeros(term_doc_matrix.shape[0], dtype=np.float64)
+    nonempty = np.diff(indptr) > 0
+    if nonempty.any():
+        max_weights[nonempty] = np.maximum.reduceat(term_doc_matrix.data, indptr[:-1][nonempty])
+    return max_weights
+
+
+def _may_admit(remaining_bound, kth_score, threshold):
+    # Une ligne encore jamais vue vaut au plus remaining_bound
+    return remaining_bound + BOUND_EPSILON >= kth_score and remaining_bound + BOUND_EPSILON > threshold
+
+
+def _merge(ids_a, scores_a, ids_b, scores_b):
+    ids, inverse = np.unique(np.concatenate((ids_a, ids_b)), return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate((scores_a, scores_b)), minlength=len(ids))
+    return ids, scores
+
+
+def _lookup(sorted_ids, doc_ids):
+    """Positions de doc_ids dans sorted_ids et masque de ceux qui y figurent."""
+    locations = np.searchsorted(sorted_ids, doc_ids)
+    locations[locations == len(sorted_ids)] = 0
+    hits = sorted_ids[locations] == doc_ids if len(sorted_ids) else np.zeros(len(doc_ids), dtype=bool)
+    return locations, hits
+
+
+def _kth_largest(scores, k):
+    if len(scores) < k:
+        return -np.inf
+    return np.partition(scores, len(scores) - k)[len(scores) - k]
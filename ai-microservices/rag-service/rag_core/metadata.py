@@ -0,0 +1,149 @@
+import json
+import os
+
+import numpy as np
+
+# Colonnes de df_combined conservées dans l'index (les seules lues par /rag)
+METADATA_COLUMNS = [
+    'source',
+    'cause_initiale_classe',
+    'cause_initiale_bloc',
+    'cause_initiale_chapitre',
+    'stats',
+    'combined_text',
+    'page',
+    'char_start',
+    'char_end',
+]
+
+
+class StringColumn:
+    """Colonne de chaînes stockée à la manière d'Arrow : un buffer UTF-8 et des offsets.
+
+    Les deux tableaux peuvent être des memmaps : une ligne n'est décodée que
+    lorsqu'elle est lue, et les pages sont partagées entre processus.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_values(cls, values):
+        encoded = [value.encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    @classmethod
+    def concat(cls, columns):
+        data = np.concatenate([np.asarray(column.data) for column in columns])
+        offsets = [np.zeros(1, dtype=np.int64)]
+        base = 0
+        for column in columns:
+            offsets.append(np.asarray(column.offsets[1:]) - column.offsets[0] + base)
+            base += int(column.offsets[-1] - column.offsets[0])
+        return cls(data, np.concatenate(offsets))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.data[start:end].tobytes().decode('utf-8')
+
+    def take(self, rows):
+        """Colonne réduite aux lignes `rows`, copiée octet par octet sans décodage."""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.asarray(self.offsets[rows])
+        lengths = np.asarray(self.offsets[rows + 1]) - starts
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Position de chaque octet : début de sa ligne dans la source + rang dans la ligne
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return StringColumn(np.asarray(self.data)[positions], offsets)
+
+    def equals(self, value):
+        """Masque des lignes égales à value, comparées octet par octet sans décodage."""
+        encoded = np.frombuffer(value.encode('utf-8'), dtype=np.uint8)
+        mask = np.diff(self.offsets) == len(encoded)
+        candidates = np.flatnonzero(mask)
+        if len(candidates) and len(encoded):
+            positions = np.asarray(self.offsets[candidates])[:, None] + np.arange(len(encoded))
+            mask[candidates] = (np.asarray(self.data)[positions] == encoded).all(axis=1)
+        return mask
+
+
+class MetadataTable:
+    """Métadonnées des lignes de l'index, une StringColumn par colonne."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def from_frame(cls, frame, column_names=METADATA_COLUMNS):
+        columns = {}
+        for name in column_names:
+            if name in frame.columns:
+                values = [_to_text(value) for value in frame[name].tolist()]
+            else:
+                values = [''] * len(frame)
+            columns[name] = StringColumn.from_values(values)
+        return cls(columns)
+
+    def __len__(self):
+        first = next(iter(self.columns.values()), None)
+        return len(first) if first is not None else 0
+
+    def row(self, i):
+        return {name: column[i] for name, column in self.columns.items()}
+
+    @classmethod
+    def concat(cls, tables):
+        names = list(tables[0].columns)
+        return cls({name: StringColumn.concat([table.columns[name] for table in tables]) for name in names})
+
+    def take(self, rows):
+        return MetadataTable({name: column.take(rows) for name, column in self.columns.items()})
+
+    def matching(self, filters):
+        """Masque des lignes dont les colonnes valent exactement les valeurs de filters."""
+        mask = np.ones(len(self), dtype=bool)
+        for name, value in filters.items():
+            if name not in self.columns:
+                return np.zeros(len(self), dtype=bool)
+            mask &= self.columns[name].equals(_to_text(value))
+        return mask
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(directory, f'{name}.data.npy'), column.data)
+            np.save(os.path.join(directory, f'{name}.offsets.npy'), column.offsets)
+        with open(os.path.join(directory, 'columns.json'), 'w', encoding='utf-8') as f:
+            json.dump(list(self.columns), f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        with open(os.path.join(directory, 'columns.json'), 'r', encoding='utf-8') as f:
+            names = json.load(f)
+        columns = {}
+        for name in names:
+            data = np.load(os.path.join(directory, f'{name}.data.npy'), mmap_mode=mmap_mode)
+            offsets = np.load(os.path.join(directory, f'{name}.offsets.npy'), mmap_mode=mmap_mode)
+            columns[name] = StringColumn(data, offsets)
+        return cls(columns)
+
+
+def _to_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if value != value:
+            return ''
+        # Les colonnes entières deviennent flottantes après le concat avec les sources sans ces colonnes
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
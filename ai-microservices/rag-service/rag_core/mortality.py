@@ -0,0 +1,145 @@
+"""Agrégation du CSV de mortalité : une ligne par cause, ventilations par année, sexe et classe d'âge.
+
+Le CSV compte une ligne par combinaison année × sexe × classe d'âge × cause :
+le texte d'une cause (classe, bloc, chapitre) s'y répète des dizaines de
+fois. L'index n'en garde qu'une ligne par cause distincte, prétraitée une
+seule fois, et les comptes de décès des lignes d'origine y sont rattachés
+sous forme agrégée (colonne 'stats' des métadonnées, en JSON compact) :
+
+    {"deces": 1234, "lignes": 80,
+     "annee_deces": {"2010": 120, ...}, "sexe": {"Femme": 600, ...}, "classe_age": {"0-14": 12, ...}}
+
+Le fichier est lu par blocs de RAG_CSV_CHUNK_ROWS lignes, les colonnes
+textuelles en catégories : la mémoire reste bornée quelle que soit sa taille.
+"""
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from .metadata import _to_text
+
+CSV_CHUNK_ROWS = int(os.environ.get('RAG_CSV_CHUNK_ROWS', 100000))
+
+CAUSE_COLUMNS = ['cause_initiale_classe', 'cause_initiale_bloc', 'cause_initiale_chapitre']
+BREAKDOWN_COLUMNS = ['annee_deces', 'sexe', 'classe_age']
+DEATHS_COLUMN = 'nombre_deces'
+
+# Lignes invalides citées au plus dans le message d'erreur d'un ajout
+MAX_REPORTED_ROWS = 20
+
+CSV_DTYPES = {
+    'sexe': 'category',
+    'classe_age': 'category',
+    'cause_initiale_classe': 'category',
+    'cause_initiale_bloc': 'category',
+    'cause_initiale_chapitre': 'category',
+}
+
+
+def read_csv_chunks(csv_path, chunk_rows=CSV_CHUNK_ROWS):
+    """Blocs successifs du CSV, colonnes textuelles en catégories."""
+    return pd.read_csv(csv_path, sep=';', dtype=CSV_DTYPES, chunksize=chunk_rows)
+
+
+def aggregate_causes(frames):
+    """DataFrame d'une ligne par cause distincte (colonnes de CAUSE_COLUMNS et 'stats'),
+    dans l'ordre de première apparition, à partir de blocs au format du CSV.
+
+    Les colonnes de la cause sont obligatoires (ValueError sinon) ; sans nombre_deces, seules
+    les lignes sont comptées. Les lignes ajoutées à un index existant passent d'abord par
+    validate_rows.
+    """
+    causes = {}
+    for frame in frames:
+        if not len(frame):
+            continue
+        missing = [column for column in CAUSE_COLUMNS if column not in frame.columns]
+        if missing:
+            raise ValueError(f"Colonnes manquantes dans les lignes CSV : {', '.join(missing)}.")
+        deaths = pd.to_numeric(frame[DEATHS_COLUMN], errors='coerce').fillna(0) \
+            if DEATHS_COLUMN in frame.columns else pd.Series(0, index=frame.index)
+        frame = frame.assign(_deces=deaths.astype('int64'))
+
+        grouped = frame.groupby(CAUSE_COLUMNS, observed=True, dropna=False, sort=False)['_deces']
+        for key, (total, rows) in grouped.agg(['sum', 'size']).iterrows():
+            stats = causes.setdefault(tuple(_to_text(value) for value in key), empty_stats())
+            stats['deces'] += int(total)
+            stats['lignes'] += int(rows)
+
+        for column in BREAKDOWN_COLUMNS:
+            if column not in frame.columns:
+                continue
+            grouped = frame.groupby(CAUSE_COLUMNS + [column], observed=True, dropna=False, sort=False)['_deces']
+            for key, total in grouped.sum().items():
+                breakdown = causes[tuple(_to_text(value) for value in key[:-1])][column]
+                value = _to_text(key[-1])
+                breakdown[value] = breakdown.get(value, 0) + int(total)
+
+    return pd.DataFrame(
+        [dict(zip(CAUSE_COLUMNS, key), stats=dumps_stats(stats)) for key, stats in causes.items()],
+        columns=CAUSE_COLUMNS + ['stats'],
+    )
+
+
+def validate_rows(frames, row_label):
+    """Les mêmes blocs, après vérification que chaque ligne a une cause complète (classe, bloc,
+    chapitre non vides) et un nombre_deces entier positif ou nul.
+
+    Lève ValueError en citant les lignes invalides (row_label(index) pour chacune) avant de
+    rendre le moindre bloc : rien n'est ajouté à l'index si une seule ligne est invalide.
+    """
+    frames = list(frames)
+    invalid = []
+    for frame in frames:
+        valid = np.ones(len(frame), dtype=bool)
+        for column in CAUSE_COLUMNS:
+            if column not in frame.columns:
+                valid[:] = False
+                break
+            valid &= frame[column].astype('object').map(lambda value: bool(_to_text(value).strip())).to_numpy(bool)
+        if DEATHS_COLUMN in frame.columns:
+            deaths = pd.to_numeric(frame[DEATHS_COLUMN], errors='coerce').to_numpy(dtype=float)
+            valid &= (deaths >= 0) & (np.mod(deaths, 1) == 0)
+        else:
+            valid[:] = False
+        invalid.extend(row_label(index) for index in frame.index[~valid])
+    if invalid:
+        shown = ', '.join(invalid[:MAX_REPORTED_ROWS]) + (', ...' if len(invalid) > MAX_REPORTED_ROWS else '')
+        raise ValueError(f"{len(invalid)} ligne(s) CSV invalide(s) : {shown}. Chaque ligne doit préciser "
+                         f"{', '.join(CAUSE_COLUMNS)} et un {DEATHS_COLUMN} entier positif ou nul.")
+    return frames
+
+
+def empty_stats():
+    return {'deces': 0, 'lignes': 0, **{column: {} for column in BREAKDOWN_COLUMNS}}
+
+
+def merge_stats(*all_stats):
+    """Somme de plusieurs agrégats (dicts de loads_stats)."""
+    merged = empty_stats()
+    for stats in all_stats:
+        merged['deces'] += stats.get('deces', 0)
+        merged['lignes'] += stats.get('lignes', 0)
+        for column in BREAKDOWN_COLUMNS:
+            for value, total in stats.get(column, {}).items():
+                merged[column][value] = merged[column].get(value, 0) + total
+    return merged
+
+
+def dumps_stats(stats):
+    # Valeurs des ventilations dans l'ordre naturel (années, classes d'âge « 5-14 » avant « 15-24 »)
+    ordered = dict(stats)
+    for column in BREAKDOWN_COLUMNS:
+        ordered[column] = {value: stats[column][value] for value in sorted(stats[column], key=natural_key)}
+    return json.dumps(ordered, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads_stats(text):
+    return json.loads(text) if text else empty_stats()
+
+
+def natural_key(value):
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'(\d+)', value) if part]
@@ -0,0 +1,168 @@
+"""Extraction du texte des PDF du corpus, parallélisée et mise en cache par hash de contenu.
+
+Chaque PDF est identifié par le SHA-256 de son contenu : un fichier inchangé
+est relu depuis le cache sans repasser par PyPDF2, seuls les fichiers nouveaux
+ou modifiés sont extraits, en parallèle sur un pool de processus.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+from PyPDF2 import PdfReader
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'RAG_PDF_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'pdf_text')
+)
+
+# Une entrée de cache produite par une autre version de PyPDF2 est ré-extraite
+EXTRACTOR_VERSION = f'PyPDF2-{PyPDF2.__version__}'
+
+
+class PdfExtractionResult:
+    """Résultat de l'extraction d'un PDF : texte par page et compte rendu."""
+
+    def __init__(self, filename, sha256, pages=None, seconds=0.0, cached=False, error=None):
+        self.filename = filename
+        self.sha256 = sha256
+        self.pages = pages or []
+        self.seconds = seconds
+        self.cached = cached
+        self.error = error
+
+    @property
+    def text(self):
+        return ''.join(self.pages)
+
+    def report(self):
+        return {
+            'file': self.filename,
+            'sha256': self.sha256,
+            'pages': len(self.pages),
+            'chars': sum(len(page) for page in self.pages),
+            'seconds': round(self.seconds, 4),
+            'cached': self.cached,
+            'error': self.error,
+        }
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract_pages(pdf_path):
+    """Texte de chaque page du PDF (exécuté dans un processus du pool)."""
+    start = time.perf_counter()
+    with open(pdf_path, 'rb') as file:
+        reader = PdfReader(file)
+        pages = [page.extract_text() or '' for page in reader.pages]
+    return pages, time.perf_counter() - start
+
+
+def extract_pdf_dir(pdf_dir, cache_dir=DEFAULT_CACHE_DIR, max_workers=None, filenames=None):
+    """Extrait les PDF de pdf_dir (tous, ou seulement filenames) et retourne une liste de
+    PdfExtractionResult triée par nom."""
+    if filenames is None:
+        filenames = (filename for filename in os.listdir(pdf_dir) if filename.endswith('.pdf'))
+    filenames = sorted(filenames)
+    results = []
+    pending = []
+
+    for filename in filenames:
+        path = os.path.join(pdf_dir, filename)
+        try:
+            sha256 = file_sha256(path)
+        except OSError as e:
+            results.append(PdfExtractionResult(filename, None, error=str(e)))
+            continue
+        start = time.perf_counter()
+        pages = _read_cache(cache_dir, sha256)
+        if pages is not None:
+            results.append(PdfExtractionResult(filename, sha256, pages, time.perf_counter() - start, cached=True))
+        else:
+            pending.append((filename, path, sha256))
+
+    if pending:
+        results.extend(_extract_pending(pending, cache_dir, max_workers))
+
+    results.sort(key=lambda result: result.filename)
+    for result in results:
+        if result.error:
+            logger.warning("Échec de l'extraction PDF %s", json.dumps(result.report(), ensure_ascii=False))
+        else:
+            logger.info("Extraction PDF %s", json.dumps(result.report(), ensure_ascii=False))
+    logger.info(
+        "Extraction PDF terminée : %d fichiers, %d depuis le cache, %d extraits, %d échecs",
+        len(results), sum(r.cached for r in results),
+        sum(not r.cached and not r.error for r in results), sum(bool(r.error) for r in results),
+    )
+    return results
+
+
+def _extract_pending(pending, cache_dir, max_workers):
+    results = []
+    # Pas de pool pour un seul fichier : le coût de démarrage des processus dominerait
+    if len(pending) == 1 or max_workers == 1:
+        outcomes = []
+        for _, path, _ in pending:
+            try:
+                outcomes.append(extract_pages(path))
+            except Exception as e:
+                outcomes.append(e)
+    else:
+        workers = min(max_workers or os.cpu_count() or 1, len(pending))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(extract_pages, path) for _, path, _ in pending]
+            outcomes = []
+            for future in futures:
+                try:
+                    outcomes.append(future.result())
+                except Exception as e:
+                    outcomes.append(e)
+
+    for (filename, _, sha256), outcome in zip(pending, outcomes):
+        if isinstance(outcome, Exception):
+            results.append(PdfExtractionResult(filename, sha256, error=f'{type(outcome).__name__}: {outcome}'))
+            continue
+        pages, seconds = outcome
+        _write_cache(cache_dir, sha256, pages)
+        results.append(PdfExtractionResult(filename, sha256, pages, seconds))
+    return results
+
+
+def _cache_path(cache_dir, sha256):
+    return os.path.join(cache_dir, sha256[:2], f'{sha256}.json')
+
+
+def _read_cache(cache_dir, sha256):
+    try:
+        with open(_cache_path(cache_dir, sha256), 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get('extractor') != EXTRACTOR_VERSION:
+        return None
+    return entry['pages']
+
+
+def _write_cache(cache_dir, sha256, pages):
+    path = _cache_path(cache_dir, sha256)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'extractor': EXTRACTOR_VERSION, 'pages': pages}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Impossible d'écrire le cache d'extraction PDF %s : %s", path, e)
@@ -0,0 +1,113 @@
+"""Cache LRU borné des résultats de recherche, avec expiration et invalidation par version d'index."""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    # Normalisation bon marché pour la clé : casse et espaces, sans passer par le prétraitement complet
+    return ' '.join(query.casefold().split())
+
+
+class QueryCache:
+
+    def __init__(self, max_entries=2048, ttl_seconds=600.0, clock=time.monotonic, reference=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Version de l'index dont proviennent les entrées : tout changement vide le cache
+        self._index_version = None
+        # Fonction sans argument donnant la version publiée (celle que lisent les nouvelles requêtes)
+        self.reference = reference
+        self._bypassed_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.bypasses = 0
+
+    @staticmethod
+    def make_key(query, **options):
+        return (normalize_query(query),) + tuple(sorted(options.items()))
+
+    def get(self, index_version, key):
+        with self._lock:
+            if not self._check_version(index_version):
+                self.misses += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, index_version, key, value):
+        with self._lock:
+            if not self._check_version(index_version):
+                return
+            self._entries[key] = (self._clock() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index_version = None
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'index_version': self._index_version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'bypasses': self.bypasses,
+            }
+
+    def _check_version(self, index_version):
+        """Vrai si le cache peut servir cette version de l'index.
+
+        Seule la version publiée (self.reference) est servie : une autre vide le cache et le
+        remplace dès qu'elle est publiée, qu'elle soit plus récente ou non (retour à une
+        génération antérieure, horloge décalée). Celle des requêtes encore en cours sur la
+        génération précédente passe à côté du cache (ni lecture ni écriture) sans le vider.
+        Sans référence, toute nouvelle version remplace la précédente.
+        """
+        if index_version == self._index_version:
+            return True
+        if self.reference is not None and index_version != self.reference():
+            self.bypasses += 1
+            if index_version != self._bypassed_version:
+                self._bypassed_version = index_version
+                logger.info("Cache de requêtes contourné pour la version %s de l'index (version publiée : %s)",
+                            index_version, self.reference())
+            return False
+        if self._entries:
+            self._entries.clear()
+            self.invalidations += 1
+        self._index_version = index_version
+        return True
@@ -0,0 +1,176 @@
+import numpy as np
+
+from shared.metrics import REGISTRY
+from shared.text_normalization import preprocess_text
+
+from .mortality import loads_stats
+
+
+SIMILARITY_THRESHOLD = 0.1  # Seuil de similarité
+DEFAULT_TOP_K = 3
+MAX_TOP_K = 20
+MAX_BATCH_QUERIES = 1000
+# Limite de contenu renvoyé par passage pour garder des réponses bornées
+EXCERPT_CHARS = 500
+
+NO_RESULT_MESSAGE = "Je n'ai pas trouvé d'informations pertinentes pour votre requête dans ma base de connaissances."
+
+# Durée des étapes d'une recherche (un lot compte pour une observation par étape)
+STAGE_SECONDS = REGISTRY.histogram('rag_stage_seconds', "Durée des étapes de /rag et /rag/batch.", ('stage',))
+
+
+def top_k(scores, k, ids=None):
+    """Positions des k meilleurs scores par sélection partielle (partition), triées par score
+    décroissant puis, en cas d'égalité, par identifiant croissant (ids, ou la position)."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if ids is None:
+        ids = np.arange(len(scores))
+    kth_score = -np.partition(-scores, k - 1)[k - 1]
+    # Parmi les ex aequo au k-ième score, garder les plus petits identifiants
+    above = np.flatnonzero(scores > kth_score)
+    ties = np.flatnonzero(scores == kth_score)
+    ties = ties[np.argsort(ids[ties], kind='stable')][:k - len(above)]
+    selected = np.concatenate((above, ties))
+    order = np.lexsort((ids[selected], -scores[selected]))
+    return selected[order]
+
+
+def search(index, query, k=DEFAULT_TOP_K, source=None):
+    """Retourne les k passages les plus similaires à la requête, au-dessus du seuil.
+
+    Passe par l'index inversé de chaque segment : seuls les postings des termes de la
+    requête sont lus, avec élagage des lignes qui ne peuvent plus entrer dans le top-k.
+    Les candidats des segments sont ensuite départagés ensemble.
+    """
+    with STAGE_SECONDS.time(stage='normalization'):
+        processed_query = preprocess_text(query)
+    with STAGE_SECONDS.time(stage='vectorization'):
+        query_vector = index.transform_queries([processed_query])
+    with STAGE_SECONDS.time(stage='similarity'):
+        rows, scores = _segment_candidates(index, query_vector.indices, query_vector.data, k, source)
+        selected = top_k(scores, k, ids=rows)
+    with STAGE_SECONDS.time(stage='lookup'):
+        return [format_result(index.row(rows[position]), float(scores[position])) for position in selected]
+
+
+def search_batch(index, queries, k=DEFAULT_TOP_K, source=None):
+    """Recherche vectorisée d'un lot de requêtes, avec filtre optionnel sur la source.
+
+    Toutes les requêtes sont transformées en un seul appel puis scorées par un seul produit
+    creux par segment contre sa matrice normalisée : seules les lignes partageant un terme
+    avec une requête ont un score non nul, et les k meilleures sont choisies parmi elles.
+    """
+    with STAGE_SECONDS.time(stage='normalization'):
+        processed_queries = [preprocess_text(query) for query in queries]
+    with STAGE_SECONDS.time(stage='vectorization'):
+        query_matrix = index.transform_queries(processed_queries)
+    with STAGE_SECONDS.time(stage='similarity'):
+        per_segment = _segment_similarities(index, query_matrix, source)
+        selected = []
+        for i in range(len(queries)):
+            rows, scores = _query_row(per_segment, i)
+            selected.append((rows, scores, top_k(scores, k, ids=rows)))
+
+    with STAGE_SECONDS.time(stage='lookup'):
+        return [
+            [format_result(index.row(rows[position]), float(scores[position])) for position in positions]
+            for rows, scores, positions in selected
+        ]
+
+
+def compare_with_exhaustive(index, queries, k=DEFAULT_TOP_K):
+    """Compare le classement de l'index inversé à celui du produit creux exhaustif.
+
+    Retourne la liste des requêtes dont les k premiers résultats (lignes ou scores) diffèrent.
+    """
+    mismatches = []
+    query_matrix = index.transform_queries([preprocess_text(query) for query in queries])
+    per_segment = _segment_similarities(index, query_matrix, None)
+    for i, query in enumerate(queries):
+        rows, scores = _query_row(per_segment, i)
+        expected = [(int(rows[p]), float(scores[p])) for p in top_k(scores, k, ids=rows)]
+
+        query_vector = query_matrix[i]
+        rows, scores = _segment_candidates(index, query_vector.indices, query_vector.data, k, None)
+        found = [(int(rows[p]), float(scores[p])) for p in top_k(scores, k, ids=rows)]
+        if found != expected:
+            mismatches.append(query)
+    return mismatches
+
+
+def _segment_candidates(index, terms, query_weights, k, source):
+    """Candidats du top-k de chaque segment, en identifiants globaux de lignes."""
+    all_rows, all_scores = [], []
+    for offset, segment in zip(index.segment_offsets, index.segments):
+        # Les termes ajoutés après la création du segment n'y ont aucun posting
+        known = terms < segment.n_terms
+        rows, scores = segment.inverted_index.candidates(
+            terms[known], query_weights[known], k,
+            threshold=SIMILARITY_THRESHOLD,
+            allowed=segment.allowed(source),
+        )
+        all_rows.append(rows + offset)
+        all_scores.append(scores)
+    return np.concatenate(all_rows), np.concatenate(all_scores)
+
+
+def _segment_similarities(index, query_matrix, source):
+    """Par segment : (décalage, similarités requêtes × lignes en CSR, masque des lignes autorisées)."""
+    per_segment = []
+    for offset, segment in zip(index.segment_offsets, index.segments):
+        if query_matrix.shape[1] > segment.n_terms:
+            query_matrix = query_matrix[:, :segment.n_terms]
+        similarities = (query_matrix @ segment.term_doc_matrix).tocsr()
+        per_segment.append((offset, similarities, segment.allowed(source)))
+    return per_segment
+
+
+def _query_row(per_segment, i):
+    """Lignes (identifiants globaux) et scores au-dessus du seuil pour la requête i."""
+    all_rows, all_scores = [], []
+    for offset, similarities, allowed in per_segment:
+        start, end = similarities.indptr[i], similarities.indptr[i + 1]
+        rows = similarities.indices[start:end]
+        scores = similarities.data[start:end]
+        keep = scores > SIMILARITY_THRESHOLD
+        if allowed is not None:
+            keep &= allowed[rows]
+        all_rows.append(rows[keep].astype(np.int64) + offset)
+        all_scores.append(scores[keep])
+    return np.concatenate(all_rows), np.concatenate(all_scores)
+
+
+def format_result(relevant_info, score):
+    """Met en forme une ligne de l'index selon sa source (csv, json ou pdf)."""
+    result = {
+        "source": relevant_info['source'],
+        "similarite": score
+    }
+
+    if relevant_info['source'] == 'csv':
+        result.update({
+            "classe": relevant_info['cause_initiale_classe'],
+            "bloc": relevant_info['cause_initiale_bloc'],
+            "chapitre": relevant_info['cause_initiale_chapitre'],
+            # Décès de la cause, au total et par année, sexe et classe d'âge
+            "statistiques": loads_stats(relevant_info['stats']),
+        })
+    elif relevant_info['source'] == 'json':
+        result.update({
+            "maladie": relevant_info['cause_initiale_classe'],
+            "symptomes": relevant_info['combined_text']
+        })
+    elif relevant_info['source'] == 'pdf':
+        passage = relevant_info['combined_text']
+        if len(passage) > EXCERPT_CHARS:
+            passage = passage[:EXCERPT_CHARS] + "..."
+        result.update({
+            "document_pdf": relevant_info['cause_initiale_classe'],
+            "page": int(relevant_info['page']),
+            "debut": int(relevant_info['char_start']),
+            "fin": int(relevant_info['char_end']),
+            "contenu_extrait": passage
+        })
+    return result
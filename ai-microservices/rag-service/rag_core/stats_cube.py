@@ -0,0 +1,467 @@
+"""Cube des décès du CSV de mortalité, pour les filtres et regroupements de /stats.
+
+Chaque dimension est codée en entiers (codes attribués dans l'ordre
+d'apparition, jamais réattribués) et les décès sont sommés dans un tableau
+NumPy dense [cause, année, sexe, classe d'âge]. Une cause est le triplet
+(classe, bloc, chapitre) : le bloc et le chapitre se filtrent et se
+regroupent à travers le code de la cause. Une requête se réduit à une
+sélection d'indices et à des sommes sur les axes non regroupés.
+
+Arborescence (RAG_STATS_DIR) :
+
+    <racine>/manifest.json           valeurs des dimensions, source lue, version
+    <racine>/counts-<version>.npy    tableau des décès, ouvert en memmap
+
+Le manifeste garde la longueur et l'empreinte SHA-256 de la partie du CSV
+déjà agrégée : quand de nouvelles lignes (une nouvelle année) sont ajoutées à
+la fin du fichier, seules celles-ci sont lues et ajoutées au cube ; si le
+début du fichier a changé, le cube est reconstruit.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from .artifact import ArtifactError, artifact_lock
+from .index import new_version
+from .ingestion import CSV_PATH, SERVICE_DIR
+from .metadata import _to_text
+from .mortality import BREAKDOWN_COLUMNS, CAUSE_COLUMNS, CSV_CHUNK_ROWS, CSV_DTYPES, DEATHS_COLUMN, natural_key
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+DEFAULT_STATS_DIR = os.environ.get('RAG_STATS_DIR', os.path.join(SERVICE_DIR, 'stats'))
+
+RELOAD_INTERVAL = float(os.environ.get('RAG_RELOAD_INTERVAL', 10))
+
+# Dimensions interrogeables : les trois niveaux de la cause puis les axes de ventilation
+DIMENSIONS = CAUSE_COLUMNS + BREAKDOWN_COLUMNS
+
+# Au-delà, une requête doit être plus filtrée ou moins regroupée
+MAX_GROUPS = int(os.environ.get('RAG_STATS_MAX_GROUPS', 10000))
+
+HASH_BLOCK_BYTES = 1 << 20
+
+
+class StatsCube:
+    """Cube immuable : décès [cause, année, sexe, classe d'âge] et valeurs des dimensions."""
+
+    def __init__(self, counts, causes, values, source=None, version=None, built_at=None):
+        self.counts = counts
+        # Colonne de cause -> valeur pour chaque code de cause
+        self.causes = causes
+        # Axe de ventilation -> valeur pour chaque code
+        self.values = values
+        # CSV agrégé : chemin, octets lus, empreinte de ces octets et lignes
+        self.source = source or {}
+        self.version = version
+        self.built_at = built_at
+
+        self._codes = {column: {value: code for code, value in enumerate(values[column])}
+                       for column in BREAKDOWN_COLUMNS}
+        # Par colonne de cause : valeurs distinctes et code de chaque cause dans cette liste
+        self._cause_levels = {}
+        for column in CAUSE_COLUMNS:
+            labels, inverse = np.unique(np.asarray(causes[column], dtype=object), return_inverse=True) \
+                if causes[column] else (np.array([], dtype=object), np.array([], dtype=np.int64))
+            self._cause_levels[column] = (labels.tolist(), inverse.astype(np.int64))
+
+    @property
+    def total(self):
+        return int(np.asarray(self.counts).sum())
+
+    def dimension_values(self, dimension):
+        """Valeurs connues d'une dimension, dans l'ordre naturel."""
+        if dimension in BREAKDOWN_COLUMNS:
+            return sorted(self.values[dimension], key=natural_key)
+        return sorted(self._cause_levels[dimension][0], key=natural_key)
+
+    def query(self, filters=None, group_by=()):
+        """Décès filtrés puis regroupés.
+
+        filters : dimension -> valeur ou liste de valeurs acceptées ; group_by : dimensions
+        du regroupement. Retourne (total, groupes) où chaque groupe est un dict des valeurs
+        de group_by et de 'deces', dans l'ordre naturel des valeurs ; les groupes sans décès
+        sont omis. Lève ValueError pour une dimension inconnue ou trop de groupes.
+        """
+        filters = filters or {}
+        group_by = list(group_by)
+        for dimension in list(filters) + group_by:
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"Dimension inconnue : {dimension}. Valeurs possibles : {', '.join(DIMENSIONS)}.")
+        if len(set(group_by)) != len(group_by):
+            raise ValueError("Une dimension ne peut apparaître qu'une fois dans 'group_by'.")
+
+        # Indices retenus sur chaque axe
+        cause_mask = np.ones(self.counts.shape[0], dtype=bool)
+        for column in CAUSE_COLUMNS:
+            if column in filters:
+                labels, inverse = self._cause_levels[column]
+                accepted = set(_filter_values(filters[column]))
+                cause_mask &= np.isin(inverse, [code for code, label in enumerate(labels) if label in accepted])
+        selection = [np.flatnonzero(cause_mask)]
+        for axis, column in enumerate(BREAKDOWN_COLUMNS, start=1):
+            if column in filters:
+                codes = self._codes[column]
+                selection.append(np.array(sorted({codes[value] for value in _filter_values(filters[column])
+                                                  if value in codes}), dtype=np.int64))
+            else:
+                selection.append(np.arange(self.counts.shape[axis]))
+        cells = np.asarray(self.counts)[np.ix_(*selection)]
+
+        # Somme sur les axes de ventilation non regroupés
+        kept_axes = [axis for axis, column in enumerate(BREAKDOWN_COLUMNS, start=1) if column in group_by]
+        summed_axes = tuple(axis for axis in range(1, 4) if axis not in kept_axes)
+        cells = cells.sum(axis=summed_axes)
+
+        # Axe des causes : regroupé par les colonnes de cause demandées, ou sommé
+        cause_group_columns = [column for column in CAUSE_COLUMNS if column in group_by]
+        if cause_group_columns:
+            keys = np.stack([self._cause_levels[column][1][selection[0]] for column in cause_group_columns], axis=1)
+            group_keys, group_of_cause = np.unique(keys, axis=0, return_inverse=True)
+            grouped = np.zeros((len(group_keys),) + cells.shape[1:], dtype=cells.dtype)
+            np.add.at(grouped, group_of_cause.reshape(-1), cells)
+            cells = grouped
+        else:
+            group_keys = None
+            cells = cells.sum(axis=0, keepdims=True)
+
+        total = int(cells.sum())
+        positions = np.argwhere(cells)
+        if len(positions) > MAX_GROUPS:
+            raise ValueError(f"La requête produit {len(positions)} groupes (au plus {MAX_GROUPS}) : "
+                             f"ajoutez des filtres ou retirez des dimensions de 'group_by'.")
+
+        groups = []
+        for position in positions:
+            group = {}
+            if group_keys is not None:
+                for column, code in zip(cause_group_columns, group_keys[position[0]]):
+                    group[column] = self._cause_levels[column][0][code]
+            for offset, axis in enumerate(kept_axes, start=1):
+                column = BREAKDOWN_COLUMNS[axis - 1]
+                group[column] = self.values[column][selection[axis][position[offset]]]
+            groups.append({**{column: group[column] for column in group_by}, 'deces': int(cells[tuple(position)])})
+        groups.sort(key=lambda group: [natural_key(group[column]) for column in group_by])
+        return total, groups
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'built_at': self.built_at,
+            'deces': self.total,
+            'causes': self.counts.shape[0],
+            'dimensions': {**{column: len(self._cause_levels[column][0]) for column in CAUSE_COLUMNS},
+                           **{column: len(self.values[column]) for column in BREAKDOWN_COLUMNS}},
+            'cells': int(np.prod(self.counts.shape)),
+            'source': self.source,
+        }
+
+
+class CubeBuilder:
+    """Ajoute des blocs au format du CSV à un cube (vide ou existant) et produit le cube suivant."""
+
+    def __init__(self, cube=None):
+        if cube is None:
+            self.causes = {column: [] for column in CAUSE_COLUMNS}
+            self.values = {column: [] for column in BREAKDOWN_COLUMNS}
+            self.counts = np.zeros((0,) * (1 + len(BREAKDOWN_COLUMNS)), dtype=np.int64)
+        else:
+            self.causes = {column: list(cube.causes[column]) for column in CAUSE_COLUMNS}
+            self.values = {column: list(cube.values[column]) for column in BREAKDOWN_COLUMNS}
+            self.counts = np.array(cube.counts, dtype=np.int64)
+        self._cause_codes = {cause: code for code, cause in enumerate(zip(*(self.causes[c] for c in CAUSE_COLUMNS)))}
+        self._codes = {column: {value: code for code, value in enumerate(self.values[column])}
+                       for column in BREAKDOWN_COLUMNS}
+        self.rows = 0
+
+    def add(self, frame):
+        if not len(frame):
+            return
+        frame = frame.assign(**{column: '' for column in DIMENSIONS if column not in frame.columns})
+        deaths = pd.to_numeric(frame[DEATHS_COLUMN], errors='coerce').fillna(0) \
+            if DEATHS_COLUMN in frame.columns else pd.Series(0, index=frame.index)
+        frame = frame.assign(_deces=deaths.astype('int64'))
+        # Réduction du bloc aux cellules distinctes avant de les coder
+        grouped = frame.groupby(DIMENSIONS, observed=True, dropna=False, sort=False)['_deces'].sum()
+
+        cells = [[] for _ in range(1 + len(BREAKDOWN_COLUMNS))]
+        for key in grouped.index:
+            texts = [_to_text(value) for value in key]
+            cells[0].append(self._code_cause(tuple(texts[:len(CAUSE_COLUMNS)])))
+            for axis, column in enumerate(BREAKDOWN_COLUMNS, start=1):
+                cells[axis].append(self._code(column, texts[len(CAUSE_COLUMNS) + axis - 1]))
+        self._grow()
+        np.add.at(self.counts, tuple(np.array(codes, dtype=np.int64) for codes in cells), grouped.to_numpy())
+        self.rows += len(frame)
+
+    def _code_cause(self, cause):
+        code = self._cause_codes.get(cause)
+        if code is None:
+            code = self._cause_codes[cause] = len(self._cause_codes)
+            for column, value in zip(CAUSE_COLUMNS, cause):
+                self.causes[column].append(value)
+        return code
+
+    def _code(self, column, value):
+        codes = self._codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+            self.values[column].append(value)
+        return code
+
+    def _grow(self):
+        shape = (len(self._cause_codes),) + tuple(len(self.values[column]) for column in BREAKDOWN_COLUMNS)
+        if shape != self.counts.shape:
+            counts = np.zeros(shape, dtype=np.int64)
+            counts[tuple(slice(0, size) for size in self.counts.shape)] = self.counts
+            self.counts = counts
+
+    def build(self, source):
+        self._grow()
+        return StatsCube(self.counts, self.causes, self.values, source, new_version(),
+                         time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+
+def refresh_cube(cube, csv_path=CSV_PATH, chunk_rows=CSV_CHUNK_ROWS):
+    """Cube à jour avec le CSV et mode utilisé : 'unchanged', 'append' (seules les lignes
+    ajoutées en fin de fichier sont lues) ou 'rebuild'.
+
+    Une dernière ligne sans fin de ligne est laissée pour le passage suivant.
+    """
+    path = os.path.abspath(csv_path)
+    source = cube.source if cube is not None else {}
+    end = _complete_length(path)
+    previous_bytes = source.get('bytes', 0) if source.get('path') == path else None
+    digest, previous_digest = _prefix_sha256(path, end, previous_bytes)
+
+    if previous_bytes is not None and end >= previous_bytes and previous_digest == source.get('sha256'):
+        if end == previous_bytes:
+            return cube, 'unchanged'
+        builder, start, mode, rows = CubeBuilder(cube), previous_bytes, 'append', source.get('rows', 0)
+    else:
+        builder, start, mode, rows = CubeBuilder(), 0, 'rebuild', 0
+
+    with open(path, 'rb') as f:
+        header = f.readline()
+        names = pd.read_csv(io.BytesIO(header), sep=';', nrows=0).columns.tolist()
+        start = max(start, len(header))
+        if end > start:
+            f.seek(start)
+            window = io.BufferedReader(_Window(f, end - start))
+            for chunk in pd.read_csv(window, sep=';', names=names, header=None, dtype=CSV_DTYPES,
+                                     chunksize=chunk_rows):
+                builder.add(chunk)
+
+    return builder.build({'path': path, 'bytes': end, 'sha256': digest, 'rows': rows + builder.rows}), mode
+
+
+def save_cube(cube, root_dir=DEFAULT_STATS_DIR):
+    """Écrit le tableau puis remplace le manifeste de manière atomique ; retire les tableaux précédents."""
+    os.makedirs(root_dir, exist_ok=True)
+    counts_name = f'counts-{cube.version}.npy'
+    tmp_path = os.path.join(root_dir, f'.tmp-{counts_name}')
+    np.save(tmp_path, np.asarray(cube.counts))
+    os.replace(tmp_path, os.path.join(root_dir, counts_name))
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'version': cube.version,
+        'built_at': cube.built_at,
+        'counts': counts_name,
+        'shape': list(cube.counts.shape),
+        'causes': cube.causes,
+        'values': cube.values,
+        'source': cube.source,
+    }
+    tmp_path = os.path.join(root_dir, '.tmp-manifest.json')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(root_dir, 'manifest.json'))
+
+    # Les workers qui ont encore l'ancien tableau en memmap gardent leur descripteur ouvert
+    for name in os.listdir(root_dir):
+        if name.startswith('counts-') and name != counts_name:
+            os.remove(os.path.join(root_dir, name))
+
+
+def cube_version(root_dir=DEFAULT_STATS_DIR):
+    try:
+        with open(os.path.join(root_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f).get('version')
+    except FileNotFoundError:
+        return None
+
+
+def load_cube(root_dir=DEFAULT_STATS_DIR, mmap_mode='r'):
+    """Cube persisté dans root_dir, ou None s'il n'y en a pas."""
+    try:
+        with open(os.path.join(root_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ArtifactError(f"Version de format du cube {manifest.get('format_version')} non supportée "
+                            f"(attendue : {FORMAT_VERSION}).")
+    counts = np.load(os.path.join(root_dir, manifest['counts']), mmap_mode=mmap_mode)
+    return StatsCube(counts, manifest['causes'], manifest['values'], manifest['source'], manifest['version'],
+                     manifest['built_at'])
+
+
+class CubeManager:
+    """Cube actif du service : rafraîchi depuis le CSV, persisté, et repris par les autres workers."""
+
+    def __init__(self, cube, root_dir=DEFAULT_STATS_DIR, csv_path=CSV_PATH, interval=RELOAD_INTERVAL):
+        self.current = cube
+        self.root_dir = root_dir
+        self.csv_path = csv_path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = threading.Event()
+        self.refreshes = 0
+        self.reloads = 0
+        self.last_refresh = None
+
+    @classmethod
+    def open(cls, root_dir=DEFAULT_STATS_DIR, csv_path=CSV_PATH, interval=RELOAD_INTERVAL):
+        """Charge le cube persisté puis le met à jour avec le CSV (sans relire ce qui est déjà agrégé)."""
+        try:
+            cube = load_cube(root_dir)
+        except (ArtifactError, OSError, ValueError, KeyError) as e:
+            logger.warning("Cube statistique ignoré, reconstruction : %s", e)
+            cube = None
+        manager = cls(cube, root_dir, csv_path, interval)
+        try:
+            manager.refresh()
+        except (OSError, ValueError) as e:
+            logger.warning("Impossible de mettre à jour le cube statistique depuis %s : %s", csv_path, e)
+        return manager
+
+    def ensure_started(self):
+        """Démarre la surveillance du cube persisté dans ce processus (une fois par worker)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self.interval > 0:
+                threading.Thread(target=self._watch, name='rag-stats-watch', daemon=True).start()
+            self._pid = os.getpid()
+
+    def refresh(self):
+        """Ajoute au cube les lignes nouvelles du CSV, publie et persiste le résultat ; retourne le compte rendu."""
+        start = time.perf_counter()
+        with artifact_lock(self.root_dir):
+            self._sync()
+            previous = self.current
+            cube, mode = refresh_cube(previous, self.csv_path)
+            if cube is not previous:
+                save_cube(cube, self.root_dir)
+                self.current = cube
+        self.refreshes += 1
+        previous_rows = previous.source.get('rows', 0) if previous is not None and mode == 'append' else 0
+        self.last_refresh = {
+            'at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'mode': mode,
+            'previous_version': previous.version if previous is not None else None,
+            'version': cube.version,
+            'rows_read': cube.source.get('rows', 0) - previous_rows if mode != 'unchanged' else 0,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+        }
+        logger.info("Cube statistique %s (%s) : %d lignes lues en %.1f ms", cube.version, mode,
+                    self.last_refresh['rows_read'], self.last_refresh['duration_ms'])
+        return self.last_refresh
+
+    def _sync(self):
+        """Recharge le cube persisté si un autre processus l'a changé."""
+        version = cube_version(self.root_dir)
+        current = self.current
+        if version is None or (current is not None and current.version == version):
+            return False
+        cube = load_cube(self.root_dir)
+        if cube is None:
+            return False
+        self.current = cube
+        self.reloads += 1
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sync()
+            except Exception as e:
+                logger.warning("Échec du rechargement du cube statistique, version conservée : %s", e)
+
+    def shutdown(self):
+        self._stop.set()
+
+
+def _filter_values(value):
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return [_to_text(item) for item in values]
+
+
+def _complete_length(path):
+    """Longueur du fichier jusqu'à la dernière fin de ligne incluse."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        position = size
+        while position > 0:
+            block = min(HASH_BLOCK_BYTES, position)
+            f.seek(position - block)
+            data = f.read(block)
+            newline = data.rfind(b'\n')
+            if newline >= 0:
+                return position - block + newline + 1
+            position -= block
+    return 0
+
+
+def _prefix_sha256(path, end, checkpoint=None):
+    """Empreintes des `end` premiers octets et des `checkpoint` premiers (None si hors fichier), en une lecture."""
+    digest = hashlib.sha256()
+    checkpoint_digest = digest.hexdigest() if checkpoint == 0 else None
+    position = 0
+    with open(path, 'rb') as f:
+        while position < end:
+            size = min(HASH_BLOCK_BYTES, end - position)
+            if checkpoint is not None and position < checkpoint < position + size:
+                size = checkpoint - position
+            data = f.read(size)
+            if not data:
+                break
+            digest.update(data)
+            position += len(data)
+            if position == checkpoint:
+                checkpoint_digest = digest.hexdigest()
+    return digest.hexdigest(), checkpoint_digest
+
+
+class _Window(io.RawIOBase):
+    """Lecture de `length` octets d'un fichier à partir de sa position courante."""
+
+    def __init__(self, f, length):
+        self._f = f
+        self._remaining = max(length, 0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+        data = self._f.read(size)
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
@@ -0,0 +1,204 @@
+"""Mises à jour incrémentales de l'index : ajouts, suppressions et fusion des segments.
+
+Chaque opération retourne une nouvelle génération (RagIndex) sans modifier la
+précédente : les segments inchangés sont partagés, et la génération en cours
+reste interrogeable jusqu'à ce que la nouvelle la remplace.
+
+Entre deux fusions, l'idf des termes connus est figé. Les lignes ajoutées
+sont pondérées avec l'idf de la génération et rejoignent le segment delta :
+leurs scores restent comparables à ceux du segment de base. Les termes
+nouveaux sont ajoutés en fin de vocabulaire, avec l'idf des statistiques du
+moment. Les fréquences documentaires sont, elles, tenues à jour à chaque
+opération. La fusion recalcule l'idf, repondère toutes les lignes vivantes,
+retire les termes qui n'apparaissent plus et retrie le vocabulaire : le
+segment obtenu est celui d'une reconstruction complète sur les mêmes lignes,
+aux arrondis près (les normes sont sommées dans un autre ordre).
+"""
+import logging
+import os
+import time
+
+import numpy as np
+from scipy import sparse
+
+from .index import RagIndex, Segment, new_segment_id, new_version, query_vectorizer, smooth_idf, vectorizer_params
+from .metadata import MetadataTable
+from .mortality import CAUSE_COLUMNS, dumps_stats, loads_stats, merge_stats
+
+logger = logging.getLogger(__name__)
+
+# Fusion dès que le delta et les lignes supprimées représentent cette part du segment de base...
+MERGE_RATIO = float(os.environ.get('RAG_MERGE_RATIO', 0.1))
+# ... et au moins ce nombre de lignes
+MERGE_MIN_ROWS = int(os.environ.get('RAG_MERGE_MIN_ROWS', 1000))
+
+
+def count_terms(analyzer, texts, terms, vocabulary):
+    """Matrice CSR des comptes de termes des textes, termes rangés par première occurrence
+    dans chaque ligne. Les termes inconnus sont ajoutés à la fin de terms et de vocabulary.
+    """
+    indptr = [0]
+    indices = []
+    data = []
+    for text in texts:
+        counts = {}
+        for token in analyzer(text):
+            column = vocabulary.get(token)
+            if column is None:
+                column = vocabulary[token] = len(terms)
+                terms.append(token)
+            counts[column] = counts.get(column, 0) + 1
+        indices.extend(counts)
+        data.extend(counts.values())
+        indptr.append(len(indices))
+    return sparse.csr_matrix(
+        (np.array(data, dtype=np.int64), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int32)),
+        shape=(len(texts), len(terms)),
+    )
+
+
+def add_rows(index, frame, pdf_report=None):
+    """Génération suivante avec les lignes de frame (processed_text, source et métadonnées) dans le delta."""
+    start = time.perf_counter()
+    vectorizer = index.vectorizer
+    terms = list(vectorizer.vocabulary)
+    known_terms = len(terms)
+    vocabulary = {term: column for column, term in enumerate(terms)}
+    counts = count_terms(vectorizer.build_analyzer(), frame['processed_text'].tolist(), terms, vocabulary)
+
+    document_frequencies = np.zeros(len(terms), dtype=np.int64)
+    document_frequencies[:known_terms] = index.document_frequencies
+    document_frequencies += np.bincount(counts.indices, minlength=len(terms))
+    n_docs = index.n_docs + counts.shape[0]
+
+    # idf de la génération pour les termes connus, statistiques à jour pour les nouveaux
+    idf = np.empty(len(terms), dtype=np.float64)
+    idf[:known_terms] = vectorizer.idf_
+    idf[known_terms:] = smooth_idf(document_frequencies[known_terms:], n_docs)
+
+    metadata = MetadataTable.from_frame(frame)
+    deleted = np.zeros(counts.shape[0], dtype=bool)
+    delta = index.delta
+    if delta is not None:
+        # Le delta est reconstruit avec les nouvelles lignes ; ses lignes existantes gardent leurs poids
+        counts = sparse.vstack([_with_terms(delta.counts, len(terms)), counts], format='csr')
+        metadata = MetadataTable.concat([delta.metadata, metadata])
+        if delta.deleted is not None:
+            deleted = np.concatenate([delta.deleted, deleted])
+    segment = Segment.from_counts(new_segment_id(), counts, metadata, idf).with_deleted(deleted)
+
+    build_report = index.build_report
+    if pdf_report:
+        build_report = dict(build_report, pdf_extraction=build_report.get('pdf_extraction', []) + pdf_report)
+    updated = RagIndex(query_vectorizer(terms, idf, vectorizer_params(vectorizer)), [index.base, segment],
+                       document_frequencies, n_docs, new_version(), 'update', build_report, index.generation + 1)
+    logger.info("Ajout de %d lignes (%d nouveaux termes) en %.1f ms, delta : %d lignes",
+                len(frame), len(terms) - known_terms, (time.perf_counter() - start) * 1000, len(segment))
+    return updated
+
+
+def delete_rows(index, filters):
+    """Génération suivante où les lignes dont les métadonnées valent filters sont supprimées.
+
+    Retourne (génération, nombre de lignes supprimées) ; sans ligne concernée, l'index est retourné tel quel.
+    """
+    if not filters:
+        raise ValueError("Une suppression doit préciser au moins un filtre.")
+    document_frequencies = index.document_frequencies.copy()
+    segments = []
+    removed = 0
+    for segment in index.segments:
+        matched = _live_matching(segment, filters)
+        rows = np.flatnonzero(matched)
+        if len(rows) == 0:
+            segments.append(segment)
+            continue
+        document_frequencies[:segment.n_terms] -= np.bincount(segment.counts[rows].indices,
+                                                              minlength=segment.n_terms)
+        segments.append(segment.with_deleted(matched if segment.deleted is None else segment.deleted | matched))
+        removed += len(rows)
+    if not removed:
+        return index, 0
+    updated = RagIndex(index.vectorizer, segments, document_frequencies, index.n_docs - removed, new_version(),
+                       'update', index.build_report, index.generation + 1)
+    logger.info("Suppression de %d lignes (filtres %s)", removed, filters)
+    return updated, removed
+
+
+def fold_causes(index, frame):
+    """Reporte dans les lignes CSV de frame (une par cause) les comptes des mêmes causes déjà
+    indexées, et supprime ces lignes de l'index : chaque cause garde une seule ligne.
+
+    Retourne (génération, lignes de frame mises à jour) ; frame est modifié en place.
+    """
+    if 'stats' not in frame.columns:
+        return index, 0
+    folded = 0
+    for position in np.flatnonzero((frame['source'] == 'csv').to_numpy()):
+        filters = {'source': 'csv', **{column: frame[column].iat[position] for column in CAUSE_COLUMNS}}
+        previous = [loads_stats(segment.metadata.columns['stats'][row])
+                    for segment in index.segments for row in np.flatnonzero(_live_matching(segment, filters))]
+        if not previous:
+            continue
+        column = frame.columns.get_loc('stats')
+        frame.iat[position, column] = dumps_stats(merge_stats(loads_stats(frame.iat[position, column]), *previous))
+        index, _ = delete_rows(index, filters)
+        folded += 1
+    return index, folded
+
+
+def merge(index):
+    """Génération à un seul segment : lignes vivantes de tous les segments, idf recalculé."""
+    start = time.perf_counter()
+    all_terms = index.vectorizer.vocabulary
+    counts_parts, metadata_parts = [], []
+    for segment in index.segments:
+        counts, metadata = _with_terms(segment.counts, len(all_terms)), segment.metadata
+        if segment.deleted is not None:
+            rows = np.flatnonzero(segment.live_mask)
+            counts, metadata = counts[rows], metadata.take(rows)
+        counts_parts.append(counts)
+        metadata_parts.append(metadata)
+    counts = sparse.vstack(counts_parts, format='csr')
+
+    # Vocabulaire réduit aux termes encore présents, trié comme celui de CountVectorizer
+    used = np.flatnonzero(np.bincount(counts.indices, minlength=len(all_terms)))
+    kept = sorted(used.tolist(), key=all_terms.__getitem__)
+    columns = np.full(len(all_terms), -1, dtype=np.int64)
+    columns[kept] = np.arange(len(kept))
+    counts = sparse.csr_matrix(
+        (np.array(counts.data), columns[counts.indices].astype(np.int32), np.array(counts.indptr)),
+        shape=(counts.shape[0], len(kept)),
+    )
+
+    merged = RagIndex.from_counts([all_terms[column] for column in kept], counts,
+                                  MetadataTable.concat(metadata_parts), vectorizer_params(index.vectorizer),
+                                  new_version(), 'update', index.build_report, index.generation + 1)
+    logger.info("Fusion de %d segments en %.1f ms : %d lignes, %d termes",
+                len(index.segments), (time.perf_counter() - start) * 1000, len(merged), merged.terms)
+    return merged
+
+
+def pending_rows(index):
+    """Lignes à reprendre à la prochaine fusion : delta et lignes supprimées."""
+    delta_rows = len(index.delta) if index.delta is not None else 0
+    return delta_rows + sum(len(segment) - segment.live_rows for segment in index.segments)
+
+
+def needs_merge(index, ratio=MERGE_RATIO, min_rows=MERGE_MIN_ROWS):
+    pending = pending_rows(index)
+    return pending > 0 and pending >= max(min_rows, ratio * len(index.base))
+
+
+def _live_matching(segment, filters):
+    matched = segment.metadata.matching(filters)
+    if segment.deleted is not None:
+        matched &= ~segment.deleted
+    return matched
+
+
+def _with_terms(matrix, n_terms):
+    """Même matrice de comptes, élargie à n_terms colonnes (les termes ajoutés depuis sont absents)."""
+    if matrix.shape[1] == n_terms:
+        return matrix
+    return sparse.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], n_terms))
@@ -0,0 +1 @@
+"""Code commun aux services diagnosis-service et rag-service."""
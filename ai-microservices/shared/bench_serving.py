@@ -0,0 +1,129 @@
+"""Débit du service RAG sous gunicorn selon le nombre de workers.
+
+Usage (depuis ai-microservices/, gunicorn installé) :
+    python -m shared.bench_serving [--workers 1,2,4] [--clients 16] [--duration 10]
+
+Pour chaque nombre de workers, lance `gunicorn -c gunicorn.conf.py app:app`
+dans rag-service avec le cache de requêtes désactivé (RAG_CACHE_SIZE=0), attend
+/readyz, puis envoie pendant --duration secondes des requêtes /rag variées
+depuis --clients processus clients. Affiche requêtes/s et latences p50/p99.
+Les clients tournent sur la même machine : sur peu de cœurs, ils prennent une
+part du CPU aux workers, et le gain mesuré est une borne basse.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAG_SERVICE_DIR = os.path.join(ROOT_DIR, 'rag-service')
+
+QUERIES = [
+    "maladie coronarienne", "insuffisance cardiaque", "tumeur maligne du poumon", "diabète sucré",
+    "accident vasculaire cérébral", "pneumonie", "cirrhose du foie", "insuffisance rénale chronique",
+    "septicémie", "hypertension artérielle", "asthme", "leucémie", "tuberculose", "infarctus du myocarde",
+    "bronchite chronique", "maladie d'Alzheimer", "cancer du sein", "hépatite virale", "grippe", "anémie",
+]
+
+
+def wait_ready(base_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/readyz", timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def client(base_url, client_id, duration, results):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    i = client_id
+    while time.monotonic() < deadline:
+        # Requêtes variées : mot-clé différent et k différent à chaque appel
+        body = json.dumps({"query": f"{QUERIES[i % len(QUERIES)]} {i}", "k": 1 + i % 5}).encode('utf-8')
+        request = urllib.request.Request(f"{base_url}/rag", data=body, headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+            latencies.append(time.perf_counter() - start)
+        except (urllib.error.URLError, ConnectionError, OSError):
+            errors += 1
+        i += 1
+    results.put((latencies, errors))
+
+
+def run(workers, args):
+    port = args.port
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), BIND=f"127.0.0.1:{port}",
+               GUNICORN_THREADS=str(args.threads), RAG_CACHE_SIZE='0', LOG_LEVEL='WARNING')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                              cwd=RAG_SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(base_url, args.startup_timeout):
+            print(f"{workers} worker(s) : service non prêt après {args.startup_timeout} s")
+            return None
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client, args=(base_url, n, args.duration, results))
+                   for n in range(args.clients)]
+        for process in clients:
+            process.start()
+        outcomes = [results.get() for _ in clients]
+        for process in clients:
+            process.join()
+    finally:
+        # SIGTERM : arrêt propre, les requêtes en cours se terminent
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    latencies = sorted(latency for values, _ in outcomes for latency in values)
+    errors = sum(errors for _, errors in outcomes)
+    if not latencies:
+        print(f"{workers} worker(s) : aucune réponse ({errors} erreurs)")
+        return None
+    throughput = len(latencies) / args.duration
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{workers} worker(s) : {throughput:.1f} req/s, p50 {p50:.1f} ms, p99 {p99:.1f} ms, {errors} erreurs")
+    return throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default=f"1,{os.cpu_count() or 1}",
+                        help="Nombres de workers à mesurer, séparés par des virgules")
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=5102)
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cœur(s), {args.clients} clients, {args.threads} threads par worker, "
+          f"cache de requêtes désactivé.")
+    baseline = None
+    for workers in sorted({int(value) for value in args.workers.split(',')}):
+        throughput = run(workers, args)
+        if throughput is None:
+            continue
+        if baseline is None:
+            baseline = (workers, throughput)
+        else:
+            print(f"  x{throughput / baseline[1]:.2f} par rapport à {baseline[0]} worker(s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Micro-benchmark de shared.text_normalization contre l'ancien traitement NLTK.
+
+Usage (depuis ai-microservices/) :
+    python -m shared.bench_text_normalization [--repeat N]
+
+Vérifie d'abord que les deux implémentations donnent la même sortie sur les
+corpus du dépôt (maladies et symptômes, médecins, CSV de mortalité s'il est
+présent), puis mesure le temps à froid (cache vidé) et à chaud (mémoïsé).
+NLTK et ses données punkt/stopwords ne sont nécessaires que pour la comparaison.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+
+from shared import text_normalization
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_corpus():
+    texts = []
+    with open(os.path.join(ROOT_DIR, 'diagnosis-service', 'diseases_symptoms.json'), 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    for disease, symptoms in data['diseases'].items():
+        texts.append(disease)
+        texts.append(' '.join(symptoms))
+        texts.extend(symptoms)
+    texts.extend(data.get('symptoms', []))
+
+    with open(os.path.join(ROOT_DIR, 'diagnosis-service', 'doctors.json'), 'r', encoding='utf-8') as f:
+        texts.extend(doctor['specialty'] for doctor in json.load(f))
+
+    csv_path = os.path.join(ROOT_DIR, '..', 'src', 'app', 'data', 'Data in text format (CSV).csv')
+    if os.path.exists(csv_path):
+        import pandas as pd
+        df = pd.read_csv(csv_path, sep=';').fillna('')
+        texts.extend((df['cause_initiale_classe'] + ' ' + df['cause_initiale_bloc'] + ' '
+                      + df['cause_initiale_chapitre']).tolist())
+    return texts
+
+
+def nltk_reference():
+    """Anciennes implémentations NLTK, ou None si NLTK ou ses données sont absents."""
+    try:
+        from nltk.corpus import stopwords
+        from nltk.tokenize import word_tokenize
+        stop_words = set(stopwords.words('french'))
+        word_tokenize('test', language='french')
+    except (ImportError, LookupError) as e:
+        print(f"Comparaison NLTK ignorée : {e.__class__.__name__}")
+        return None
+
+    def preprocess_text(text):
+        text = text.lower()
+        text = re.sub(r'\W', ' ', text)
+        tokens = word_tokenize(text, language='french')
+        return ' '.join(word for word in tokens if word.isalpha() and word not in stop_words)
+
+    def normalize_string(text):
+        text = ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
+        text = text.lower()
+        text = re.sub(r'\W', ' ', text)
+        tokens = word_tokenize(text, language='french')
+        return ' '.join(word for word in tokens if word.isalpha() and word not in stop_words)
+
+    return {'preprocess_text': preprocess_text, 'normalize_string': normalize_string}
+
+
+def timed(function, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            function(text)
+    return (time.perf_counter() - start) / (repeat * len(texts)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    texts = load_corpus()
+    print(f"Corpus : {len(texts)} textes ({len(set(texts))} distincts).")
+    reference = nltk_reference()
+
+    failed = False
+    for name in ('preprocess_text', 'normalize_string'):
+        cached = getattr(text_normalization, f'_cached_{name}')
+        uncached = getattr(text_normalization, f'_{name}')
+
+        if reference is not None:
+            differences = [text for text in texts if uncached(text) != reference[name](text)]
+            status = 'identique' if not differences else f'{len(differences)} différences'
+            print(f"{name} : sortie {status} à celle de NLTK.")
+            for text in differences[:5]:
+                print(f"  {text!r}: {uncached(text)!r} != {reference[name](text)!r}")
+            failed = failed or bool(differences)
+
+        line = f"{name} : {timed(uncached, texts, args.repeat):.2f} µs/texte à froid"
+        cached.cache_clear()
+        cached_time = timed(cached, texts, args.repeat)
+        line += f", {cached_time:.2f} µs/texte mémoïsé"
+        if reference is not None:
+            line += f", NLTK {timed(reference[name], texts, args.repeat):.2f} µs/texte"
+        print(line)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
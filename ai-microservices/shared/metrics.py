@@ -0,0 +1,302 @@
+"""Métriques des services au format texte de Prometheus, sans dépendance.
+
+Histogrammes de durée, compteurs et jauges sont tenus en mémoire dans chaque
+processus : une observation coûte un verrou, une recherche dichotomique dans
+les bornes et trois additions. GET /metrics (voir instrument_app) les rend au
+format d'exposition texte 0.0.4.
+
+Avec plusieurs workers gunicorn, une requête /metrics n'est servie que par
+l'un d'eux. Si METRICS_DIR est défini, chaque worker y écrit l'état de ses
+compteurs et histogrammes (au plus toutes les METRICS_FLUSH_INTERVAL secondes,
+à la fin d'une requête) et /metrics additionne ceux de tous les workers. Le
+dossier est vidé par le processus maître au démarrage de gunicorn (serving.py)
+et l'état d'un worker qui s'arrête y reste : les compteurs ne reculent pas
+quand gunicorn remplace un worker.
+
+Les jauges sont calculées à la demande (callback) par le worker qui répond :
+elles décrivent ce processus, ou un état partagé (base SQLite) quand la
+source l'est.
+"""
+import bisect
+import glob
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# Bornes (en secondes) adaptées aux étapes d'une requête : de la demi-milliseconde au LLM
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Étiquettes attendues : {', '.join(labelnames) or 'aucune'} (reçues : {', '.join(labels)}).")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = [*zip(labelnames, key), *extra]
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {key: value for key, value in self._values.items()}
+
+    @staticmethod
+    def merge(total, values):
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+        return total
+
+    def render(self, values):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram:
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # Par jeu d'étiquettes : [effectifs par borne (dernier : au-delà), somme]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][position] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe la durée du bloc, exceptions comprises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: [list(counts), total] for key, (counts, total) in self._values.items()}
+
+    @staticmethod
+    def merge(total, values):
+        for key, (counts, value_sum) in values.items():
+            state = total.get(key)
+            if state is None:
+                total[key] = [list(counts), value_sum]
+            else:
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += value_sum
+        return total
+
+    def render(self, values):
+        lines = []
+        for key, (counts, value_sum) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(value_sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Jauge calculée à chaque rendu : callback() retourne une valeur, ou {étiquettes: valeur}."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def snapshot(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return {(key if isinstance(key, tuple) else (key,)): value
+                for key, value in values.items() if value is not None}
+
+    def render(self, values):
+        return [f"{self.name}{_format_labels(self.labelnames, tuple(map(str, key)))} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Registry:
+
+    def __init__(self, metrics_dir=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Métrique {metric.name} déjà déclarée avec un autre type ou d'autres étiquettes.")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        return self._register(Gauge(name, documentation, callback, labelnames))
+
+    def reset_dir(self):
+        """Supprime les états laissés par une exécution précédente (processus maître, avant le fork)."""
+        if self.metrics_dir:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            for path in glob.glob(os.path.join(self.metrics_dir, 'metrics-*.json')):
+                os.remove(path)
+
+    def _snapshot(self):
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items())
+                if not isinstance(metric, Gauge)}
+
+    def flush(self, force=False):
+        """Écrit l'état de ce processus dans METRICS_DIR (au plus une fois par intervalle, sauf force)."""
+        if not self.metrics_dir:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        payload = {name: [[list(key), value] for key, value in values.items()]
+                   for name, values in self._snapshot().items()}
+        path = os.path.join(self.metrics_dir, f'metrics-{os.getpid()}.json')
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Les métriques ne doivent jamais faire échouer une requête
+            pass
+
+    def _collect(self):
+        """État de tous les processus : celui-ci en direct, les autres depuis leurs fichiers."""
+        totals = self._snapshot()
+        if not self.metrics_dir:
+            return totals
+        own_path = os.path.join(self.metrics_dir, f'metrics-{os.getpid()}.json')
+        for path in glob.glob(os.path.join(self.metrics_dir, 'metrics-*.json')):
+            if path == own_path:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    payload = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, items in payload.items():
+                metric = self._metrics.get(name)
+                if metric is None or isinstance(metric, Gauge):
+                    continue
+                metric.merge(totals.setdefault(name, {}), {tuple(key): value for key, value in items})
+        return totals
+
+    def render(self):
+        totals = self._collect()
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            try:
+                values = totals.get(name, {}) if not isinstance(metric, Gauge) else metric.snapshot()
+            except Exception:
+                # Une jauge dont la source est indisponible est simplement omise
+                continue
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(values))
+        return "\n".join(lines) + "\n"
+
+
+# Registre du processus, partagé par les modules d'un service (comme les loggers)
+REGISTRY = Registry()
+
+
+def instrument_app(app, registry=REGISTRY):
+    """Durée des requêtes par route et statut, et route GET /metrics."""
+    from flask import Response, g, request
+
+    request_seconds = registry.histogram('http_request_duration_seconds',
+                                         "Durée de traitement des requêtes HTTP (jusqu'au début de la réponse).",
+                                         ('method', 'endpoint', 'status'))
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'inconnu'
+            request_seconds.observe(time.perf_counter() - start, method=request.method, endpoint=endpoint,
+                                    status=str(response.status_code))
+            registry.flush()
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        registry.flush(force=True)
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+    return request_seconds
@@ -0,0 +1,328 @@
+"""Profilage à la demande des requêtes, commun aux deux services.
+
+Une requête est profilée si un administrateur le demande (en-tête
+X-Profile: sample ou cprofile, avec X-Admin-Token) ou, pour les routes de
+recherche et de diagnostic, tirée au sort avec la probabilité
+PROFILE_SAMPLE_RATE (0 par défaut). Sans profilage, le seul coût par requête
+est la lecture d'un en-tête : aucun profileur n'est installé.
+
+Deux modes :
+
+- sample : un thread relève la pile du thread de la requête toutes les
+  PROFILE_INTERVAL secondes ; le résultat est au format « collapsed stacks »
+  (une pile par ligne, cadres séparés par « ; », puis le nombre
+  d'échantillons), lu directement par flamegraph.pl ou speedscope ;
+- cprofile : profil déterministe de cProfile, téléchargeable au format
+  pstats (.prof, pour snakeviz) ou en résumé texte. Un seul à la fois par
+  processus ; une demande concurrente est profilée en mode sample.
+
+Le profil couvre la requête jusqu'à la fin de l'envoi de la réponse, flux
+SSE compris, mais pas les threads du pool de parallélisation (appels RAG,
+médecins). Les PROFILE_BUFFER_SIZE derniers profils sont gardés en mémoire,
+ou dans PROFILE_DIR (partagé par les workers gunicorn) s'il est défini, et
+consultables par GET /admin/profiles.
+"""
+import cProfile
+import collections
+import glob
+import io
+import json
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'sample')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_BUFFER_SIZE = int(os.environ.get('PROFILE_BUFFER_SIZE', 20))
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or None
+
+MODES = ('sample', 'cprofile')
+# Lignes du résumé texte d'un profil cProfile
+SUMMARY_LINES = 40
+
+
+class StackSampler:
+    """Échantillonne la pile d'un thread jusqu'à stop() ; stacks() au format collapsed."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+                frame = frame.f_back
+            self.counts[";".join(reversed(names))] += 1
+
+    def stacks(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+class ProfileSession:
+    """Profil d'une requête en cours ; finish() retourne (métadonnées, artefacts)."""
+
+    def __init__(self, mode, trigger, method, path, interval=PROFILE_INTERVAL):
+        self.mode = mode
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.metadata = {'id': self.id, 'mode': mode, 'trigger': trigger, 'method': method, 'path': path,
+                         'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'pid': os.getpid()}
+        self._interval = interval
+        self._sampler = None
+        self._profile = None
+        self._start = None
+
+    def start(self):
+        self._start = time.perf_counter()
+        if self.mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = StackSampler(threading.get_ident(), self._interval).start()
+        return self
+
+    def finish(self, status=None):
+        duration = time.perf_counter() - self._start
+        metadata = dict(self.metadata, status=status, duration_ms=round(duration * 1000, 1))
+        if self._profile is not None:
+            self._profile.disable()
+            summary = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=summary)
+            # Même contenu que Stats.dump_stats : lisible par pstats et snakeviz
+            prof = marshal.dumps(stats.stats)
+            stats.sort_stats('cumulative').print_stats(SUMMARY_LINES)
+            artifacts = {'prof': prof, 'txt': summary.getvalue().encode('utf-8')}
+            metadata['functions'] = len(stats.stats)
+        else:
+            self._sampler.stop()
+            artifacts = {'folded': self._sampler.stacks().encode('utf-8')}
+            metadata['samples'] = sum(self._sampler.counts.values())
+            metadata['interval_seconds'] = self._interval
+        return metadata, artifacts
+
+
+class MemoryProfileStore:
+    """Derniers profils de ce processus (tampon circulaire)."""
+
+    def __init__(self, max_profiles=PROFILE_BUFFER_SIZE):
+        self._lock = threading.Lock()
+        self._profiles = collections.OrderedDict()
+        self.max_profiles = max_profiles
+
+    def add(self, metadata, artifacts):
+        with self._lock:
+            self._profiles[metadata['id']] = (metadata, artifacts)
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def list(self):
+        with self._lock:
+            return [metadata for metadata, _ in reversed(self._profiles.values())]
+
+    def artifact(self, profile_id, kind):
+        with self._lock:
+            entry = self._profiles.get(profile_id)
+        return entry[1].get(kind) if entry is not None else None
+
+
+class DirectoryProfileStore:
+    """Derniers profils de tous les workers, dans un dossier : <id>.json et un fichier par artefact."""
+
+    def __init__(self, path=PROFILE_DIR, max_profiles=PROFILE_BUFFER_SIZE):
+        self.path = path
+        self.max_profiles = max_profiles
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, metadata, artifacts):
+        for kind, payload in artifacts.items():
+            self._write(f"{metadata['id']}.{kind}", payload)
+        # Métadonnées en dernier : un profil listé a tous ses artefacts
+        self._write(f"{metadata['id']}.json", json.dumps(metadata).encode('utf-8'))
+        for stale in self._ids()[self.max_profiles:]:
+            for path in glob.glob(os.path.join(self.path, f"{stale}.*")):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def list(self):
+        profiles = []
+        for profile_id in self._ids():
+            try:
+                with open(os.path.join(self.path, f"{profile_id}.json"), 'r', encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def artifact(self, profile_id, kind):
+        if profile_id not in self._ids():
+            return None
+        try:
+            with open(os.path.join(self.path, f"{profile_id}.{kind}"), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _ids(self):
+        """Identifiants des profils, du plus récent au plus ancien (date d'écriture des métadonnées)."""
+        entries = []
+        for path in glob.glob(os.path.join(self.path, '*.json')):
+            try:
+                entries.append((os.stat(path).st_mtime_ns, os.path.basename(path)[:-len('.json')]))
+            except OSError:
+                continue
+        return [profile_id for _, profile_id in sorted(entries, reverse=True)]
+
+    def _write(self, name, payload):
+        path = os.path.join(self.path, name)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+
+class Profiler:
+
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, mode=PROFILE_MODE, interval=PROFILE_INTERVAL, store=None):
+        if mode not in MODES:
+            raise ValueError(f"PROFILE_MODE inconnu : {mode!r} (attendu : {' ou '.join(MODES)})")
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.interval = interval
+        self.store = store or (DirectoryProfileStore() if PROFILE_DIR else MemoryProfileStore())
+        # cProfile ne peut profiler qu'une requête à la fois dans un processus
+        self._cprofile_lock = threading.Lock()
+        self.captured = 0
+        self.errors = 0
+
+    def start(self, mode, trigger, method, path):
+        if mode == 'cprofile':
+            if self._cprofile_lock.acquire(blocking=False):
+                try:
+                    return ProfileSession(mode, trigger, method, path, self.interval).start()
+                except ValueError:
+                    # Un autre outil de profilage est déjà actif dans le processus
+                    self._cprofile_lock.release()
+            mode = 'sample'
+        return ProfileSession(mode, trigger, method, path, self.interval).start()
+
+    def finish(self, session, status=None):
+        try:
+            metadata, artifacts = session.finish(status)
+        finally:
+            if session.mode == 'cprofile':
+                self._cprofile_lock.release()
+        try:
+            self.store.add(metadata, artifacts)
+        except OSError:
+            self.errors += 1
+            return None
+        self.captured += 1
+        return metadata
+
+    def stats(self):
+        return {'sample_rate': self.sample_rate, 'mode': self.mode, 'interval_seconds': self.interval,
+                'buffer_size': self.store.max_profiles, 'directory': getattr(self.store, 'path', None),
+                'captured': self.captured, 'errors': self.errors}
+
+
+# Type MIME et extension de téléchargement de chaque artefact
+ARTIFACT_TYPES = {
+    'folded': ('text/plain; charset=utf-8', 'folded'),
+    'prof': ('application/octet-stream', 'prof'),
+    'txt': ('text/plain; charset=utf-8', 'txt'),
+}
+
+
+def install_profiling(app, is_admin_request, sample_paths=(), profiler=None):
+    """Profilage des requêtes de `app` et routes GET /admin/profiles[/<id>[/<artefact>]].
+
+    `sample_paths` : routes concernées par le tirage au sort (PROFILE_SAMPLE_RATE).
+    """
+    from flask import Response, g, jsonify, request
+
+    profiler = profiler or Profiler()
+    sample_paths = frozenset(sample_paths)
+
+    def forbidden():
+        return jsonify({"error": "Accès réservé à l'administration."}), 403
+
+    @app.before_request
+    def start_profile():
+        requested = request.headers.get('X-Profile')
+        if requested is not None:
+            if not is_admin_request():
+                return None
+            trigger = 'admin'
+            mode = requested if requested in MODES else profiler.mode
+        elif profiler.sample_rate > 0 and request.path in sample_paths and random.random() < profiler.sample_rate:
+            trigger, mode = 'sampling', profiler.mode
+        else:
+            return None
+        g.profile_session = profiler.start(mode, trigger, request.method, request.path)
+        return None
+
+    @app.after_request
+    def attach_profile(response):
+        session = g.pop('profile_session', None)
+        if session is not None:
+            response.headers['X-Profile-Id'] = session.id
+            # Arrêt à la fermeture de la réponse : un flux SSE est profilé jusqu'au bout
+            status = response.status_code
+            response.call_on_close(lambda: profiler.finish(session, status))
+        return response
+
+    @app.teardown_request
+    def abort_profile(exc):
+        # Exception non gérée : after_request n'a pas été appelé
+        session = g.pop('profile_session', None)
+        if session is not None:
+            profiler.finish(session, 500)
+
+    @app.route('/admin/profiles', methods=['GET'])
+    def list_profiles():
+        if not is_admin_request():
+            return forbidden()
+        return jsonify({'profiler': profiler.stats(), 'profiles': profiler.store.list()})
+
+    @app.route('/admin/profiles/<profile_id>', methods=['GET'])
+    @app.route('/admin/profiles/<profile_id>/<kind>', methods=['GET'])
+    def download_profile(profile_id, kind=None):
+        if not is_admin_request():
+            return forbidden()
+        kinds = [kind] if kind is not None else ['folded', 'prof']
+        for candidate in kinds:
+            if candidate not in ARTIFACT_TYPES:
+                return jsonify({"error": f"Artefact inconnu : {candidate}. Valeurs possibles : "
+                                         f"{', '.join(ARTIFACT_TYPES)}."}), 400
+            payload = profiler.store.artifact(profile_id, candidate)
+            if payload is not None:
+                content_type, extension = ARTIFACT_TYPES[candidate]
+                return Response(payload, content_type=content_type, headers={
+                    'Content-Disposition': f'attachment; filename="{profile_id}.{extension}"'})
+        return jsonify({"error": "Profil introuvable."}), 404
+
+    return profiler
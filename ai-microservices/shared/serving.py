@@ -0,0 +1,69 @@
+"""Réglages gunicorn communs aux deux services (voir gunicorn.conf.py de chaque service).
+
+L'application est importée une seule fois dans le processus maître
+(preload_app) : modèle, index RAG et médecins sont chargés avant le fork et
+partagés en copie sur écriture par les workers. Juste avant le premier fork,
+gc.freeze() place tous ces objets dans la génération permanente du ramasse-
+miettes : les collectes des workers ne les parcourent plus, et ne réécrivent
+donc pas leurs en-têtes (ce qui dupliquerait les pages partagées).
+
+Au démarrage, le maître vide METRICS_DIR (voir metrics.py) ; à l'arrêt d'un
+worker, son état de métriques y est écrit une dernière fois.
+"""
+import gc
+import os
+import sys
+
+
+def default_workers():
+    """WEB_CONCURRENCY, sinon un worker par cœur."""
+    return int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+
+
+def settings(default_port):
+    """Réglages gunicorn, à injecter dans le module de configuration : globals().update(settings(...))."""
+    return {
+        'bind': os.environ.get('BIND', f"0.0.0.0:{default_port}"),
+        'workers': default_workers(),
+        # Threads par worker : les réponses SSE et les appels RAG/LLM attendent surtout des E/S
+        'worker_class': 'gthread',
+        'threads': int(os.environ.get('GUNICORN_THREADS', 4)),
+        'preload_app': True,
+        'timeout': int(os.environ.get('GUNICORN_TIMEOUT', 120)),
+        # Arrêt propre : les requêtes en cours ont ce délai pour se terminer après SIGTERM
+        'graceful_timeout': int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30)),
+        'keepalive': 5,
+        'max_requests': int(os.environ.get('GUNICORN_MAX_REQUESTS', 0)),
+        'max_requests_jitter': int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0)),
+        'accesslog': os.environ.get('GUNICORN_ACCESS_LOG'),
+        'on_starting': on_starting,
+        'pre_fork': pre_fork,
+        'worker_exit': worker_exit,
+    }
+
+
+_frozen = False
+
+
+def on_starting(server):
+    from shared.metrics import REGISTRY
+    REGISTRY.reset_dir()
+
+
+def pre_fork(server, worker):
+    global _frozen
+    if not _frozen:
+        gc.collect()
+        gc.freeze()
+        _frozen = True
+        server.log.info("Tas gelé avant le fork : %d objets partagés", gc.get_freeze_count())
+
+
+def worker_exit(server, worker):
+    # Chaque service peut exposer shutdown() pour libérer ses ressources (pools de threads...)
+    app_module = sys.modules.get('app')
+    shutdown = getattr(app_module, 'shutdown', None)
+    if shutdown is not None:
+        shutdown()
+    from shared.metrics import REGISTRY
+    REGISTRY.flush(force=True)
@@ -0,0 +1,104 @@
+"""Normalisation de texte commune aux deux services, sans NLTK au démarrage.
+
+Reproduit à l'identique l'ancien traitement NLTK (`re.sub(r'\\W', ' ', ...)` puis
+`word_tokenize(..., language='french')` et filtre des mots vides) :
+
+- après la suppression de la ponctuation, le texte ne contient plus que des
+  caractères de mot et des espaces ; `word_tokenize` se réduit alors à un
+  découpage sur les espaces, plus les quelques contractions anglaises que le
+  tokenizer Treebank sépare (« cannot » -> « can not »...) ;
+- la liste des mots vides français est celle du corpus `stopwords` de NLTK,
+  embarquée dans french_stopwords.txt : rien n'est téléchargé au démarrage.
+
+Les textes courts sont mémoïsés : symptômes, spécialités et requêtes se
+répètent. Les textes longs (passages de PDF) ne le sont pas pour ne pas
+garder le corpus en mémoire.
+"""
+import os
+import re
+import unicodedata
+from functools import lru_cache
+
+_STOPWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'french_stopwords.txt')
+
+with open(_STOPWORDS_PATH, 'r', encoding='utf-8') as _f:
+    FRENCH_STOP_WORDS = frozenset(line.strip() for line in _f if line.strip())
+
+# Suites de caractères de mot : équivalent de re.sub(r'\W', ' ', text).split()
+_WORD_RE = re.compile(r'\w+')
+
+# Contractions que le tokenizer Treebank de NLTK découpe même sans apostrophe
+_TREEBANK_SPLITS = {
+    'cannot': ('can', 'not'),
+    'gimme': ('gim', 'me'),
+    'gonna': ('gon', 'na'),
+    'gotta': ('got', 'ta'),
+    'lemme': ('lem', 'me'),
+    'wanna': ('wan', 'na'),
+}
+
+CACHE_SIZE = int(os.environ.get('TEXT_NORMALIZATION_CACHE_SIZE', 65536))
+# Au-delà de cette longueur, le résultat n'est pas mis en cache
+CACHE_MAX_CHARS = 512
+
+
+class _CombiningMarkTable(dict):
+    """Table de str.translate qui supprime les diacritiques (catégorie Mn), remplie à la demande."""
+
+    def __missing__(self, codepoint):
+        value = None if unicodedata.category(chr(codepoint)) == 'Mn' else codepoint
+        self[codepoint] = value
+        return value
+
+
+_COMBINING_MARKS = _CombiningMarkTable()
+
+
+def strip_accents(text):
+    if text.isascii():
+        return text
+    return unicodedata.normalize('NFD', text).translate(_COMBINING_MARKS)
+
+
+def tokenize(text):
+    """Mots alphabétiques non vides de `text` (déjà en minuscules), dans l'ordre."""
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        split = _TREEBANK_SPLITS.get(word)
+        for token in split or (word,):
+            if token.isalpha() and token not in FRENCH_STOP_WORDS:
+                tokens.append(token)
+    return tokens
+
+
+def preprocess_text(text):
+    """Prétraitement du service RAG : minuscules, ponctuation, mots vides (accents conservés)."""
+    if len(text) > CACHE_MAX_CHARS:
+        return _preprocess_text(text)
+    return _cached_preprocess_text(text)
+
+
+def normalize_string(text):
+    """Normalisation du service de diagnostic : comme preprocess_text, accents supprimés d'abord."""
+    if len(text) > CACHE_MAX_CHARS:
+        return _normalize_string(text)
+    return _cached_normalize_string(text)
+
+
+def _preprocess_text(text):
+    return ' '.join(tokenize(text.lower()))
+
+
+def _normalize_string(text):
+    return ' '.join(tokenize(strip_accents(text).lower()))
+
+
+_cached_preprocess_text = lru_cache(maxsize=CACHE_SIZE)(_preprocess_text)
+_cached_normalize_string = lru_cache(maxsize=CACHE_SIZE)(_normalize_string)
+
+
+def cache_info():
+    return {
+        'preprocess_text': _cached_preprocess_text.cache_info()._asdict(),
+        'normalize_string': _cached_normalize_string.cache_info()._asdict(),
+    }